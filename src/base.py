@@ -6,19 +6,25 @@ __author__ = "Srijan Saxena"
 __email__ = "srijan@loratechai.com"
 
 # Import dependancies
+import asyncio
 import json
 from logging import Logger
 import os
 import time
-from functools import wraps
-from typing import Dict, Generator
-from dataclasses import asdict
+import aiohttp
+import requests
+from collections import Counter
+from functools import partial, wraps
+from itertools import islice
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Union
 from historydb.redislease import RedisLease
-from utils.database_utils import connect_to_mongodb, bulk_migrate_to_es
-from res.models.datamodels import ESAction, ESDoc
+from historydb.bloomfilter import TimedBloomFilter
+from utils.database_utils import BufferedMongoWriter, connect_to_mongodb, ensure_unique_index, bulk_migrate_to_es
 from abc import ABC, abstractmethod
 from datetime import datetime
+from res.models.datamodels import BaseDoc
 from utils.general_utils import get_configs
+from utils.http_utils import AsyncFetcher, get_http_session
 
 # Lurkers
 from lurkers import *
@@ -39,15 +45,24 @@ class Lurker(ABC):
     """
     Abstract lurker class
     """
-    def __init__(self, subclass_config: dict, logger: Logger, test_mode: bool=False):
+    # Fields of the mongo documents read by get_text() (dotted for subfields), None reads whole documents
+    TEXT_FIELDS = None
+    # Fields of the mongo documents copied as is to the ES documents
+    ES_FIELDS = ['unique_identifier', 'tickers', 'sentiment', 'sector_code', 'source_link', 'time']
+
+    def __init__(self, subclass_config: dict, logger: Logger, test_mode: bool=False, session: requests.Session=None):
         """
         Initializes a Lurker Abstract Base class. Called only by subclasses.
 
         Args:
             logger (Logger): logger initialised by the subclass.
+            session (requests.Session, optional): HTTP session to scrape with. Defaults to the process-wide session.
         """
         self.logger = logger
 
+        # Pooled keep-alive HTTP session
+        self.session = session if session is not None else get_http_session()
+
         # self.logger.info("Connecting to microservices..")
         try:
             # Get Configs
@@ -72,7 +87,7 @@ class Lurker(ABC):
             setup_configs = get_configs('res/configs/setup-configs.yaml')
 
             # ElasticSearch Param
-            # self.ES_INDEX = subclass_config['es_index']
+            self.ES_INDEX = subclass_config.get('es_index')
 
             # Redis Params
             try:
@@ -87,20 +102,131 @@ class Lurker(ABC):
                 self.logger.error(e)
                 raise e
 
+            # History DB, shared by all the jobs of this lurker
+            prefilter_configs = setup_configs.get('redis_history_prefilter')
+            prefilter = TimedBloomFilter(**prefilter_configs) if prefilter_configs else None
+            self.history_db = RedisLease(name=self.REDIS_HISTORY_DB, host=self.REDIS_HOST, prefilter=prefilter)
+
             # Subclass Params
             self.SOURCE_CLASS = subclass_config['class']
 
+            # The database rejects duplicated documents too, in case the history db forgot them
+            ensure_unique_index(self.mongo_collection, 'unique_identifier', logger=self.logger)
+
+            # Background writer of the scraped documents, "insert" or "upsert" (insert only if new)
+            self.WRITE_MODE = subclass_config.get('write_mode', base_config.get('write_mode', 'insert'))
+            self._dry_run = False
+            self.writer = BufferedMongoWriter(
+                self.mongo_collection,
+                batch_size=subclass_config.get('write_batch_size', 500),
+                flush_secs=subclass_config.get('write_flush_secs', 5),
+                max_pending=subclass_config.get('write_max_pending', 2000),
+                logger=self.logger,
+                upsert=self.WRITE_MODE == 'upsert',
+                key='unique_identifier',
+                on_outcome=self._count_write_outcome
+            )
+
+            # Async Scrape Params
+            self.ASYNC_SCRAPE = subclass_config.get('async_scrape', False)
+            self.MAX_IN_FLIGHT = subclass_config.get('max_in_flight', 16)
+            self.PER_HOST_LIMIT = subclass_config.get('per_host_limit', 4)
+
+            # Async HTTP client of the lurker, with the same timeouts as the HTTP session
+            http_configs = setup_configs.get('http') or {}
+            self.fetcher = AsyncFetcher(
+                max_in_flight=self.MAX_IN_FLIGHT,
+                per_host_limit=self.PER_HOST_LIMIT,
+                connect_timeout_secs=http_configs.get('connect_timeout_secs', 10),
+                read_timeout_secs=http_configs.get('read_timeout_secs', 60)
+            )
+
             # Keep track of the job
-            self.successful_documents = []
-            self.successful_queries = [] 
-            self.failed_queries = []
-            self.skipped_queries = []
+            self.reset_job()
 
         except Exception as e:
             self.logger.error(e)
             raise e
 
 
+    def reset_job(self):
+        """
+        Clears the bookkeeping of the previous job.
+        """
+        self.successful_documents = []
+        self.successful_queries = [] 
+        self.failed_queries = []
+        self.skipped_queries = []
+        self._history_claims = {}
+        self.write_outcomes = Counter()
+
+    def set_task(self, payload: str):
+        """
+        Points a long-lived lurker at its next task. Subclasses parse the payload after calling this.
+
+        Args:
+            payload (str): payload of the work queue item (i.e. the ticker).
+        """
+        self.reset_job()
+
+    def add_document(self, doc: Union[dict, BaseDoc], query):
+        """
+        Stores a scraped document: it is queued to be written to mongodb, or kept in
+        self.successful_documents during a dryrun().
+
+        Args:
+            doc (Union[dict, BaseDoc]): the document, models are converted by the writer.
+            query: query the document was scraped from.
+        """
+        if self._dry_run:
+            self.successful_documents.append(doc)
+        else:
+            self.writer.add(doc)
+        self.successful_queries.append(query)
+
+    def _count_write_outcome(self, doc: dict, outcome: str):
+        """
+        Counts the outcome of writing a document of the job, called by self.writer.
+        """
+        self.write_outcomes[outcome] += 1
+
+    def close(self):
+        """
+        Writes the documents still waiting, stops the background writer and closes the async HTTP client.
+        """
+        self.writer.close()
+        self.fetcher.close()
+
+    @classmethod
+    def shard_payload(cls, payload: str, duration_days: int) -> List[str]:
+        """
+        Splits the task of a payload (i.e. a ticker) into sub-tasks that can run on different workers.
+        Lurkers whose tasks can straggle override this, and parse the shards in set_task().
+
+        Args:
+            payload (str): payload of the task (i.e. the ticker).
+            duration_days (int): how many days back the task scrapes.
+
+        Returns:
+            List[str]: payloads of the sub-tasks, the payload itself by default.
+        """
+        return [payload]
+
+    @classmethod
+    def window_secs(cls, payload: str) -> Optional[int]:
+        """
+        Returns the length of the time window a payload scrapes, for lurkers whose tasks each cover a
+        window relative to now (i.e. "<duration_hr>-<offset_hr>"). The task must run at least once
+        per window, or the window it skips is never scraped.
+
+        Args:
+            payload (str): payload of the task.
+
+        Returns:
+            int: length of the window in seconds, None if the task is not bound to a window.
+        """
+        return None
+
     @abstractmethod
     def scraper_iterator(self,ticker) -> Generator[str, bool, None]:
         """
@@ -139,6 +265,59 @@ class Lurker(ABC):
         """
         pass
 
+    async def get_document_async(self, query, fetcher: AsyncFetcher, **kwargs) -> bool:
+        """
+        Coroutine counterpart of get_document(), used by scrape() when async_scrape is enabled.
+        Runs get_document() in the default executor unless the subclass fetches with fetcher.
+
+        Args:
+            query (str): Query needed to scrape source.
+            fetcher (AsyncFetcher): Shared HTTP client bounding the requests in flight.
+
+        Returns:
+            bool: Successful
+        """
+        return await self.run_blocking(partial(self.get_document, query, **kwargs))
+
+    async def run_blocking(self, func, *args):
+        """
+        Runs a blocking call (e.g. a redis lookup) in the default executor so it does not stall the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    def fetch_page(self, url: str) -> Optional[bytes]:
+        """
+        GETs url with the HTTP session, trying up to NUM_RETRIES times.
+
+        Returns:
+            bytes: body of the page, None if it could not be fetched.
+        """
+        for _ in range(self.NUM_RETRIES):
+            try:
+                response = self.session.get(url)
+                if response.status_code == 200:
+                    return response.content
+            except requests.exceptions.RequestException as e:
+                self.logger.debug(f"Failed Request: {e}")
+        return None
+
+    async def fetch_page_async(self, url: str, fetcher: AsyncFetcher) -> Optional[bytes]:
+        """
+        Coroutine counterpart of fetch_page(), fetching with fetcher.
+
+        Returns:
+            bytes: body of the page, None if it could not be fetched.
+        """
+        for _ in range(self.NUM_RETRIES):
+            try:
+                status, body = await fetcher.get(url)
+                if status == 200:
+                    return body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.debug(f"Failed Request: {e}")
+        return None
+
     @abstractmethod
     def get_text(self, doc: Dict) -> str:
         """
@@ -152,48 +331,67 @@ class Lurker(ABC):
         """
         pass
     
-    def generate_es_actions(self) -> Generator[dict, None, None]:
+    def es_projection(self) -> dict:
+        """
+        Builds the projection of the mongo documents on the fields needed by es_action().
+
+        Returns:
+            dict: projection, None (whole documents) if the lurker does not declare TEXT_FIELDS.
+        """
+        if self.TEXT_FIELDS is None:
+            return None
+        return {field: True for field in self.ES_FIELDS + list(self.TEXT_FIELDS)}
+
+    def generate_es_actions(self, batch_size: int = 1000) -> Generator[dict, None, None]:
         """
         Generates Actions for ES Bulk Ingestion.
 
+        Args:
+            batch_size (int): number of documents per cursor batch.
+
         Yields:
             Generator[dict, None, None]: Action for ES Bulk Ingestion.
         """
-        cursor = self.mongo_collection.find({"just_insert": True})
+        cursor = self.mongo_collection.find({"just_insert": True}, projection=self.es_projection(), batch_size=batch_size)
         for item in cursor:
-            id = item['_id']
-            text = self.get_text(item)
-            
-            # for sector, some source will have 8 digits, some source will be 2,4,6,8 or none
-            # here we set the sector as a Integer for elasticsearch mapping
-            sector_code = item['sector_code']
-            # TODO: sector_code = int(sector) if sector != None and math.isnan(sector) == False else None
-
-            tickers = item['tickers'] # TODO: All subclasses have same ticker field
-            source_link = item['source_link'] #TODO: Add to subclass scrapers
-
-            if self.SOURCE_CLASS==1:
-                sentiment = 0
-                time = datetime.now()
-            else:
-                sentiment = item['sentiment']
-                time = item['time']
-
-            doc = ESDoc(
-                text= text,
-                tickers= tickers,
-                sentiment= sentiment,
-                sector_code= sector_code,
-                source_link= source_link,
-                time= time
-            )
+            yield self.es_action(item)
 
-            action = ESAction(
-                _id= id,
-                _source= doc
-            )
+    def es_action(self, item: dict) -> dict:
+        """
+        Builds the Action for ES Bulk Ingestion of a document of the mongo collection.
+        Built as a plain dict, with the layout of ESAction.
 
-            yield asdict(action)        
+        Args:
+            item (dict): document of the mongo collection, at least projected with es_projection().
+
+        Returns:
+            dict: Action for ES Bulk Ingestion.
+        """
+        # for sector, some source will have 8 digits, some source will be 2,4,6,8 or none
+        # here we set the sector as a Integer for elasticsearch mapping
+        # TODO: sector_code = int(sector) if sector != None and math.isnan(sector) == False else None
+
+        if self.SOURCE_CLASS==1:
+            sentiment = 0
+            time = datetime.now()
+        else:
+            sentiment = item['sentiment']
+            time = item['time']
+
+        return {
+            '_id': str(item['_id']),
+            '_source': {
+                'unique_identifier': item.get('unique_identifier'),
+                'tickers': item['tickers'], # TODO: All subclasses have same ticker field
+                'sentiment': sentiment,
+                'sector_code': item['sector_code'],
+                'source_link': item['source_link'], #TODO: Add to subclass scrapers
+                'time': time,
+                'text': self.get_text(item)
+            },
+            '_op_type': 'create',
+            'pipeline': 'add-timestamp'
+        }
 
     def hasScrapedDocument(self):
         return (self.getSuccessQueryNum() > 0) or (self.getFailedQueryNum() > 0) or (self.getSkippedQueryNum() > 0)
@@ -214,8 +412,68 @@ class Lurker(ABC):
 
         Return: unique_identifier if the article was added successfully, False otherwise.
         """
-        histroy_db = RedisLease(name=self.REDIS_HISTORY_DB, host=self.REDIS_HOST)
-        return histroy_db.tryAdd(unique_identifier,lease_secs=lease_secs)
+        # Outcome already known from claimArticles()
+        claimed = self._history_claims.pop(unique_identifier, None)
+        if claimed is not None:
+            return unique_identifier if claimed else False
+
+        return self.history_db.tryAdd(unique_identifier,lease_secs=lease_secs)
+
+    def claimArticle(self, query) -> Optional[str]:
+        """
+
+        Claims the article of query (see get_article_id() of the lurker) in the redis history database.
+        Articles claimed by another job are recorded as skipped.
+
+        Return: unique_identifier if the article was added successfully, None otherwise.
+        """
+        article_id = self.get_article_id(query)
+        if article_id is None:
+            return None
+
+        unique_identifier = self.tryAddArticleToHistory(article_id)
+        if not unique_identifier:
+            self.skipped_queries.append(query)
+            return None
+        return unique_identifier
+
+    def claimArticles(self, unique_identifiers: list, lease_secs: int = 604800) -> set:
+        """
+
+        Claims a whole listing page of articles in the redis history database in one round-trip.
+        The outcome is remembered, so tryAddArticleToHistory() does not hit redis again for these articles.
+
+        Return: the unique_identifiers that were added successfully.
+        """
+        added = set(self.history_db.tryAddMany(unique_identifiers, lease_secs=lease_secs))
+        for unique_identifier in unique_identifiers:
+            self._history_claims[unique_identifier] = unique_identifier in added
+        return added
+
+    def claimInBatches(self, queries: Iterable, get_id: Callable) -> Generator:
+        """
+
+        Yields the queries of a listing, claiming them with claimArticles() a batch at a time right before
+        they are scraped. A job that fails or stops early (i.e. dryrun()) only leaves the current batch
+        claimed but not scraped, instead of the whole listing for 7 days.
+
+        Batches are MAX_IN_FLIGHT queries, the number scrape_async() works on at once, and a single query
+        during a dryrun().
+
+        Args:
+            queries (Iterable): queries of the listing.
+            get_id (Callable): returns the unique identifier of a query, None to not claim it.
+
+        Yields:
+            queries, in order
+        """
+        queries = iter(queries)
+        while True:
+            batch = list(islice(queries, 1 if self._dry_run else self.MAX_IN_FLIGHT))
+            if not batch:
+                return
+            self.claimArticles([unique_identifier for unique_identifier in map(get_id, batch) if unique_identifier])
+            yield from batch
 
     def dryrun(self):
         """
@@ -234,11 +492,15 @@ class Lurker(ABC):
             # Get **kwargs for subclass scraper
             scraper_params = self.get_scraper_params()
 
-            # Get 1 document only
-            for query in scraper_iter:
-                success = self.get_document(query, **scraper_params)
-                if len(self.successful_documents) > 0:
-                    break
+            # Get 1 document only, kept in self.successful_documents
+            self._dry_run = True
+            try:
+                for query in scraper_iter:
+                    success = self.get_document(query, **scraper_params)
+                    if len(self.successful_documents) > 0:
+                        break
+            finally:
+                self._dry_run = False
 
             success_count = len(self.successful_queries)
             fail_count = len(self.failed_queries)
@@ -263,21 +525,24 @@ class Lurker(ABC):
             # Get **kwargs for subclass scraper
             scraper_params = self.get_scraper_params()
 
-            # Get documents
-            for query in scraper_iter:
-                success = self.get_document(query, **scraper_params)
-                
-            # Insert Data to mongodb database
+            # Get documents, they are written to mongodb by self.writer as they come
             try:
-                self.mongo_collection.insert_many(self.successful_documents, ordered=False)
-            except Exception as e:
-                self.logger.info(f"Payload failed to migrate to mongo.")
-                self.logger.debug(f"Failed Insertion into Mongo: {e}")
-
-            success_count = len(self.successful_queries)
+                if self.ASYNC_SCRAPE:
+                    self.fetcher.run(self.scrape_async(scraper_iter, scraper_params))
+                else:
+                    for query in scraper_iter:
+                        success = self.get_document(query, **scraper_params)
+            finally:
+                # Everything scraped is stored before the job is reported as done (or failed)
+                self.writer.flush()
+
+            # Counted from what the writer reported, not from the scraped queries
+            inserted = self.write_outcomes[BufferedMongoWriter.INSERTED]
+            duplicate = self.write_outcomes[BufferedMongoWriter.DUPLICATE]
+            failed = self.write_outcomes[BufferedMongoWriter.FAILED]
             fail_count = len(self.failed_queries)
 
-            self.logger.info(f'{source} fininshes running! {success_count} records inserted. {fail_count} records failed. ')
+            self.logger.info(f'{source} fininshes running! {inserted} records inserted. {duplicate} duplicate records. {failed} records failed. {fail_count} queries failed.')
 
             # Migrate to ES
             # self.logger.info("Migrating {num_docs} docs to ES...")
@@ -303,6 +568,30 @@ class Lurker(ABC):
         except Exception as e:
             raise e
 
+    async def scrape_async(self, scraper_iter, scraper_params: dict):
+        """
+        Drives get_document_async() over the queries of scraper_iter, with at most
+        MAX_IN_FLIGHT documents being scraped at once. Runs on the event loop of self.fetcher.
+
+        Args:
+            scraper_iter (Iterable): queries needed by get_document_async()
+            scraper_params (dict): **kwargs needed by scraper function.
+        """
+        # Some scrapers return a list, consumers must share a single iterator over it
+        scraper_iter = iter(scraper_iter)
+
+        async def consume():
+            # Every consumer pulls the next query from the shared iterator
+            for query in scraper_iter:
+                try:
+                    await self.get_document_async(query, self.fetcher, **scraper_params)
+                except Exception as e:
+                    self.logger.warning(f"Failed to scrape. {query}")
+                    self.logger.debug(f"Failed Scrape: {e}")
+                    self.failed_queries.append(query)
+
+        await asyncio.gather(*[consume() for _ in range(self.MAX_IN_FLIGHT)])
+
 
 """
 WIP Code
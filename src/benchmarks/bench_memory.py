@@ -0,0 +1,89 @@
+"""
+    Memory benchmark of the buffered documents
+
+    Compares the heap taken by buffered documents: instances of the previous models (dataclasses
+    with a __dict__), instances of the slotted models declared with mongo_doc(), which the writer
+    now buffers, and the mappings it buffered before, e.g.:
+        $ python -m benchmarks.bench_memory --docs 100000
+"""
+
+import argparse
+import gc
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Union
+
+from benchmarks.bench_serialization import BenchMongoDoc
+
+
+@dataclass
+class LegacyMongoDocBase:
+    """The previous models: dataclasses, mixed in with the defaults."""
+    unique_identifier: str
+    tickers: List[str]
+    sentiment: Union[float, None]
+    sector_code: int
+    source_link: Union[str, None]
+    time: datetime
+    source_id: str
+    text_hash: str
+    link: str
+    info: dict
+    title: str
+    text: str
+    keywords: list
+
+@dataclass
+class LegacyMongoDocDefaultsBase:
+    retrieval_time: datetime = field(default_factory=datetime.now)
+    just_insert: bool = True
+
+@dataclass
+class LegacyMongoDoc(LegacyMongoDocDefaultsBase, LegacyMongoDocBase):
+    pass
+
+def make_docs(cls: type, n: int) -> list:
+    """
+    Builds n documents with small, distinct fields, so that the per-document overhead dominates.
+    """
+    now = datetime.now()
+    return [
+        cls(
+            unique_identifier=str(i), tickers=['0700.HK'], sentiment=None, sector_code=2,
+            source_link=None, time=now, source_id=str(i), text_hash='', link='', info={},
+            title=str(i), text='', keywords=[]
+        )
+        for i in range(n)
+    ]
+
+def measure(build) -> int:
+    """
+    Returns:
+        int: bytes still allocated by build() once it returned.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    kept = build()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return end - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=100000, help='documents buffered')
+    args = parser.parse_args()
+
+    results = [
+        ('dataclass', measure(lambda: make_docs(LegacyMongoDoc, args.docs))),
+        ('slotted', measure(lambda: make_docs(BenchMongoDoc, args.docs))),
+        ('mapping', measure(lambda: [doc.to_document() for doc in make_docs(BenchMongoDoc, args.docs)])),
+    ]
+    baseline = results[0][1]
+    for name, size in results:
+        print(f"{name:<12} {size / 2**20:>8.1f} MiB  {size / args.docs:>6.0f} B/doc  x{size / baseline:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+    Micro-benchmark of the history db claims
+
+    Compares the claims/sec of RedisLease.tryAdd against the previous implementation
+    (EXISTS + SETEX under the global 'mylock' lock) with 1, 4 and 16 concurrent clients.
+
+    Needs a local redis-server, e.g.:
+        $ redis-server --port 6379 &
+        $ python -m benchmarks.bench_redislease --host localhost --claims 2000
+"""
+
+import argparse
+import time
+import uuid
+from multiprocessing import Pool
+
+from historydb.redislease import RedisLease
+
+
+class LockedRedisLease(RedisLease):
+    """RedisLease with the previous, lock based, claim."""
+
+    def tryAdd(self, item, lease_secs: int = 604800) -> bytes:
+        with self._db.lock('mylock'):
+            if item:
+                if not self.isExist(item):
+                    p = self._db.pipeline()
+                    itemkey = self._itemkey(item)
+                    p.setex(self._lease_key_prefix + itemkey, lease_secs, self._session)
+                    p.execute()
+                    return item
+                else:
+                    return False
+            else:
+                return False
+
+
+IMPLEMENTATIONS = {
+    'lock': LockedRedisLease,
+    'atomic': RedisLease,
+}
+
+
+def run_client(args) -> int:
+    """
+    Claims `claims` ids, half of them already claimed by another client, and returns the number of claims made.
+    """
+    implementation, name, host, port, claims, client_id = args
+    lease = IMPLEMENTATIONS[implementation](name=name, host=host, port=port)
+
+    for i in range(claims):
+        # Every other id is shared with the next client, so half of the claims are duplicates
+        owner = client_id if i % 2 else client_id + 1
+        lease.tryAdd(f"{owner}-{i}", lease_secs=60)
+
+    return claims
+
+
+def bench(implementation: str, host: str, port: int, clients: int, claims: int) -> float:
+    """
+    Returns the claims/sec of an implementation with `clients` concurrent clients.
+    """
+    name = f"bench_redislease:{uuid.uuid4()}"
+    jobs = [(implementation, name, host, port, claims, client_id) for client_id in range(clients)]
+
+    with Pool(clients) as pool:
+        start = time.perf_counter()
+        total = sum(pool.map(run_client, jobs))
+        elapsed = time.perf_counter() - start
+
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--claims', type=int, default=2000, help='claims per client')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'lock (claims/s)':>16} {'atomic (claims/s)':>18} {'speedup':>8}")
+    for clients in args.clients:
+        locked = bench('lock', args.host, args.port, clients, args.claims)
+        atomic = bench('atomic', args.host, args.port, clients, args.claims)
+        print(f"{clients:>8} {locked:>16.0f} {atomic:>18.0f} {atomic / locked:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+    Micro-benchmark of the majority sector of an article's tickers
+
+    Compares the lookups/sec of the recursive general_utils.get_sector_loose() and of
+    UniverseIndex.get_sector_loose() on a synthetic universe of 8-digit ICB codes, e.g.:
+        $ python -m benchmarks.bench_sector --universe 10000 --lookups 100000
+"""
+
+import argparse
+import random
+import time
+import timeit
+
+from utils.general_utils import get_sector_loose
+from utils.universe_index import UniverseIndex
+
+
+def make_universe(n: int, rng: random.Random) -> dict:
+    """
+    Builds n tickers spread over 11 industries, with codes sharing their leading digits.
+    """
+    return {
+        f'T{i}': f'{rng.randrange(10, 21)}{rng.randrange(10, 13)}{rng.randrange(10, 13)}{rng.randrange(10, 13)}'
+        for i in range(n)
+    }
+
+def make_ticker_lists(sector_dict: dict, n: int, max_tickers: int, rng: random.Random) -> list:
+    """
+    Builds n ticker lists like the symbols of news articles, with some tickers outside the universe.
+    """
+    tickers = list(sector_dict) + [f'UNKNOWN{i}' for i in range(len(sector_dict) // 10)]
+    return [rng.sample(tickers, rng.randint(1, max_tickers)) for _ in range(n)]
+
+def bench(func, ticker_lists: list, repeat: int) -> float:
+    """
+    Returns:
+        float: best lookups/sec of func over repeat runs.
+    """
+    best = min(timeit.repeat(lambda: [func(ticker_list) for ticker_list in ticker_lists], number=1, repeat=repeat))
+    return len(ticker_lists) / best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--universe', type=int, default=10000, help='tickers in the universe')
+    parser.add_argument('--lookups', type=int, default=100000, help='ticker lists resolved')
+    parser.add_argument('--max-tickers', type=int, default=8, help='maximum tickers per list')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per method, the best one is kept')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    sector_dict = make_universe(args.universe, rng)
+    ticker_lists = make_ticker_lists(sector_dict, args.lookups, args.max_tickers, rng)
+
+    start = time.perf_counter()
+    index = UniverseIndex(sector_dict)
+    print(f"index built in {time.perf_counter() - start:.3f} sec")
+
+    baseline = bench(lambda ticker_list: get_sector_loose(ticker_list, sector_dict), ticker_lists, args.repeat)
+    print(f"{'recursive':<10} {baseline:>12,.0f} lookups/sec")
+    rate = bench(index.get_sector_loose, ticker_lists, args.repeat)
+    print(f"{'index':<10} {rate:>12,.0f} lookups/sec  x{rate / baseline:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+    Micro-benchmark of the conversion of scraped documents to mongo mappings
+
+    Compares the docs/sec of dataclasses.asdict() and to_document() on documents shaped
+    like the lurkers' ones, e.g.:
+        $ python -m benchmarks.bench_serialization --docs 20000
+"""
+
+import argparse
+import timeit
+from dataclasses import asdict
+from datetime import datetime
+
+from res.models.datamodels import MongoDocBase, mongo_doc, to_document
+
+@mongo_doc
+class BenchMongoDoc(MongoDocBase):
+    link: str
+    info: dict
+    title: str
+    text: str
+    keywords: list
+
+def make_doc(i: int) -> BenchMongoDoc:
+    """
+    Builds a document with the nested fields of an EastMoney report and the text of a news article.
+    """
+    return BenchMongoDoc(
+        unique_identifier=str(i),
+        tickers=['0700.HK', '9988.HK', '3690.HK'],
+        sentiment=[0.1, -0.2, 0.05],
+        sector_code=2,
+        source_link=[f'https://example.com/{i}'],
+        time=datetime.now(),
+        source_id=str(i),
+        text_hash='',
+
+        link=f'https://example.com/{i}',
+        info={
+            'title': 'report', 'orgName': 'broker', 'researcher': 'analyst',
+            'industry': {'code': '451', 'name': 'internet'}, 'ratings': [{'from': 'hold', 'to': 'buy'}]
+        },
+        title='title ' * 10,
+        text='text ' * 1000,
+        keywords=[{'word': 'word', 'score': 0.5}] * 10
+    )
+
+def bench(func, docs: list, repeat: int) -> float:
+    """
+    Returns:
+        float: best docs/sec of func over repeat runs.
+    """
+    best = min(timeit.repeat(lambda: [func(doc) for doc in docs], number=1, repeat=repeat))
+    return len(docs) / best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=20000, help='documents per run')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per method, the best one is kept')
+    args = parser.parse_args()
+
+    docs = [make_doc(i) for i in range(args.docs)]
+    assert to_document(docs[0]) == asdict(docs[0])
+
+    baseline = bench(asdict, docs, args.repeat)
+    print(f"{'asdict':<12} {baseline:>12,.0f} docs/sec")
+    rate = bench(to_document, docs, args.repeat)
+    print(f"{'to_document':<12} {rate:>12,.0f} docs/sec  x{rate / baseline:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Streams the documents written by the lurkers to ElasticSearch, decoupled from scraping
+
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List
+
+import redis
+from bson import ObjectId
+
+from base import Lurker
+from lurkers import LURKER_TYPES
+from utils.database_utils import BufferedMongoWriter, bulk_migrate_to_es, connect_to_mongodb, es_dead_letter, get_elasticsearch
+from utils.general_utils import get_configs
+from utils.http_utils import get_http_session
+
+log_fmt = '%(asctime)s %(levelname)s %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+logger = logging.getLogger(__name__)
+
+class EsMigrator():
+    """
+    Tails the mongo collection of a lurker by _id and migrates its new documents to ES.
+
+    The last _id migrated (the watermark) is kept in redis, so a restarted migrator resumes where it
+    stopped instead of scanning the collection for the just_insert flag. Documents younger than
+    lag_secs are left for a later pass: an _id is generated before its document is committed, so a
+    slightly smaller _id can still show up for a while.
+
+    Args:
+        lurker (Lurker): lurker whose collection is migrated, it builds the ES actions.
+        es (Elasticsearch): ES connection.
+        watermarks (redis.StrictRedis): redis holding the watermarks.
+        watermarks_key (str): redis hash of the watermarks, by collection.
+        batch_size (int): maximum number of documents read from mongo per pass.
+        chunk_size (int): number of documents per ES bulk request.
+        thread_count (int): number of ES bulk requests in parallel.
+        max_chunk_bytes (int): maximum size of an ES bulk request, in bytes.
+        lag_secs (int): age of the youngest documents migrated.
+        dead_letters (Callable[[dict], None], optional): sink of the documents ES rejected or that could
+            not be converted. Without it, the watermark stops at the first document that could not be converted.
+    """
+    def __init__(self, lurker: Lurker, es, watermarks: redis.StrictRedis, watermarks_key: str = 'es_migrator:watermarks',
+                 batch_size: int = 5000, chunk_size: int = 500, thread_count: int = 4,
+                 max_chunk_bytes: int = 100 * 1024 * 1024, lag_secs: int = 30, dead_letters: Callable[[dict], None] = None):
+        self.lurker = lurker
+        self.collection = lurker.mongo_collection
+        self.es_index = lurker.ES_INDEX
+        self.es = es
+        self.watermarks = watermarks
+        self.watermarks_key = watermarks_key
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.thread_count = thread_count
+        self.max_chunk_bytes = max_chunk_bytes
+        self.lag_secs = lag_secs
+        self.dead_letters = dead_letters
+
+    def get_watermark(self):
+        """
+        Returns the last _id migrated, None if the collection was never migrated by this migrator.
+        """
+        watermark = self.watermarks.hget(self.watermarks_key, self.collection.full_name)
+        if watermark is None:
+            return None
+        watermark = watermark.decode('utf-8')
+        return ObjectId(watermark) if ObjectId.is_valid(watermark) else watermark
+
+    def set_watermark(self, id):
+        self.watermarks.hset(self.watermarks_key, self.collection.full_name, str(id))
+
+    def build_es_actions(self, items: Iterable[dict]) -> List[dict]:
+        """
+        Builds the ES actions of documents, in order.
+
+        A document that cannot be converted goes to the dead-letter sink. Without a sink, the actions
+        stop at the first such document, so that the watermark does not move past it.
+
+        Returns:
+            List[dict]: the actions, one per document up to the first failure without a sink.
+        """
+        actions = []
+        for item in items:
+            try:
+                actions.append(self.lurker.es_action(item))
+            except Exception as e:
+                if self.dead_letters is None:
+                    logger.error(f"Failed to build the ES action of {item.get('_id')} of {self.collection.full_name}, stopping there: {e}")
+                    break
+                logger.warning(f"Failed to build the ES action of {item.get('_id')} of {self.collection.full_name}: {e}")
+                self.dead_letters(es_dead_letter(
+                    {'build': {'_id': str(item.get('_id')), 'exception': repr(e)}}, self.es_index, self.collection
+                ))
+        return actions
+
+    def migrate_batch(self) -> int:
+        """
+        Migrates the next batch of documents after the watermark, then moves the watermark past them.
+        Only the documents acknowledged by ES have their just_insert flag reset, the others go to the
+        dead-letter sink, as well as the documents whose action cannot be built.
+
+        Returns:
+            int: number of documents read, 0 when the migrator caught up.
+        """
+        upper = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=self.lag_secs))
+        watermark = self.get_watermark()
+        if watermark is None:
+            # First run, start from the documents never migrated
+            query = {'_id': {'$lt': upper}, 'just_insert': True}
+        else:
+            query = {'_id': {'$gt': watermark, '$lt': upper}}
+
+        # Only the fields of the ES documents, in cursor batches of a bulk chunk
+        cursor = self.collection.find(query, projection=self.lurker.es_projection(), batch_size=self.chunk_size)
+        items = list(cursor.sort('_id', 1).limit(self.batch_size))
+        if not items:
+            return 0
+
+        actions = self.build_es_actions(items)
+        if len(actions) < len(items) and self.dead_letters is None:
+            # Resume from the document that failed
+            items = items[:len(actions)]
+            if not items:
+                return 0
+
+        successes, failures, _ = bulk_migrate_to_es(
+            self.collection,
+            self.es_index,
+            actions,
+            reset_chunk_size=self.chunk_size,
+            thread_count=self.thread_count,
+            chunk_size=self.chunk_size,
+            max_chunk_bytes=self.max_chunk_bytes,
+            dead_letters=self.dead_letters
+        )
+        self.set_watermark(items[-1]['_id'])
+
+        logger.info(f"{self.collection.full_name}: migrated {successes} documents to {self.es_index}, {failures} failed.")
+        return len(items)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the documents of the lurker collections to ElasticSearch")
+    parser.add_argument('--once', action='store_true', help="Exit once every collection caught up")
+    args = parser.parse_args()
+
+    config = get_configs('res/configs/setup-configs.yaml')
+    migrator_configs = config.get('es_migrator', {})
+    poll_secs = migrator_configs.get('poll_secs', 5)
+
+    es = get_elasticsearch()
+    watermarks = redis.StrictRedis(host=os.getenv("REDIS_SERVICE_HOST"))
+    session = get_http_session(**config.get('http', {}))
+
+    # Documents rejected by ES are kept in mongo for inspection and replay
+    dead_letters = BufferedMongoWriter(
+        connect_to_mongodb(migrator_configs.get('dead_letter_collection', 'es_dead_letters')),
+        logger=logger
+    )
+
+    migrators = []
+    for lurker_type in config['lurkers_collection']:
+        lurker = LURKER_TYPES[lurker_type](session=session)
+        if not lurker.ES_INDEX:
+            logger.warning(f"No es_index configured for {lurker_type}, not migrating it.")
+            continue
+        migrators.append(EsMigrator(
+            lurker,
+            es,
+            watermarks,
+            watermarks_key=migrator_configs.get('watermarks_key', 'es_migrator:watermarks'),
+            batch_size=migrator_configs.get('batch_size', 5000),
+            chunk_size=migrator_configs.get('chunk_size', 500),
+            thread_count=migrator_configs.get('thread_count', 4),
+            max_chunk_bytes=migrator_configs.get('max_chunk_bytes', 100 * 1024 * 1024),
+            lag_secs=migrator_configs.get('lag_secs', 30),
+            dead_letters=dead_letters.add
+        ))
+
+    while True:
+        read = 0
+        for migrator in migrators:
+            try:
+                read += migrator.migrate_batch()
+            except Exception as e:
+                logger.error(f"Failed to migrate {migrator.collection.full_name}: {e}", exc_info=True)
+
+        if read == 0:
+            if args.once:
+                break
+            # Every collection caught up
+            time.sleep(poll_secs)
+
+    for migrator in migrators:
+        migrator.lurker.close()
+    dead_letters.close()
+
+if __name__ == "__main__":
+    main()
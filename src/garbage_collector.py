@@ -1,5 +1,7 @@
+import argparse
 from typing import List
 from workqueue.rediswq import RedisWQ
+from workqueue.reaper import LeaseReaper
 import logging
 from utils.general_utils import get_configs
 from utils.database_utils import connect_to_mongodb
@@ -11,14 +13,32 @@ logging.basicConfig(level=logging.INFO, format=log_fmt)
 logger = logging.getLogger(__name__)
 
 def main():
+    parser = argparse.ArgumentParser(description="Requeue the jobs whose lease expired")
+    parser.add_argument('--daemon', action='store_true', help="Keep running and reap every few seconds, with leader election")
+    parser.add_argument('--redrive', action='store_true', help="Move every job of the dead-letter queue back to the work queue")
+    args = parser.parse_args()
+
     config = get_configs('res/configs/setup_configs.yaml')
     redis_wqs = config['redis_wqs'] # One Global Queue
 
     wq = RedisWQ(name=redis_wqs, host=os.getenv("REDIS_SERVICE_HOST"))
+
+    if args.redrive:
+        redriven = wq.redrive()
+        logger.info(f"Redrove {redriven} dead-lettered jobs")
+        return
+
+    if args.daemon:
+        reaper = LeaseReaper(wq, interval_secs=config.get('reaper_secs', 2))
+        logger.info("Reaping Expired Leases")
+        # Run in the foreground, the process is the reaper
+        reaper.run()
+        return
+
     # Check if there are expired leases
-    wq.check_expired_leases()
+    requeued = wq.check_expired_leases()
 
-    logger.info("Checked Expired Leases")
+    logger.info(f"Checked Expired Leases, {requeued} jobs requeued")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
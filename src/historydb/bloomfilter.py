@@ -0,0 +1,146 @@
+# the TimedBloomFilter Class
+
+import hashlib
+import math
+import threading
+import time
+import uuid
+from typing import List
+
+
+class TimedBloomFilter(object):
+    """Time-windowed Bloom filter, used as a local pre-filter of the history db.
+
+    The window is split in `generations` buckets, each with its own bit array.
+    Items are added to the current bucket and looked up in all the live ones.
+    A bucket is dropped once it is older than the window, so an item is
+    forgotten before its lease (of `window_secs`) expires in the history db.
+
+    The buckets are periodically synced with redis: the bits set locally are
+    OR-ed into a redis string per bucket, and the buckets of the other workers
+    are OR-ed back into the local filter.
+
+    This object is thread-safe.
+    """
+
+    def __init__(self, capacity: int = 200000, error_rate: float = 0.0001, window_secs: int = 604800,
+                 generations: int = 7, sync_secs: int = 300) -> None:
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of items expected per bucket.
+        error_rate : float, optional
+            Expected false positive rate at capacity.
+        window_secs : int, optional
+            How long an item is remembered, the lease_secs of the history db.
+        generations : int, optional
+            Number of buckets the window is split in.
+        sync_secs : int, optional
+            Minimal number of seconds between two syncs with redis.
+        """
+        self._num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._num_bytes = (self._num_bits + 7) // 8
+        self._num_hashes = max(1, int(round(self._num_bits / capacity * math.log(2))))
+        self._window_secs = window_secs
+        self._generations = generations
+        self._bucket_secs = window_secs / generations
+        self._sync_secs = sync_secs
+        self._last_sync = 0
+
+        self._buckets = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _current_bucket(self) -> int:
+        return int(time.time() // self._bucket_secs)
+
+    def _live_buckets(self) -> List[int]:
+        current = self._current_bucket()
+        return list(range(current - self._generations + 1, current + 1))
+
+    def _expire(self) -> None:
+        """Drop the buckets that fell out of the window."""
+        oldest = self._current_bucket() - self._generations + 1
+        for bucket in [bucket for bucket in self._buckets if bucket < oldest]:
+            del self._buckets[bucket]
+            self._dirty.discard(bucket)
+
+    def _positions(self, item: str) -> List[int]:
+        """Returns the bit positions of an item (double hashing)."""
+        digest = hashlib.sha224(item.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self._num_bits for i in range(self._num_hashes)]
+
+    def add(self, item: str) -> None:
+        """Add an item to the current bucket."""
+        positions = self._positions(item)
+        with self._lock:
+            self._expire()
+            bucket = self._current_bucket()
+            bits = self._buckets.setdefault(bucket, bytearray(self._num_bytes))
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            self._dirty.add(bucket)
+
+    def __contains__(self, item: str) -> bool:
+        """False if the item was definitely not added within the window."""
+        positions = self._positions(item)
+        with self._lock:
+            self._expire()
+            for bits in self._buckets.values():
+                if all(bits[position >> 3] & (1 << (position & 7)) for position in positions):
+                    return True
+        return False
+
+    def _merge(self, bucket: int, remote: bytes) -> None:
+        """OR the bits of a remote bucket into the local one."""
+        if len(remote) != self._num_bytes:
+            # Filter built with other parameters, ignore it
+            return
+        local = self._buckets.get(bucket)
+        if local is None:
+            self._buckets[bucket] = bytearray(remote)
+        else:
+            merged = int.from_bytes(local, 'big') | int.from_bytes(remote, 'big')
+            self._buckets[bucket] = bytearray(merged.to_bytes(self._num_bytes, 'big'))
+
+    def sync(self, db, key_prefix: str) -> None:
+        """Push the local buckets to redis and pull the buckets of the other workers.
+
+        Parameters
+        ----------
+        db : redis.StrictRedis
+            Connection to redis, without decode_responses.
+        key_prefix : string
+            Prefix of the redis keys of the buckets.
+        """
+        with self._lock:
+            self._expire()
+            dirty = {bucket: bytes(self._buckets[bucket]) for bucket in self._dirty}
+            self._dirty.clear()
+            live = self._live_buckets()
+
+        p = db.pipeline(transaction=False)
+        for bucket, bits in dirty.items():
+            key = f"{key_prefix}{bucket}"
+            tmp_key = f"{key}:{uuid.uuid4()}"
+            p.set(tmp_key, bits, ex=60)
+            p.bitop('OR', key, key, tmp_key)
+            p.delete(tmp_key)
+            p.expireat(key, int((bucket + self._generations) * self._bucket_secs) + 1)
+        for bucket in live:
+            p.get(f"{key_prefix}{bucket}")
+        results = p.execute()
+
+        with self._lock:
+            for bucket, remote in zip(live, results[len(results) - len(live):]):
+                if remote:
+                    self._merge(bucket, remote)
+            self._last_sync = time.time()
+
+    def maybe_sync(self, db, key_prefix: str) -> None:
+        """Sync with redis if the last sync is older than sync_secs."""
+        if time.time() - self._last_sync >= self._sync_secs:
+            self.sync(db, key_prefix)
@@ -7,10 +7,12 @@ __email__ = "u3556578@connect.hku.hk"
 import hashlib
 import logging
 import uuid
-from typing import Any
+from typing import Any, Iterable, List
 
 import redis
 
+from historydb.bloomfilter import TimedBloomFilter
+
 class RedisLease(object):
     """Simple Redis Lease Backend
 
@@ -21,7 +23,7 @@ class RedisLease(object):
 
     """
 
-    def __init__(self, name: str, max_retries: int = 2, **redis_kwargs: Any) -> None:
+    def __init__(self, name: str, max_retries: int = 2, prefilter: TimedBloomFilter = None, **redis_kwargs: Any) -> None:
         """Redis worker queue instance
 
         The default connection parameters are:
@@ -38,7 +40,18 @@ class RedisLease(object):
         max_retries : int, optional
             Number of times to retry a job before removing it from the queue.
             If you don't wish to retry jobs, set the limit to 0.
+        prefilter : TimedBloomFilter, optional
+            Local filter of the items claimed recently. Items it has never
+            seen are known not to exist without a round-trip to redis, items
+            it has (probably) seen are confirmed in redis. Claims always go
+            through redis, a false positive never drops a new item.
         """
+        self._prefilter = prefilter
+        if prefilter is not None:
+            # The filter buckets are binary, they need a connection that does not decode
+            self._raw_db = redis.StrictRedis(**redis_kwargs)
+            self._prefilter_key_prefix = name + ":prefilter:"
+
         redis_kwargs.update(decode_responses=True)
         self._db = redis.StrictRedis(**redis_kwargs)
         # The session ID will uniquely identify this "worker".
@@ -55,28 +68,66 @@ class RedisLease(object):
 
     def isExist(self, item: str) -> bool:
         """True if a lease on 'item' exists."""
+        if self._prefilter is not None and not self._prefiltered(item):
+            # Definitely never claimed within the lease window
+            return False
         return bool(self._db.exists(self._lease_key_prefix + self._itemkey(item)))
 
     def tryAdd(self, item, lease_secs: int = 604800) -> bytes:
-        """Add a item to the lease atomically."""
-        with self._db.lock('mylock'):
-            # Check if item exist in the lease db
-            if item:
-                if not self.isExist(item):
-                    p = self._db.pipeline()
-                    # Record that we (this session id) are working on a key. Expire
-                    # that note after the lease timeout.
-                    # Note: if we crash at this line of the program, then GC will see
-                    # no lease for this item a later return it to the main queue.
-                    itemkey = self._itemkey(item)
-                    p.setex(self._lease_key_prefix + itemkey, lease_secs, self._session)
-                    p.execute()
-
-                    return item
-                else:
-                    return False
-            else:
-                return False
+        """Add a item to the lease atomically.
+
+        The check and the claim are a single SET NX EX, so no distributed
+        lock is needed and concurrent workers never claim the same item twice.
+
+        Returns the item if it was added, False otherwise.
+        """
+        if not item:
+            return False
+
+        # Record that we (this session id) have seen the item. Expire
+        # that note after the lease timeout.
+        itemkey = self._itemkey(item)
+        added = self._db.set(self._lease_key_prefix + itemkey, self._session, nx=True, ex=lease_secs)
+
+        if added and self._prefilter is not None:
+            # Only claims are remembered, so the filter never outlives a lease
+            self._prefilter.add(item)
+
+        if added:
+            return item
+        else:
+            return False
+
+    def tryAddMany(self, items: Iterable[str], lease_secs: int = 604800) -> List[str]:
+        """Add many items to the lease in a single round-trip.
+
+        Every item is claimed atomically with SET NX EX, so an item is only
+        reported as added to one of the workers claiming it.
+
+        Returns the items that were not in the lease db yet, in order.
+        """
+        # Drop empty and repeated items, keeping the order
+        items = [item for item in dict.fromkeys(items) if item]
+        if not items:
+            return []
+
+        p = self._db.pipeline(transaction=False)
+        for item in items:
+            p.set(self._lease_key_prefix + self._itemkey(item), self._session, nx=True, ex=lease_secs)
+        results = p.execute()
+
+        added = [item for item, claimed in zip(items, results) if claimed]
+        if self._prefilter is not None:
+            # Only claims are remembered, so the filter never outlives a lease
+            for item in added:
+                self._prefilter.add(item)
+
+        return added
+
+    def _prefiltered(self, item: str) -> bool:
+        """True if the prefilter has (probably) seen the item within the lease window."""
+        self._prefilter.maybe_sync(self._raw_db, self._prefilter_key_prefix)
+        return item in self._prefilter
 
     # DONE: add functions to clean up all keys associated with "name" when
     # processing is complete.
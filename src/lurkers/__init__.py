@@ -2,4 +2,13 @@ from .newsfilter import Newsfilter
 from .aastocks import AAstocks
 from .etnet import Etnet
 from .eastmoney import EastMoney
-from .reddit import Reddit
\ No newline at end of file
+from .reddit import Reddit
+
+# Lurker type (as used in the work queue items) -> Lurker class
+LURKER_TYPES = {
+    'newsfilter': Newsfilter,
+    'reddit': Reddit,
+    'aastocks': AAstocks,
+    'etnet': Etnet,
+    'eastmoney': EastMoney,
+}
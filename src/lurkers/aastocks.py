@@ -14,27 +14,21 @@ __email__ = "u3556578@connect.hku.hk"
 import json
 from typing import Dict, Generator, Iterator
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
-import urllib
 from utils.general_utils import get_configs, get_sector_dict, get_sector_loose
 from utils.hkscraper_utils import getTickerCode
 import logging
 from datetime import datetime
 import re
 
-@dataclass
-class __AAstocksMongoDocBase(MongoDocBase):
+@mongo_doc
+class AAstocksMongoDoc(MongoDocBase):
     title: str
     text: str
     source: str
 
-@dataclass
-class AAstocksMongoDoc(MongoDocDefaultsBase, __AAstocksMongoDocBase):
-    pass
-
 
 class AAstocks(Lurker):
     """
@@ -46,7 +40,10 @@ class AAstocks(Lurker):
         duration (int): Optional, the duration of the documents you want to scrape from.
 
     """
-    def __init__(self, ticker, **kwargs):
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['title', 'text']
+
+    def __init__(self, ticker=None, **kwargs):
         # Set logger
         log_fmt = '%(asctime)s %(levelname)s %(message)s'
         logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -79,15 +76,26 @@ class AAstocks(Lurker):
                 ticker = str(ticker)
             ticker = ticker.zfill(5)
             URL = f"http://aastocks.com/tc/stocks/analysis/stock-aafn/{ticker}/0/all/1"
-            page = requests.get(URL,proxies=urllib.request.getproxies())
+            page = self.session.get(URL)
             soup = BeautifulSoup(page.content, "html.parser")
             news_list = soup.find_all('div', attrs={"ref" : lambda tag: tag and tag.startswith("NOW")})
-            for news in news_list:
-                url = 'http://aastocks.com' + news.find('a')['href']
-                yield url
+            urls = ['http://aastocks.com' + news.find('a')['href'] for news in news_list]
         except:
             return []
 
+        # Claim the listing in the history db a batch at a time, as it is scraped
+        yield from self.claimInBatches(urls, self.get_article_id)
+
+    def set_task(self, payload: str):
+        """
+        Sets the ticker to scrape for the next job.
+
+        Args:
+            payload (str): The ticker to scrape
+        """
+        super().set_task(payload)
+        self.ticker = payload
+
     def get_scraper_params(self) -> dict:
         """
         No special extra params. Superclass Abstract Method implementation used.
@@ -104,7 +112,19 @@ class AAstocks(Lurker):
         Returns:
             str: text
         """
-        return doc['title'] + doc['description'] + doc['text']
+        return doc['title'] + doc['text']
+
+    def get_article_id(self, query):
+        """
+        Extracts the AAstocks article id from the article url.
+
+        Returns:
+            str: article id, None if the url is not an article
+        """
+        m = re.search('(NOW.[0-9]*)', query)
+        if m:
+            return m.group(1)
+        return None
 
     def get_document(self, query, **kwargs) -> bool:
         """
@@ -113,108 +133,112 @@ class AAstocks(Lurker):
         Returns:
             bool: True if all articles(s) are successfully scraped, False otherwise
         """
-        
-        m = re.search('(NOW.[0-9]*)', query)
-        if m:
-            article_id = m.group(1)
-        else:
+        unique_identifier = self.claimArticle(query)
+        if not unique_identifier:
             return False
+        return self.parse_document(query, unique_identifier, self.fetch_page(query))
 
-        # Get UniqueIdentifier
-        unique_identifier = self.tryAddArticleToHistory(article_id)
+    async def get_document_async(self, query, fetcher, **kwargs) -> bool:
+        """
+        Implementation of get_document() for the async scrape mode.
 
-        if unique_identifier:
+        Returns:
+            bool: True if all articles(s) are successfully scraped, False otherwise
+        """
+        unique_identifier = await self.run_blocking(self.claimArticle, query)
+        if not unique_identifier:
+            return False
+        return self.parse_document(query, unique_identifier, await self.fetch_page_async(query, fetcher))
 
-            for _ in range(self.NUM_RETRIES):
-                try:
-                    response = requests.get(query,proxies=urllib.request.getproxies())
-                    if response.status_code == 200:
-                        page = response
-                        break
-                except requests.exceptions.RequestException as e:
-                    content = None
-            
-            if page is None:
-                self.logger.warning(f"Failed to Connect. {query}")
-                return
+    def parse_document(self, query, unique_identifier, content) -> bool:
+        """
+        Parses a fetched AAstocks article page into a document.
 
-            soup = BeautifulSoup(page.content, "html.parser")
+        Args:
+            query (str): url of the article.
+            unique_identifier (str): identifier claimed in the history db.
+            content (bytes): body of the article page, None if it could not be fetched.
+
+        Returns:
+            bool: True if the article is successfully parsed, False otherwise
+        """
+        if content is None:
+            self.logger.warning(f"Failed to Connect. {query}")
+            return
+
+        soup = BeautifulSoup(content, "html.parser")
+
+        # Get Title
+        title = soup.find_all("div", class_="newshead5")
+        title = title[0].text.strip()
+        
+        # Get Ticker List
+        tickers = soup.find_all('a', class_="jsStock")
+        ticker_list = list()
+        
+        # Get Sentiment
+        like = soup.find("div", class_='divRecommend').find('div',class_='value').text
+        pos = soup.find("div", class_="divBullish").find('div',class_='value').text
+        neg = soup.find("div", class_="divBearish").find('div',class_='value').text
+
+        sentiment = {"like": like, "pos": pos, "neg": neg}
 
-            # Get Title
-            title = soup.find_all("div", class_="newshead5")
-            title = title[0].text.strip()
-            
-            # Get Ticker List
-            tickers = soup.find_all('a', class_="jsStock")
-            ticker_list = list()
-            
-            # Get Sentiment
-            like = soup.find("div", class_='divRecommend').find('div',class_='value').text
-            pos = soup.find("div", class_="divBullish").find('div',class_='value').text
-            neg = soup.find("div", class_="divBearish").find('div',class_='value').text
-
-            sentiment = {"like": like, "pos": pos, "neg": neg}
-
-            for ticker in tickers:
-                ticker_list.append(ticker['sym'].strip())
-
-            if len(ticker_list) == 0:
-                ticker_list.append(self.ticker)
-
-            ticker_list = getTickerCode(ticker_list)
-
-            # Content
-            text = soup.find(id="spanContent")
-            
-            try:
-                unwanted = text.find(class_='quote-box2')
-                unwanted.extract()
-                unwanted = text.find(class_='quote-box2')
-                unwanted.extract()
-            except:
-                pass
-            
-            text = "".join(text.p.text.split())
-
-            # Get News Time
-            timestamp = soup.find_all('div', class_="newstime5")
-            timestamp = timestamp[0].text.strip()
-            timestamp = datetime.strptime(timestamp,'%Y/%m/%d %H:%M')
-
-            source = 'aastocks'
-            source_id = str(hash(title))
-            tickers = ticker_list
-            title= title
-            time = timestamp
-            source_link = query
-            text = text
-            sector_code = None
-            text_hash = str(hash(title+text))
-            sentiment = None
-
-            doc = AAstocksMongoDoc(
-                        unique_identifier = unique_identifier,
-                        tickers = tickers,
-                        sentiment=sentiment,
-                        sector_code=sector_code,
-                        source_link=source_link,
-                        time=time,
-                        source_id=source_id,
-                        text_hash=text_hash,
-                        title=title,
-                        text=text,
-                        source=source
-                    )
-
-            try:
-                self.successful_documents.append(asdict(doc))
-                self.successful_queries.append(query)
-                return True
-            except Exception as e:
-                self.logger.info(f"Payload failed to migrate to mongo. {query}")
-                self.logger.debug(f"Failed Insertion into Mongo: {e}")
-                self.failed_queries.append(query)
-                return False
-        else:
-            self.skipped_queries.append(query)
-            return False
\ No newline at end of file
+        for ticker in tickers:
+            ticker_list.append(ticker['sym'].strip())
+
+        if len(ticker_list) == 0:
+            ticker_list.append(self.ticker)
+
+        ticker_list = getTickerCode(ticker_list)
+
+        # Content
+        text = soup.find(id="spanContent")
+        
+        try:
+            unwanted = text.find(class_='quote-box2')
+            unwanted.extract()
+            unwanted = text.find(class_='quote-box2')
+            unwanted.extract()
+        except:
+            pass
+        
+        text = "".join(text.p.text.split())
+
+        # Get News Time
+        timestamp = soup.find_all('div', class_="newstime5")
+        timestamp = timestamp[0].text.strip()
+        timestamp = datetime.strptime(timestamp,'%Y/%m/%d %H:%M')
+
+        source = 'aastocks'
+        source_id = str(hash(title))
+        tickers = ticker_list
+        title= title
+        time = timestamp
+        source_link = query
+        text = text
+        sector_code = None
+        text_hash = str(hash(title+text))
+        sentiment = None
+
+        doc = AAstocksMongoDoc(
+                    unique_identifier = unique_identifier,
+                    tickers = tickers,
+                    sentiment=sentiment,
+                    sector_code=sector_code,
+                    source_link=source_link,
+                    time=time,
+                    source_id=source_id,
+                    text_hash=text_hash,
+                    title=title,
+                    text=text,
+                    source=source
+                )
+
+        try:
+            self.add_document(doc, query)
+            return True
+        except Exception as e:
+            self.logger.info(f"Payload failed to migrate to mongo. {query}")
+            self.logger.debug(f"Failed Insertion into Mongo: {e}")
+            self.failed_queries.append(query)
+            return False
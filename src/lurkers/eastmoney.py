@@ -1,10 +1,9 @@
 __author__ = "Guo Zhongyuan"
 
 import json
-from typing import Dict, Generator, Iterator
+from typing import Dict, Generator, Iterator, Optional
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
 from utils.general_utils import get_configs, get_sector_dict, get_sector_loose
@@ -13,18 +12,14 @@ from datetime import datetime, timedelta
 
 from utils.tencent_api import TecentNLU
 
-@dataclass
-class __EastMoneyMongoDocBase(MongoDocBase):
+@mongo_doc
+class EastMoneyMongoDoc(MongoDocBase):
     link: str
     info: dict
     type: str
     content: str
     keywords: list
 
-@dataclass
-class EastMoneyMongoDoc(MongoDocDefaultsBase, __EastMoneyMongoDocBase):
-    pass
-
 
 class EastMoney(Lurker):
     """
@@ -33,6 +28,9 @@ class EastMoney(Lurker):
         duration_hr (int, optional): the scraping period in hrs. Defaults to 12.
         offset_hr (int, optional): the scraping period in hrs. Defaults to 0.
     """
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['info.title', 'content']
+
     def __init__(self, duration_hr: int = 12, offset_hr: int = 0, **kwargs):
 
         log_fmt = '%(asctime)s %(levelname)s %(message)s'
@@ -41,7 +39,7 @@ class EastMoney(Lurker):
 
         '''Base Class Parameters'''
         configs = get_configs('res/configs/eastmoney_configs.yaml')
-        super().__init__(configs, logger)
+        super().__init__(configs, logger, **kwargs)
 
         try:
             '''Subclass Params'''
@@ -68,7 +66,7 @@ class EastMoney(Lurker):
         query_list = []
         for i in range(len(url_list)):
             url = url_list[i]
-            res = requests.get(url)
+            res = self.session.get(url)
             res_text = res.text
             res_text = res_text[17:-1]
             res_js = json.loads(res_text)
@@ -86,7 +84,9 @@ class EastMoney(Lurker):
         start_dt = (today + offset + duration).strftime('%Y-%m-%d')
         # Start to end
         query_list = self.__get_query(start_dt, end_dt, pages=100)
-        for query in query_list:
+
+        # Claim the listing in the history db a batch at a time, as it is scraped
+        for query in self.claimInBatches(query_list, lambda query: str(query['id'])):
             encodeUrl = query['encodeUrl']
             content_url = f'https://data.eastmoney.com/report/zw_macresearch.jshtml?encodeUrl={encodeUrl}'
             query_dict = {
@@ -95,6 +95,26 @@ class EastMoney(Lurker):
             }
             yield query_dict
 
+    def set_task(self, payload: str):
+        """
+        Sets the scraping period for the next job.
+
+        Args:
+            payload (str): "<duration_hr>-<offset_hr>"
+        """
+        super().set_task(payload)
+        duration_hr, offset_hr = payload.split('-')
+        self.DURATION_HR = int(duration_hr)
+        self.OFFSET_HR = int(offset_hr)
+
+    @classmethod
+    def window_secs(cls, payload: str) -> Optional[int]:
+        """
+        The "<duration_hr>-<offset_hr>" window of the payload lasts duration_hr.
+        """
+        duration_hr, _ = payload.split('-')
+        return int(duration_hr) * 3600
+
     def get_scraper_params(self) -> dict:
         """
         No special extra params. Superclass Abstract Method implementation used.
@@ -111,10 +131,11 @@ class EastMoney(Lurker):
         Returns:
             str: text
         """
-        return doc['text_title'] + doc['text_content']
+        # content is None when the report page has no known layout
+        return (doc['info'] or {}).get('title', '') + (doc['content'] or '')
 
     def __get_content(self, text_link):
-        html = requests.get(text_link).content
+        html = self.session.get(text_link).content
         soup = BeautifulSoup(html, "lxml")
         # class_name = {
         #     '个股研报': 'stockzw_content',
@@ -145,20 +166,21 @@ class EastMoney(Lurker):
 
         text_link = query['link']
         text_info = query['info']
-        text_type, text_content = self.__get_content(text_link)
 
-        '''info from baidu-nlu-api'''
-        if text_content!=None:
-            keywords = self.__get_keywords_from_tencent_api(text_content)
-        else:
-            keywords = []
-
-        # Get UniqueIdentifier
+        # Get UniqueIdentifier, before fetching so duplicates cost no request
         unique_identifier = self.tryAddArticleToHistory(str(text_info['id']))
 
         if unique_identifier:
+            text_type, text_content = self.__get_content(text_link)
+
+            '''info from baidu-nlu-api'''
+            if text_content!=None:
+                keywords = self.__get_keywords_from_tencent_api(text_content)
+            else:
+                keywords = []
+
             doc = EastMoneyMongoDoc(
-                unique_identifier = '',
+                unique_identifier = unique_identifier,
                 tickers = [],
                 sentiment=[],
                 sector_code=4,
@@ -175,8 +197,7 @@ class EastMoney(Lurker):
             )
 
             try:
-                self.successful_documents.append(asdict(doc))
-                self.successful_queries.append(query)
+                self.add_document(doc, query)
             except Exception as e:
                 failed_payloads = 1
                 self.failed_queries.append(query)
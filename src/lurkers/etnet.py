@@ -13,11 +13,9 @@ __email__ = "u3556578@connect.hku.hk"
 
 from typing import Dict, Generator
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
-import urllib
 from utils.general_utils import get_configs, get_sector_dict, get_sector_loose
 from utils.hkscraper_utils import getTickerCode
 import logging
@@ -27,18 +25,13 @@ import re
 from itertools import groupby 
 from string import punctuation
 
-@dataclass
-class __EtnetMongoDocBase(MongoDocBase):
+@mongo_doc
+class EtnetMongoDoc(MongoDocBase):
     title: str
     text: str
     source: str
 
 
-@dataclass
-class EtnetMongoDoc(MongoDocDefaultsBase, __EtnetMongoDocBase):
-    pass
-
-
 class Etnet(Lurker):
     """
 
@@ -49,7 +42,10 @@ class Etnet(Lurker):
         duration (int): Optional, the duration of the documents you want to scrape from.
 
     """
-    def __init__(self, ticker, max_page=5,**kwargs):
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['title', 'text']
+
+    def __init__(self, ticker=None, max_page=5,**kwargs):
         # Set logger
         log_fmt = '%(asctime)s %(levelname)s %(message)s'
         logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -85,7 +81,7 @@ class Etnet(Lurker):
                 ticker = str(ticker)
             ticker = ticker.zfill(5)
             URL = f"http://www.etnet.com.hk/www/tc/stocks/realtime/quote_news_list.php?page=1&section=related&code={ticker}"
-            page = requests.get(URL,proxies=urllib.request.getproxies())
+            page = self.session.get(URL)
             soup = BeautifulSoup(page.content, "html.parser")
             
             articles = soup.find(class_="DivArticlePagination")
@@ -102,11 +98,22 @@ class Etnet(Lurker):
                     article_links.extend(results)
                 else:
                     break
-                
-            return article_links
         except:
             return []
 
+        # Claim the listing in the history db a batch at a time, as it is scraped
+        return self.claimInBatches(article_links, self.get_article_id)
+
+    def set_task(self, payload: str):
+        """
+        Sets the ticker to scrape for the next job.
+
+        Args:
+            payload (str): The ticker to scrape
+        """
+        super().set_task(payload)
+        self.ticker = payload
+
     def get_scraper_params(self) -> dict:
         """
         No special extra params. Superclass Abstract Method implementation used.
@@ -123,7 +130,7 @@ class Etnet(Lurker):
         Returns:
             str: text
         """
-        return doc['title'] + doc['description'] + doc['text']
+        return doc['title'] + doc['text']
 
     # Start of Helper Func
     def strQ2B(self,ustring):
@@ -156,7 +163,7 @@ class Etnet(Lurker):
     # End of Helper Func
 
     def getNewsLink(self,URL):
-        page = requests.get(URL,proxies=urllib.request.getproxies())
+        page = self.session.get(URL)
         soup = BeautifulSoup(page.content, "html.parser")
         
         article_links = set()
@@ -180,6 +187,18 @@ class Etnet(Lurker):
         
         return article_links
 
+    def get_article_id(self, query):
+        """
+        Extracts the Etnet article id from the article url.
+
+        Returns:
+            str: article id, None if the url is not an article
+        """
+        m = re.search('(ETN.[0-9]*)', query)
+        if m:
+            return m.group(1)
+        return None
+
     def get_document(self, query, **kwargs) -> bool:
         """
         Implementation of a function that scrape a article from a given query
@@ -187,103 +206,108 @@ class Etnet(Lurker):
         Returns:
             bool: True if all articles(s) are successfully scraped, False otherwise
         """
+        unique_identifier = self.claimArticle(query)
+        if not unique_identifier:
+            return False
+        return self.parse_document(query, unique_identifier, self.fetch_page(query))
 
-        m = re.search('(ETN.[0-9]*)', query)
-        if m:
-            article_id = m.group(1)
-        else:
+    async def get_document_async(self, query, fetcher, **kwargs) -> bool:
+        """
+        Implementation of get_document() for the async scrape mode.
+
+        Returns:
+            bool: True if all articles(s) are successfully scraped, False otherwise
+        """
+        unique_identifier = await self.run_blocking(self.claimArticle, query)
+        if not unique_identifier:
             return False
+        return self.parse_document(query, unique_identifier, await self.fetch_page_async(query, fetcher))
 
-        # Get UniqueIdentifier
-        unique_identifier = self.tryAddArticleToHistory(article_id)
+    def parse_document(self, query, unique_identifier, content) -> bool:
+        """
+        Parses a fetched Etnet article page into a document.
 
-        if unique_identifier:
-            try:
-                for _ in range(self.NUM_RETRIES):
-                    try:
-                        response = requests.get(query,proxies=urllib.request.getproxies())
-                        if response.status_code == 200:
-                            page = response
-                            break
-                    except requests.exceptions.RequestException as e:
-                        content = None
-                
-                if page is None:
-                    self.logger.warning(f"Failed to Connect. {query}")
-                    return
+        Args:
+            query (str): url of the article.
+            unique_identifier (str): identifier claimed in the history db.
+            content (bytes): body of the article page, None if it could not be fetched.
 
-                soup = BeautifulSoup(page.content, "html.parser")
-                
-                # Get Title
-                title = soup.find("p", class_="ArticleHdr")
-                title = str(title.text).strip()
-                title = self.strQ2B(title)
+        Returns:
+            bool: True if the article is successfully parsed, False otherwise
+        """
+        try:
+            if content is None:
+                self.logger.warning(f"Failed to Connect. {query}")
+                return
 
-                # Content
-                text = soup.find(id="NewsContent")
-                text = "".join(text.p.text.split())
+            soup = BeautifulSoup(content, "html.parser")
+            
+            # Get Title
+            title = soup.find("p", class_="ArticleHdr")
+            title = str(title.text).strip()
+            title = self.strQ2B(title)
 
-                # 全形 -> 半形
-                text = self.strQ2B(text) 
-                
-                # Remove Consecutive Punctuation
-                text = self.removeConsecutive(text)
-
-                # Get Tickers
-                ticker_list = re.findall(r"\((.*?)\)",text)
-                for idx,ticker in enumerate(ticker_list):
-                    if not ticker.isnumeric():
-                        ticker_list = list(filter((ticker).__ne__, ticker_list))
-
-                if len(ticker_list) == 0:
-                    ticker_list.append(self.ticker)
-
-                ticker_list = getTickerCode(ticker_list)
-
-                # Get News Time
-                timestamp = soup.find_all('p', class_="date")
-                timestamp = timestamp[0].text.strip()
-                timestamp = datetime.strptime(timestamp,'%d/%m/%Y %H:%M')
-
-                source = 'etnet'
-                source_id = str(hash(title))
-                tickers = ticker_list
-                title= title
-                time = timestamp
-                source_link = query
-                text = text
-                sector_code = None
-                text_hash = str(hash(title+text))
-                sentiment = None
-
-                doc = EtnetMongoDoc(
-                            unique_identifier=unique_identifier,
-                            tickers = tickers,
-                            sentiment=sentiment,
-                            sector_code=sector_code,
-                            source_link=source_link,
-                            time=time,
-                            source_id=source_id,
-                            text_hash=text_hash,
-                            title=title,
-                            text=text,
-                            source=source
-                        )
-
-                try:
-                    self.successful_documents.append(asdict(doc))
-                    self.successful_queries.append(query)
-                    return True
-                except Exception as e:
-                    self.logger.info(f"Payload failed to migrate to mongo. {query}")
-                    self.logger.debug(f"Failed Insertion into Mongo: {e}")
-                    self.failed_queries.append(query)
-                    return False
-                    
-            except:
-                # Some error occurred, skip this record
-                self.skipped_queries.append(query)
+            # Content
+            text = soup.find(id="NewsContent")
+            text = "".join(text.p.text.split())
+
+            # 全形 -> 半形
+            text = self.strQ2B(text) 
+            
+            # Remove Consecutive Punctuation
+            text = self.removeConsecutive(text)
+
+            # Get Tickers
+            ticker_list = re.findall(r"\((.*?)\)",text)
+            for idx,ticker in enumerate(ticker_list):
+                if not ticker.isnumeric():
+                    ticker_list = list(filter((ticker).__ne__, ticker_list))
+
+            if len(ticker_list) == 0:
+                ticker_list.append(self.ticker)
+
+            ticker_list = getTickerCode(ticker_list)
+
+            # Get News Time
+            timestamp = soup.find_all('p', class_="date")
+            timestamp = timestamp[0].text.strip()
+            timestamp = datetime.strptime(timestamp,'%d/%m/%Y %H:%M')
+
+            source = 'etnet'
+            source_id = str(hash(title))
+            tickers = ticker_list
+            title= title
+            time = timestamp
+            source_link = query
+            text = text
+            sector_code = None
+            text_hash = str(hash(title+text))
+            sentiment = None
+
+            doc = EtnetMongoDoc(
+                        unique_identifier=unique_identifier,
+                        tickers = tickers,
+                        sentiment=sentiment,
+                        sector_code=sector_code,
+                        source_link=source_link,
+                        time=time,
+                        source_id=source_id,
+                        text_hash=text_hash,
+                        title=title,
+                        text=text,
+                        source=source
+                    )
+
+            try:
+                self.add_document(doc, query)
+                return True
+            except Exception as e:
+                self.logger.info(f"Payload failed to migrate to mongo. {query}")
+                self.logger.debug(f"Failed Insertion into Mongo: {e}")
+                self.failed_queries.append(query)
                 return False
-        else:
+                
+        except:
+            # Some error occurred, skip this record
             self.skipped_queries.append(query)
-            return False
\ No newline at end of file
+            return False
@@ -2,27 +2,23 @@ __author__ = "Srijan Saxena"
 __email__ = "srijan@loratechai.com"
 
 import json
-from typing import Dict, Generator, Iterator
+from typing import Dict, Generator, Iterator, List, Optional
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
-from utils.general_utils import get_configs, get_sector_dict, get_sector_loose
+from utils.general_utils import get_configs
+from utils.universe_index import UniverseIndex
 import logging
 from datetime import datetime
 
-@dataclass
-class __NewsfilterMongoDocBase(MongoDocBase):
+@mongo_doc
+class NewsfilterMongoDoc(MongoDocBase):
     title: str
     description: str
     text: str
     source: str
 
-@dataclass
-class NewsfilterMongoDoc(MongoDocDefaultsBase, __NewsfilterMongoDocBase):
-    pass
-
 
 class Newsfilter(Lurker):
     """
@@ -34,7 +30,10 @@ class Newsfilter(Lurker):
         duration (int): Optional, the duration of the documents you want to scrape from.
 
     """
-    def __init__(self, ticker, duration = 7, **kwargs):
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['title', 'description', 'text']
+
+    def __init__(self, ticker=None, duration = 7, **kwargs):
         # Set logger
         log_fmt = '%(asctime)s %(levelname)s %(message)s'
         logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -54,9 +53,10 @@ class Newsfilter(Lurker):
             self.QUERY_API = api_configs['query_api']
             self.RENDER_API = api_configs['render_api']
 
-            self.sector_dict = get_sector_dict(self.universe_collection)
+            self.universe_index = UniverseIndex.from_collection(self.universe_collection)
 
             self.ticker = ticker
+            self.days = range(self.DURATION)
 
         except Exception as e:
             self.logger.error(e)
@@ -70,10 +70,48 @@ class Newsfilter(Lurker):
         Yields:
             Generator[str, None, None]: queries needed by get_document()
         """
-        for j in range(self.DURATION):
-            queryString = f'symbols:{self.ticker} AND publishedAt:[now-{j}d/d TO *]  AND NOT title:\"4 Form\"'
+        for j in self.days:
+            # One query per day, so that a day can be scraped on its own
+            if j == 0:
+                published_at = 'publishedAt:[now/d TO *]'
+            else:
+                published_at = f'publishedAt:[now-{j}d/d TO now-{j - 1}d/d}}'
+            queryString = f'symbols:{self.ticker} AND {published_at}  AND NOT title:\"4 Form\"'
             yield queryString
 
+    def set_task(self, payload: str):
+        """
+        Sets the ticker to scrape for the next job.
+
+        Args:
+            payload (str): The ticker to scrape, "<ticker>@<day>" for a single day of it
+        """
+        super().set_task(payload)
+        ticker, _, day = payload.partition('@')
+        self.ticker = ticker
+        self.days = [int(day)] if day else range(self.DURATION)
+
+    @classmethod
+    def shard_payload(cls, payload: str, duration_days: int) -> List[str]:
+        """
+        Splits a ticker into one sub-task per day, so that a heavily covered ticker is spread across workers.
+
+        Args:
+            payload (str): The ticker
+            duration_days (int): how many days back the task scrapes.
+
+        Returns:
+            List[str]: "<ticker>@<day>" payloads
+        """
+        return [f"{payload}@{day}" for day in range(duration_days)]
+
+    @classmethod
+    def window_secs(cls, payload: str) -> Optional[int]:
+        """
+        A "<ticker>@<day>" payload scrapes a single day.
+        """
+        return 86400 if '@' in payload else None
+
     def get_scraper_params(self) -> dict:
         """
         No special extra params. Superclass Abstract Method implementation used.
@@ -103,7 +141,7 @@ class Newsfilter(Lurker):
             str: the full text of news
         """
         url = self.RENDER_API.replace('{article_id}', str(article_id))
-        response = requests.get(url, params={'token': self.API_KEY})
+        response = self.session.get(url, params={'token': self.API_KEY})
         if response.status_code == 200:
             content = BeautifulSoup((response.text), 'lxml').get_text()
         return content
@@ -129,7 +167,7 @@ class Newsfilter(Lurker):
 
         for _ in range(self.NUM_RETRIES):
             try:
-                response = requests.post(self.QUERY_API, data=json_data_bytes, headers=headers)
+                response = self.session.post(self.QUERY_API, data=json_data_bytes, headers=headers)
                 if response.status_code == 200:
                     content = response.json()
                     break
@@ -149,7 +187,9 @@ class Newsfilter(Lurker):
             payload['from'] += payload['size']
 
             articles = content['articles']
-            for article in articles:
+
+            # Claim the page in the history db a batch at a time, as the texts are fetched
+            for article in self.claimInBatches(articles, lambda article: article['id']):
                 source_id = article['id']
                 
                 # Get UniqueIdentifier
@@ -163,7 +203,7 @@ class Newsfilter(Lurker):
                     time = datetime.strptime(article['publishedAt'][0:10], "%Y-%m-%d")
                     source_link = article['url']
                     text = self.__get_text_from_id(source_id)
-                    sector_code = get_sector_loose(tickers, self.sector_dict)
+                    sector_code = self.universe_index.get_sector_loose(tickers)
                     text_hash = str(hash(title+description+text))
                     sentiment = None
 
@@ -183,8 +223,7 @@ class Newsfilter(Lurker):
                     )
 
                     try:
-                        self.successful_documents.append(asdict(doc))
-                        self.successful_queries.append(query)
+                        self.add_document(doc, query)
                     except Exception as e:
                         self.failed_queries.append(query)
                 else:
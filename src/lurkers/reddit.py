@@ -2,10 +2,9 @@ __author__ = "Srijan Saxena"
 __email__ = "srijan@loratechai.com"
 
 import json
-from typing import Dict, Generator, Iterator
+from typing import Dict, Generator, Iterator, Optional
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
 from utils.general_utils import get_configs, get_stock_list
@@ -17,23 +16,21 @@ import random
 from time import sleep
 
 
-@dataclass
-class __RedditMongoDocBase(MongoDocBase):
+@mongo_doc
+class RedditMongoDoc(MongoDocBase):
     text: str
     source: str
 
 
-@dataclass
-class RedditMongoDoc(MongoDocDefaultsBase, __RedditMongoDocBase):
-    pass
-
-
 class Reddit(Lurker):
     """
 
     Reddit Lurker class, using pushshift API, the default duration_hr is 2 hrs 
 
     """
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['text']
+
 
     def __init__(self, duration_hr: int = 12, offset_hr: int = 0, **kwargs):
         """[summary]
@@ -100,6 +97,26 @@ class Reddit(Lurker):
         for j in range(self.DURATION_HR):
             yield (f"{j+self.OFFSET_HR}h", f"{j+1+self.OFFSET_HR}h")
 
+    def set_task(self, payload: str):
+        """
+        Sets the scraping period for the next job.
+
+        Args:
+            payload (str): "<duration_hr>-<offset_hr>"
+        """
+        super().set_task(payload)
+        duration_hr, offset_hr = payload.split('-')
+        self.DURATION_HR = int(duration_hr)
+        self.OFFSET_HR = int(offset_hr)
+
+    @classmethod
+    def window_secs(cls, payload: str) -> Optional[int]:
+        """
+        The "<duration_hr>-<offset_hr>" window of the payload lasts duration_hr.
+        """
+        duration_hr, _ = payload.split('-')
+        return int(duration_hr) * 3600
+
     def get_scraper_params(self) -> dict:
         """
         No special extra params. Superclass Abstract Method implementation used.
@@ -116,7 +133,7 @@ class Reddit(Lurker):
         Returns:
             str: text
         """
-        return doc['title'] + doc['description'] + doc['text']
+        return doc['text']
 
     def __get_text_from_id(self, article_id) -> str:
         """
@@ -129,7 +146,7 @@ class Reddit(Lurker):
             str: the full text of news
         """
         url = self.RENDER_API.replace('{article_id}', str(article_id))
-        response = requests.get(url, params={'token': self.API_KEY})
+        response = self.session.get(url, params={'token': self.API_KEY})
         if response.status_code == 200:
             content = BeautifulSoup((response.text), 'lxml').get_text()
         return content
@@ -142,7 +159,7 @@ class Reddit(Lurker):
         # get resource from pushshift API
         for data_source in self.data_sources:
             while True:
-                response = requests.get(
+                response = self.session.get(
                     base, {"subreddit": data_source, 'size': 100, 'after': after, 'before': before})
                 if response.status_code != 200:
                     # if request fail, request too frequently, sleep for a while and ask again
@@ -152,6 +169,7 @@ class Reddit(Lurker):
                 break
 
             # processing the body
+            submissions = []
             for item in data:
 
                 # submissions with this key means the content is probabaly removed by the moderator
@@ -173,6 +191,12 @@ class Reddit(Lurker):
                 if len(tickers) == 0:
                     continue
 
+                submissions.append((item, ticker_timestamp, text, tickers))
+
+            # Claim the whole batch in the history db at once
+            self.claimArticles([item['id'] for item, _, _, _ in submissions])
+
+            for item, ticker_timestamp, text, tickers in submissions:
                 # Get UniqueIdentifier
                 unique_identifier = self.tryAddArticleToHistory(item['id'])
 
@@ -191,8 +215,7 @@ class Reddit(Lurker):
                     )
 
                     try:
-                        self.successful_documents.append(asdict(doc))
-                        self.successful_queries.append(item['id'])
+                        self.add_document(doc, item['id'])
                     except Exception as e:
                         self.failed_queries.append(item['id'])
                 else:
@@ -14,8 +14,7 @@ __email__ = "u3556578@connect.hku.hk"
 import json
 from typing import Dict, Generator, Iterator
 from base import Lurker
-from res.models.datamodels import MongoDocBase, MongoDocDefaultsBase
-from dataclasses import dataclass, asdict
+from res.models.datamodels import MongoDocBase, mongo_doc
 from bs4 import BeautifulSoup
 import requests
 from utils.general_utils import get_configs, get_sector_dict, get_sector_loose
@@ -38,17 +37,13 @@ LurkerTemplateMongoDoc(
 )
 """
 
-@dataclass
-class __LurkerTemplateMongoDocBase(MongoDocBase):
+@mongo_doc
+class LurkerTemplateMongoDoc(MongoDocBase):
     title: str
     description: str
     text: str
     source: str
 
-@dataclass
-class LurkerTemplateMongoDoc(MongoDocDefaultsBase, __LurkerTemplateMongoDocBase):
-    pass
-
 
 class LurkerTemplate(Lurker):
     """
@@ -60,7 +55,10 @@ class LurkerTemplate(Lurker):
         duration (int): Optional, the duration of the documents you want to scrape from.
 
     """
-    def __init__(self, ticker, duration = 7):
+    # Fields read by get_text(), the ES export only fetches these
+    TEXT_FIELDS = ['title', 'description', 'text']
+
+    def __init__(self, ticker, duration = 7, **kwargs):
         # Set logger
         log_fmt = '%(asctime)s %(levelname)s %(message)s'
         logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -68,7 +66,7 @@ class LurkerTemplate(Lurker):
 
         # Base Class Parameters
         configs = get_configs('res/configs/lurkertemplate-configs.yaml')
-        super().__init__(configs, logger)
+        super().__init__(configs, logger, **kwargs)
 
         try:            
             # Subclass Params (Optional)
@@ -136,7 +134,9 @@ class LurkerTemplate(Lurker):
             record_list = []
 
             try:
-                self.mongo_collection.insert_many(record_list, ordered=False)
+                # Written to mongodb in the background
+                for record in record_list:
+                    self.writer.add(record)
                 
             except Exception as e:
                 failed_payloads += 1
@@ -1,7 +1,62 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import List, Union
+from operator import attrgetter
+from typing import Callable, List, Tuple, Union
 
+# Dataclass -> (field names, getter of their values), built once per class
+_ENCODERS = {}
+
+def _encoder(cls: type) -> Tuple[Tuple[str, ...], Callable]:
+    encoder = _ENCODERS.get(cls)
+    if encoder is None:
+        names = tuple(f.name for f in fields(cls))
+        getter = attrgetter(*names) if len(names) > 1 else (lambda doc: (getattr(doc, names[0]),))
+        encoder = _ENCODERS[cls] = (names, getter)
+    return encoder
+
+def to_document(doc) -> dict:
+    """
+    Converts a dataclass instance to a BSON-ready mapping, a shallow alternative to asdict().
+    Works with slotted (see slotted()) and regular dataclasses.
+
+    Field values are not copied: lists and dicts (i.e. tickers) are shared with the instance,
+    which must not be modified after. Nested dataclasses are not converted.
+
+    Args:
+        doc (obj): dataclass instance.
+
+    Returns:
+        dict: field name -> value.
+    """
+    names, getter = _encoder(type(doc))
+    return dict(zip(names, getter(doc)))
+
+def slotted(cls: type) -> type:
+    """
+    Rebuilds a dataclass with __slots__ for its own fields, so that its instances have no __dict__.
+    Python 3.7 dataclasses have no slots=True; defaults are bound in the generated __init__ already.
+
+    All the bases of the dataclass must be slotted too for its instances to be compact.
+
+    Args:
+        cls (type): dataclass.
+
+    Returns:
+        type: slotted dataclass.
+    """
+    inherited = {name for base in cls.__mro__[1:] for name in getattr(base, '__slots__', ())}
+    names = tuple(f.name for f in fields(cls) if f.name not in inherited)
+
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = names
+    for name in names:
+        # Class attributes holding the defaults would shadow the slots
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+@slotted
 @dataclass
 class BaseDoc:
     """
@@ -14,7 +69,14 @@ class BaseDoc:
     source_link: Union[str, None]
     time: datetime
 
+    def to_document(self) -> dict:
+        """
+        Converts the document to a BSON-ready mapping, without copying its fields. See to_document().
+        """
+        return to_document(self)
+
 
+@slotted
 @dataclass
 class ESDoc(BaseDoc):
     """
@@ -22,6 +84,7 @@ class ESDoc(BaseDoc):
     """
     text: str
 
+@slotted
 @dataclass
 class ESAction:
     """
@@ -32,15 +95,50 @@ class ESAction:
     _op_type: str = 'create'
     pipeline: str = 'add-timestamp'
 
+@slotted
 @dataclass
 class MongoDocBase(BaseDoc):
     """
     Dataclass to represent documents stored in MongoDB.
+    The documents of a lurker are declared with mongo_doc(), which adds its fields.
     """
     source_id: str
     text_hash: str
 
-@dataclass
-class MongoDocDefaultsBase:
-    retrieval_time: datetime = field(default_factory=datetime.now)
-    just_insert: bool = True
\ No newline at end of file
+def _mongo_doc_defaults() -> List[Tuple[str, type, object]]:
+    """
+    Fields with defaults of every mongo document, declared after the fields of the lurker.
+    """
+    return [
+        ('retrieval_time', datetime, field(default_factory=datetime.now)),
+        ('just_insert', bool, field(default=True)),
+    ]
+
+def mongo_doc(cls: type) -> type:
+    """
+    Class decorator declaring the mongo documents of a lurker, i.e.:
+
+        @mongo_doc
+        class EtnetMongoDoc(MongoDocBase):
+            title: str
+            text: str
+
+    The class gets the fields of MongoDocBase, then its own fields, then retrieval_time and just_insert.
+    It is made a slotted dataclass.
+
+    Args:
+        cls (type): subclass of MongoDocBase declaring the fields of the lurker.
+
+    Returns:
+        type: the slotted dataclass.
+    """
+    if not issubclass(cls, MongoDocBase):
+        raise TypeError(f"{cls.__name__} must derive from MongoDocBase")
+
+    annotations = dict(cls.__dict__.get('__annotations__', {}))
+    for name, type_, default in _mongo_doc_defaults():
+        annotations[name] = type_
+        setattr(cls, name, default)
+    cls.__annotations__ = annotations
+
+    return slotted(dataclass(cls))
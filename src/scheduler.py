@@ -0,0 +1,106 @@
+# Re-enqueues the tasks of a continuous work queue on per-source cadences
+
+import math
+import time
+from typing import Dict, List
+from workqueue.rediswq import RedisWQ
+import logging
+from utils.general_utils import get_configs
+from utils.database_utils import connect_to_mongodb
+from workqueue_setup import build_tasks, update_universe
+import os
+
+log_fmt = '%(asctime)s %(levelname)s %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+logger = logging.getLogger(__name__)
+
+class Scheduler():
+    """
+    Keeps a continuous work queue fed: every task is enqueued again once its lurker's cadence elapsed.
+
+    Args:
+        wq (RedisWQ): the work queue.
+        cadence_secs (Dict[str, int]): lurker type -> seconds between two runs of its tasks.
+        default_cadence_secs (int): cadence of the lurker types not in cadence_secs.
+    """
+    def __init__(self, wq: RedisWQ, cadence_secs: Dict[str, int] = None, default_cadence_secs: int = 3600):
+        self.wq = wq
+        self.cadence_secs = cadence_secs or {}
+        self.default_cadence_secs = default_cadence_secs
+        self.task_lanes = {}
+
+    def cadence(self, task: str) -> int:
+        """
+        Returns the cadence of a task, from its lurker type.
+        """
+        lurker_type = task.split(":")[0]
+        return self.cadence_secs.get(lurker_type, self.default_cadence_secs)
+
+    def set_tasks(self, lanes: Dict[str, List[str]]):
+        """
+        Sets the tasks to schedule. New tasks are due now, and tasks that are gone are unscheduled.
+
+        Args:
+            lanes (Dict[str, List[str]]): lane -> tasks, as built by build_tasks().
+        """
+        self.task_lanes = {task: lane for lane, tasks in lanes.items() for task in tasks}
+
+        gone = [task for task in self.wq.scheduled() if task not in self.task_lanes]
+        self.wq.unschedule(gone)
+        added = self.wq.schedule(self.task_lanes)
+        logger.info(f"Scheduled {added} new tasks, unscheduled {len(gone)}")
+
+    def tick(self, limit: int = 1000) -> int:
+        """
+        Enqueues the tasks that are due.
+
+        Returns:
+            int: number of tasks enqueued.
+        """
+        now = time.time()
+        batches = {}
+        for task in self.wq.due_tasks(now, limit=limit):
+            lane = self.task_lanes.get(task)
+            if lane is None:
+                # Scheduled by an older universe, set_tasks() will drop it
+                continue
+            batches.setdefault((lane, self.cadence(task)), []).append(task)
+
+        enqueued = 0
+        for (lane, cadence), tasks in batches.items():
+            enqueued += self.wq.enqueue_due(tasks, next_due=now + cadence, lane=lane)
+        return enqueued
+
+def main():
+    config = get_configs('res/configs/setup_configs.yaml')
+    universe_collection = connect_to_mongodb(config['universe_collection'])
+    redis_wqs = config['redis_wqs'] # One Global Queue
+    lurkers_collection = config['lurkers_collection']
+    hot_tickers = set(config.get('hot_tickers') or [])
+
+    cadence_secs = config.get('cadence_secs', {})
+    default_cadence_secs = config.get('default_cadence_secs', 3600)
+    tick_secs = config.get('scheduler_tick_secs', 5)
+    refresh_secs = config.get('universe_refresh_secs', 3600)
+
+    wq = RedisWQ(name=redis_wqs, host=os.getenv("REDIS_SERVICE_HOST"))
+    scheduler = Scheduler(wq, cadence_secs=cadence_secs, default_cadence_secs=default_cadence_secs)
+
+    # The lurkers that are not by ticker only need to cover the longest cadence
+    hours = math.ceil(max(list(cadence_secs.values()) + [default_cadence_secs]) / 3600)
+
+    last_refresh = 0
+    while True:
+        if time.time() - last_refresh >= refresh_secs:
+            update_universe(universe_collection=universe_collection)
+            tickers = universe_collection.distinct('ticker_symbol')
+            scheduler.set_tasks(build_tasks(lurkers_collection, tickers, hours=hours, hot_tickers=hot_tickers))
+            last_refresh = time.time()
+
+        enqueued = scheduler.tick()
+        if enqueued:
+            logger.info(f"Enqueued {enqueued} due tasks")
+        time.sleep(tick_secs)
+
+if __name__ == "__main__":
+    main()
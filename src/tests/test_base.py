@@ -0,0 +1,177 @@
+import unittest
+from unittest import mock
+from lurkers import Etnet
+from base import Lurker
+from utils.database_utils import BufferedMongoWriter
+from utils.http_utils import AsyncFetcher
+from tests.test_http_utils import LocalServer
+
+class FakeHistoryDB:
+    """
+    History db recording the claims, where the items in seen are already claimed.
+    """
+    def __init__(self, seen: set = ()):
+        self.seen = set(seen)
+        self.claims = []
+
+    def tryAddMany(self, items: list, lease_secs: int = 604800) -> list:
+        self.claims.append(list(items))
+        added = [item for item in items if item not in self.seen]
+        self.seen.update(added)
+        return added
+
+    def tryAdd(self, item: str, lease_secs: int = 604800):
+        self.claims.append([item])
+        if item in self.seen:
+            return False
+        self.seen.add(item)
+        return item
+
+class TestClaimInBatches(unittest.TestCase):
+
+    def setUp(self):
+        # Only the history db bookkeeping is exercised, no connection is needed
+        self.lurker = Etnet.__new__(Etnet)
+        self.lurker.history_db = FakeHistoryDB(seen={'2'})
+        self.lurker.MAX_IN_FLIGHT = 3
+        self.lurker._dry_run = False
+        self.lurker.reset_job()
+
+    def test_claimsBatchesAsTheyAreScraped(self):
+        queries = self.lurker.claimInBatches([str(i) for i in range(7)], lambda query: query)
+        self.assertEqual(self.lurker.history_db.claims, [])
+
+        self.assertEqual(next(queries), '0')
+        self.assertEqual(self.lurker.history_db.claims, [['0', '1', '2']])
+
+        self.assertEqual(list(queries), [str(i) for i in range(1, 7)])
+        self.assertEqual(self.lurker.history_db.claims, [['0', '1', '2'], ['3', '4', '5'], ['6']])
+
+    def test_stoppingEarlyLeavesTheListingUnclaimed(self):
+        for query in self.lurker.claimInBatches([str(i) for i in range(7)], lambda query: query):
+            if query == '1':
+                break
+        self.assertEqual(self.lurker.history_db.seen, {'0', '1', '2'})
+
+    def test_dryrunClaimsOneQueryAtATime(self):
+        self.lurker._dry_run = True
+        queries = self.lurker.claimInBatches(['0', '1', '2'], lambda query: query)
+        next(queries)
+        self.assertEqual(self.lurker.history_db.claims, [['0']])
+
+    def test_skipsQueriesWithoutIdentifier(self):
+        queries = list(self.lurker.claimInBatches(['0', 'x', '1'], lambda query: None if query == 'x' else query))
+        self.assertEqual(queries, ['0', 'x', '1'])
+        self.assertEqual(self.lurker.history_db.claims, [['0', '1']])
+
+    def test_tryAddReusesTheClaims(self):
+        for query in self.lurker.claimInBatches(['0', '1', '2'], lambda query: query):
+            pass
+        self.assertEqual(self.lurker.tryAddArticleToHistory('1'), '1')
+        self.assertFalse(self.lurker.tryAddArticleToHistory('2'))
+        # Answered from the claims, without another round-trip
+        self.assertEqual(len(self.lurker.history_db.claims), 1)
+
+    def test_claimArticleSkipsClaimedArticles(self):
+        self.assertEqual(self.lurker.claimArticle('https://www.etnet.com.hk/ETN1'), 'ETN1')
+        self.assertIsNone(self.lurker.claimArticle('https://www.etnet.com.hk/ETN1'))
+        self.assertEqual(self.lurker.skipped_queries, ['https://www.etnet.com.hk/ETN1'])
+        # Not an article, nothing to claim
+        self.assertIsNone(self.lurker.claimArticle('https://www.etnet.com.hk/'))
+        self.assertEqual(len(self.lurker.history_db.claims), 2)
+
+class TestScrape(unittest.TestCase):
+
+    def test_logsWriteOutcomes(self):
+        # Only scrape() is exercised, no connection is needed
+        lurker = Etnet.__new__(Etnet)
+        lurker.logger = mock.Mock()
+        lurker.writer = mock.Mock()
+        lurker.ASYNC_SCRAPE = False
+        lurker.reset_job()
+        lurker.scraper_iterator = lambda: ['0', '1', '2']
+        lurker.get_scraper_params = lambda: {}
+        outcomes = {'0': BufferedMongoWriter.INSERTED, '1': BufferedMongoWriter.DUPLICATE, '2': BufferedMongoWriter.INSERTED}
+        def get_document(query):
+            lurker.successful_queries.append(query)
+            lurker._count_write_outcome({}, outcomes[query])
+        lurker.get_document = get_document
+
+        lurker.scrape()
+        lurker.writer.flush.assert_called_once()
+        lurker.logger.info.assert_called_with(
+            'Etnet fininshes running! 2 records inserted. 1 duplicate records. 0 records failed. 0 queries failed.'
+        )
+
+class TestScrapeAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.addCleanup(self.server.close)
+
+        # Only scrape_async() is exercised, no connection is needed
+        self.lurker = Etnet.__new__(Etnet)
+        self.lurker.MAX_IN_FLIGHT = 3
+        self.lurker.fetcher = AsyncFetcher(max_in_flight=3, per_host_limit=3)
+        self.addCleanup(self.lurker.fetcher.close)
+        self.lurker.logger = mock.Mock()
+        self.lurker.reset_job()
+
+        self.in_flight, self.max_in_flight = 0, 0
+        self.fetchers = set()
+        self.lurker.get_document_async = self.get_document_async
+
+    async def get_document_async(self, query, fetcher, **kwargs):
+        self.fetchers.add(fetcher)
+        if query == 'fail':
+            raise ValueError(query)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            status, body = await fetcher.get(self.server.url + '?sleep=0.05')
+        finally:
+            self.in_flight -= 1
+        self.lurker.successful_queries.append(query)
+        return status == 200
+
+    def scrape(self, queries: list):
+        self.lurker.fetcher.run(self.lurker.scrape_async(iter(queries), {}))
+
+    def test_scrapesEveryQueryOnce(self):
+        queries = [str(i) for i in range(10)]
+        self.scrape(queries)
+        self.assertEqual(sorted(self.lurker.successful_queries), sorted(queries))
+        self.assertEqual(self.server.requests, 10)
+
+    def test_boundsDocumentsInFlight(self):
+        self.scrape([str(i) for i in range(10)])
+        self.assertEqual(self.max_in_flight, 3)
+
+    def test_recordsFailedQueries(self):
+        self.scrape(['0', 'fail', '1'])
+        self.assertEqual(self.lurker.failed_queries, ['fail'])
+        self.assertEqual(sorted(self.lurker.successful_queries), ['0', '1'])
+
+    def test_reusesFetcherAcrossJobs(self):
+        self.scrape(['0', '1'])
+        session = self.lurker.fetcher._session
+        self.lurker.reset_job()
+        self.scrape(['2', '3'])
+        self.assertEqual(self.fetchers, {self.lurker.fetcher})
+        self.assertIs(self.lurker.fetcher._session, session)
+
+    def test_defaultsToGetDocumentInExecutor(self):
+        self.lurker.get_document = lambda query, **kwargs: self.lurker.successful_queries.append(query) or True
+        self.assertTrue(self.lurker.fetcher.run(Lurker.get_document_async(self.lurker, '0', self.lurker.fetcher)))
+        self.assertEqual(self.lurker.successful_queries, ['0'])
+
+    def test_fetchPageAsyncRetries(self):
+        self.lurker.NUM_RETRIES = 2
+        fetcher = AsyncFetcher(read_timeout_secs=0.2)
+        self.addCleanup(fetcher.close)
+        self.assertIsNone(fetcher.run(self.lurker.fetch_page_async(self.server.url + '?sleep=0.5', fetcher)))
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(fetcher.run(self.lurker.fetch_page_async(self.server.url, fetcher)), b'ok')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import threading
+import time
+import unittest
+from datetime import datetime
+from bson import ObjectId
+import pymongo
+from pymongo.errors import BulkWriteError, OperationFailure
+from res.models.datamodels import MongoDocBase, mongo_doc
+from utils.database_utils import BufferedMongoWriter, ensure_unique_index
+
+class FakeResult:
+    def __init__(self, upserted_ids: dict):
+        self.upserted_ids = upserted_ids
+
+class FakeCollection:
+    """
+    In-memory collection with the write semantics BufferedMongoWriter relies on: unordered
+    insert_many() and bulk_write() of upserts, a unique index on unique_identifier, and the
+    BulkWriteError details of mongo. Documents with 'fail' set get a non-duplicate write error.
+    """
+    full_name = 'test.fake'
+
+    def __init__(self, key: str = 'unique_identifier'):
+        self.key = key
+        self.docs = []
+        self.calls = []
+        # Cleared to hold the writes, i.e. to simulate a slow database
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _exists(self, value) -> bool:
+        return any(doc.get(self.key) == value for doc in self.docs)
+
+    def _raise(self, errors: list, upserted: list, inserted: int):
+        raise BulkWriteError({'writeErrors': errors, 'upserted': upserted, 'nInserted': inserted})
+
+    def insert_many(self, docs: list, ordered: bool = True):
+        self.gate.wait()
+        self.calls.append(('insert_many', len(docs)))
+        errors = []
+        for i, doc in enumerate(docs):
+            doc.setdefault('_id', ObjectId())
+            if doc.get('fail'):
+                errors.append({'index': i, 'code': 2, 'errmsg': 'BadValue'})
+            elif doc.get(self.key) and self._exists(doc[self.key]):
+                errors.append({'index': i, 'code': 11000, 'errmsg': 'E11000 duplicate key error'})
+            else:
+                self.docs.append(doc)
+        if errors:
+            self._raise(errors, [], len(docs) - len(errors))
+
+    def create_index(self, keys, **kwargs):
+        self.calls.append(('create_index', keys, kwargs))
+        if self._exists_duplicates():
+            raise OperationFailure('E11000 duplicate key error', code=11000)
+        return kwargs['name']
+
+    def _exists_duplicates(self) -> bool:
+        values = [doc[self.key] for doc in self.docs if doc.get(self.key)]
+        return len(values) != len(set(values))
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> FakeResult:
+        self.gate.wait()
+        self.calls.append(('bulk_write', len(operations)))
+        errors, upserted = [], {}
+        for i, operation in enumerate(operations):
+            doc = dict(operation._doc['$setOnInsert'])
+            if self._exists(operation._filter[self.key]):
+                # Matched, nothing is written
+                continue
+            if doc.get('fail'):
+                errors.append({'index': i, 'code': 2, 'errmsg': 'BadValue'})
+                continue
+            doc['_id'] = ObjectId()
+            self.docs.append(doc)
+            upserted[i] = doc['_id']
+        if errors:
+            self._raise(errors, [{'index': i, '_id': id} for i, id in upserted.items()], 0)
+        return FakeResult(upserted)
+
+def wait_until(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+@mongo_doc
+class WriterTestMongoDoc(MongoDocBase):
+    text: str
+
+class TestBufferedMongoWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection()
+        self.outcomes = []
+
+    def writer(self, **kwargs) -> BufferedMongoWriter:
+        kwargs.setdefault('flush_secs', 60)
+        writer = BufferedMongoWriter(self.collection, on_outcome=lambda doc, outcome: self.outcomes.append(outcome), **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_writesFullBatches(self):
+        writer = self.writer(batch_size=3)
+        for i in range(7):
+            writer.add({'unique_identifier': str(i)})
+        self.assertTrue(wait_until(lambda: len(self.collection.calls) == 2))
+        self.assertEqual(self.collection.calls, [('insert_many', 3), ('insert_many', 3)])
+
+        writer.close()
+        self.assertEqual(self.collection.calls[-1], ('insert_many', 1))
+        self.assertEqual(len(self.collection.docs), 7)
+
+    def test_writesPartialBatchAfterFlushSecs(self):
+        writer = self.writer(batch_size=100, flush_secs=0.2)
+        writer.add({'unique_identifier': '1'})
+        writer.add({'unique_identifier': '2'})
+        self.assertTrue(wait_until(lambda: len(self.collection.docs) == 2))
+        self.assertEqual(self.collection.calls, [('insert_many', 2)])
+
+    def test_flushWritesPendingDocuments(self):
+        writer = self.writer(batch_size=100)
+        for i in range(3):
+            writer.add({'unique_identifier': str(i)})
+        writer.flush()
+        self.assertEqual(len(self.collection.docs), 3)
+        self.assertEqual(writer.inserted, 3)
+        self.assertTrue(writer.is_alive())
+
+    def test_closeDrainsPendingDocuments(self):
+        writer = self.writer(batch_size=2)
+        for i in range(5):
+            writer.add({'unique_identifier': str(i)})
+        writer.close()
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(len(self.collection.docs), 5)
+        self.assertEqual(self.outcomes, [BufferedMongoWriter.INSERTED] * 5)
+
+    def test_addBlocksWhileBufferIsFull(self):
+        self.collection.gate.clear()
+        writer = self.writer(batch_size=1, max_pending=2)
+        # The writer holds the first document, the next two fill the buffer
+        for i in range(3):
+            writer.add({'unique_identifier': str(i)})
+
+        blocked = threading.Thread(target=writer.add, args=({'unique_identifier': '3'},))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+
+        self.collection.gate.set()
+        blocked.join(2)
+        self.assertFalse(blocked.is_alive())
+        writer.close()
+        self.assertEqual(len(self.collection.docs), 4)
+
+    def test_convertsDocumentModels(self):
+        writer = self.writer()
+        writer.add(WriterTestMongoDoc('1', [], None, 2, None, datetime.now(), '', '', 'text'))
+        writer.close()
+        self.assertEqual(self.collection.docs[0]['text'], 'text')
+        self.assertTrue(self.collection.docs[0]['just_insert'])
+
+    def test_survivesUnexpectedErrors(self):
+        def broken_insert_many(docs, ordered=True):
+            raise RuntimeError('connection lost')
+        self.collection.insert_many = broken_insert_many
+        writer = self.writer()
+        writer.add({'unique_identifier': '1'})
+        writer.flush()
+        self.assertEqual(writer.failed, 1)
+        self.assertTrue(writer.is_alive())
+
+class TestWriteOutcomes(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection()
+        self.collection.docs.append({'_id': ObjectId(), 'unique_identifier': 'old'})
+
+    def write(self, docs: list, upsert: bool) -> dict:
+        outcomes = {}
+        writer = BufferedMongoWriter(self.collection, batch_size=100, upsert=upsert,
+                                     on_outcome=lambda doc, outcome: outcomes.setdefault(doc['unique_identifier'], []).append(outcome))
+        for doc in docs:
+            writer.add(doc)
+        writer.close()
+        return outcomes
+
+    def test_upsertInsertsNewDocuments(self):
+        outcomes = self.write([{'unique_identifier': 'new', 'text': 'text'}], upsert=True)
+        self.assertEqual(outcomes, {'new': [BufferedMongoWriter.INSERTED]})
+        self.assertEqual(self.collection.calls, [('bulk_write', 1)])
+        self.assertEqual(self.collection.docs[-1]['text'], 'text')
+
+    def test_upsertSkipsExistingDocuments(self):
+        outcomes = self.write([{'unique_identifier': 'old', 'text': 'changed'}], upsert=True)
+        self.assertEqual(outcomes, {'old': [BufferedMongoWriter.DUPLICATE]})
+        # $setOnInsert: the stored document is left as is
+        self.assertEqual(len(self.collection.docs), 1)
+        self.assertNotIn('text', self.collection.docs[0])
+
+    def test_upsertDedupsWithinBatch(self):
+        outcomes = self.write([{'unique_identifier': 'new'}, {'unique_identifier': 'new'}], upsert=True)
+        self.assertEqual(outcomes, {'new': [BufferedMongoWriter.INSERTED, BufferedMongoWriter.DUPLICATE]})
+        self.assertEqual(len(self.collection.docs), 2)
+
+    def test_upsertMapsWriteErrors(self):
+        outcomes = self.write([
+            {'unique_identifier': 'a'},
+            {'unique_identifier': 'b', 'fail': True},
+            {'unique_identifier': 'old'},
+            {'unique_identifier': 'c'},
+        ], upsert=True)
+        self.assertEqual(outcomes, {
+            'a': [BufferedMongoWriter.INSERTED],
+            'b': [BufferedMongoWriter.FAILED],
+            'old': [BufferedMongoWriter.DUPLICATE],
+            'c': [BufferedMongoWriter.INSERTED],
+        })
+
+    def test_upsertCountsConcurrentDuplicateKeyAsDuplicate(self):
+        # Another writer inserted the same key between the match and the insert
+        def racing_bulk_write(operations, ordered=True):
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000'}], 'upserted': []})
+        self.collection.bulk_write = racing_bulk_write
+        outcomes = self.write([{'unique_identifier': 'new'}], upsert=True)
+        self.assertEqual(outcomes, {'new': [BufferedMongoWriter.DUPLICATE]})
+
+    def test_insertMapsWriteErrors(self):
+        outcomes = self.write([
+            {'unique_identifier': 'a'},
+            {'unique_identifier': 'old'},
+            {'unique_identifier': 'b', 'fail': True},
+        ], upsert=False)
+        self.assertEqual(outcomes, {
+            'a': [BufferedMongoWriter.INSERTED],
+            'old': [BufferedMongoWriter.DUPLICATE],
+            'b': [BufferedMongoWriter.FAILED],
+        })
+
+class TestEnsureUniqueIndex(unittest.TestCase):
+
+    def test_createsPartialUniqueIndex(self):
+        collection = FakeCollection()
+        self.assertTrue(ensure_unique_index(collection))
+        self.assertEqual(collection.calls, [('create_index', [('unique_identifier', pymongo.ASCENDING)], {
+            'name': 'unique_identifier_unique',
+            'unique': True,
+            # Documents without an identifier stay out of the index
+            'partialFilterExpression': {'unique_identifier': {'$gt': ''}},
+        })])
+
+    def test_reportsDuplicatedCollection(self):
+        collection = FakeCollection()
+        collection.docs += [{'unique_identifier': 'a'}, {'unique_identifier': 'a'}]
+        self.assertFalse(ensure_unique_index(collection))
+
+if __name__ == '__main__':
+    unittest.main()
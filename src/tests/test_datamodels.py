@@ -0,0 +1,58 @@
+import unittest
+from dataclasses import asdict
+from datetime import datetime
+from res.models.datamodels import MongoDocBase, mongo_doc, to_document
+
+@mongo_doc
+class SampleMongoDoc(MongoDocBase):
+    info: dict
+    text: str
+
+class TestToDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = SampleMongoDoc(
+            unique_identifier='111',
+            tickers=['0700.HK'],
+            sentiment=[],
+            sector_code=2,
+            source_link=[],
+            time=datetime.now(),
+            source_id='',
+            text_hash='',
+            info={'industry': {'code': '451'}},
+            text='text'
+        )
+
+    def test_matchesAsdict(self):
+        self.assertEqual(self.doc.to_document(), asdict(self.doc))
+
+    def test_keepsFieldOrder(self):
+        self.assertEqual(list(to_document(self.doc)), list(asdict(self.doc)))
+
+    def test_doesNotCopyFields(self):
+        document = to_document(self.doc)
+        self.assertIs(document['tickers'], self.doc.tickers)
+        self.assertIs(document['info'], self.doc.info)
+
+class TestMongoDoc(unittest.TestCase):
+
+    def test_hasDefaultsLast(self):
+        doc = SampleMongoDoc('111', [], [], 2, [], datetime.now(), '', '', {}, 'text')
+        self.assertTrue(doc.just_insert)
+        self.assertIsInstance(doc.retrieval_time, datetime)
+
+    def test_isSlotted(self):
+        doc = SampleMongoDoc('111', [], [], 2, [], datetime.now(), '', '', {}, 'text')
+        self.assertFalse(hasattr(doc, '__dict__'))
+        with self.assertRaises(AttributeError):
+            doc.title = 'title'
+
+    def test_mustDeriveFromMongoDocBase(self):
+        with self.assertRaises(TypeError):
+            @mongo_doc
+            class OtherMongoDoc:
+                text: str
+
+if __name__ == '__main__':
+    unittest.main()
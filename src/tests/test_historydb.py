@@ -1,6 +1,8 @@
 import os
 import unittest
+import uuid
 from historydb.redislease import RedisLease
+from historydb.bloomfilter import TimedBloomFilter
 from utils.general_utils import get_configs
 from time import sleep
 
@@ -41,5 +43,62 @@ class TestRedisLeaseMethods(unittest.TestCase):
         results = self._db.isExist(unique_identifier)
         self.assertFalse(results)
 
+    def test_canAddManyLeases(self):
+        batch = str(uuid.uuid4())
+        results = self._db.tryAddMany([batch + '333', batch + '444', batch + '333'], lease_secs=3)
+        self.assertEqual(results, [batch + '333', batch + '444'])
+
+    def test_cannotAddManyifExist(self):
+        batch = str(uuid.uuid4())
+        self._db.tryAdd(batch + '555', lease_secs=3)
+        results = self._db.tryAddMany([batch + '555', batch + '666'], lease_secs=3)
+        self.assertEqual(results, [batch + '666'])
+
+    def test_canConfirmPrefilteredLease(self):
+        batch = str(uuid.uuid4())
+        prefiltered_db = RedisLease(name=self.REDIS_HISTORY_DB, host=self.REDIS_HOST, prefilter=TimedBloomFilter(capacity=1000))
+        self.assertFalse(prefiltered_db.isExist(batch + '777'))
+        self.assertEqual(prefiltered_db.tryAddMany([batch + '777'], lease_secs=3), [batch + '777'])
+        self.assertTrue(prefiltered_db.isExist(batch + '777'))
+        self.assertFalse(prefiltered_db.tryAdd(batch + '777', lease_secs=3))
+        self.assertFalse(self._db.tryAdd(batch + '777', lease_secs=3))
+
+    def test_canClaimFalsePositive(self):
+        batch = str(uuid.uuid4())
+        prefilter = TimedBloomFilter(capacity=1000)
+        prefiltered_db = RedisLease(name=self.REDIS_HISTORY_DB, host=self.REDIS_HOST, prefilter=prefilter)
+        # The filter (wrongly) reports the item as seen, redis does not hold it
+        prefilter.add(batch + '888')
+        self.assertEqual(prefiltered_db.tryAdd(batch + '888', lease_secs=3), batch + '888')
+        prefilter.add(batch + '999')
+        self.assertEqual(prefiltered_db.tryAddMany([batch + '999'], lease_secs=3), [batch + '999'])
+
+    def test_prefilterOnlyRemembersClaims(self):
+        batch = str(uuid.uuid4())
+        self._db.tryAdd(batch + '000', lease_secs=3)
+        prefilter = TimedBloomFilter(capacity=1000)
+        prefiltered_db = RedisLease(name=self.REDIS_HISTORY_DB, host=self.REDIS_HOST, prefilter=prefilter)
+        self.assertEqual(prefiltered_db.tryAddMany([batch + '000', batch + '111'], lease_secs=3), [batch + '111'])
+        # Held by another worker, whose lease may end before the filter forgets it
+        self.assertNotIn(batch + '000', prefilter)
+        self.assertIn(batch + '111', prefilter)
+
+class TestTimedBloomFilterMethods(unittest.TestCase):
+
+    def setUp(self):
+        self._filter = TimedBloomFilter(capacity=1000, error_rate=0.001, window_secs=3, generations=3)
+
+    def test_canFindAddedItem(self):
+        self._filter.add('111')
+        self.assertTrue('111' in self._filter)
+
+    def test_cannotFindMissingItem(self):
+        self.assertFalse('222' in self._filter)
+
+    def test_canForgetExpiredItem(self):
+        self._filter.add('333')
+        sleep(3)
+        self.assertFalse('333' in self._filter)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
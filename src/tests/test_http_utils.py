@@ -0,0 +1,147 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+from requests.utils import get_environ_proxies
+from utils import http_utils
+from utils.http_utils import AsyncFetcher, TimeoutHTTPAdapter, build_http_session
+
+class LocalServer:
+    """
+    HTTP server in a background thread, recording the requests in flight.
+    GET /?sleep=<secs> answers 'ok' after sleeping.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.clients = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server.lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    server.requests += 1
+                    server.clients.add(self.client_address)
+                try:
+                    sleep = float(parse_qs(urlsplit(self.path).query).get('sleep', ['0'])[0])
+                    time.sleep(sleep)
+                    self.send_response(200)
+                    self.send_header('Content-Length', '2')
+                    self.end_headers()
+                    self.wfile.write(b'ok')
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}/'
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+class TestBuildHttpSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.addCleanup(self.server.close)
+        # Nothing listens on the proxy, only hosts in NO_PROXY can be reached
+        environ = mock.patch.dict(os.environ, {'HTTP_PROXY': 'http://127.0.0.1:9', 'NO_PROXY': '127.0.0.1'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.resolved = []
+        def counted_get_environ_proxies(url, no_proxy=None):
+            self.resolved.append(url)
+            return get_environ_proxies(url, no_proxy=no_proxy)
+        patcher = mock.patch.object(http_utils, 'get_environ_proxies', counted_get_environ_proxies)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolvesProxiesOncePerHost(self):
+        session = build_http_session()
+        self.assertFalse(session.trust_env)
+        for _ in range(3):
+            self.assertEqual(session.get(self.server.url).content, b'ok')
+        self.assertEqual(self.resolved, [self.server.url])
+
+    def test_usesEnvironmentProxies(self):
+        session = build_http_session()
+        settings = session.merge_environment_settings('http://example.com/', {}, None, None, None)
+        self.assertEqual(settings['proxies']['http'], 'http://127.0.0.1:9')
+        # Proxies given to a request win
+        settings = session.merge_environment_settings('http://example.com/', {'http': 'http://proxy:3128'}, None, None, None)
+        self.assertEqual(settings['proxies']['http'], 'http://proxy:3128')
+
+    def test_setsDefaultTimeouts(self):
+        session = build_http_session(connect_timeout_secs=3, read_timeout_secs=7)
+        adapter = session.get_adapter('https://example.com/')
+        self.assertIsInstance(adapter, TimeoutHTTPAdapter)
+        self.assertEqual(adapter.timeout, (3, 7))
+
+class TestAsyncFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.addCleanup(self.server.close)
+
+    def fetcher(self, **kwargs) -> AsyncFetcher:
+        fetcher = AsyncFetcher(**kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_canGet(self):
+        fetcher = self.fetcher()
+        self.assertEqual(fetcher.run(fetcher.get(self.server.url)), (200, b'ok'))
+
+    def test_reusesSessionAcrossRuns(self):
+        fetcher = self.fetcher()
+        fetcher.run(fetcher.get(self.server.url))
+        session = fetcher._session
+        fetcher.run(fetcher.get(self.server.url))
+        self.assertIs(fetcher._session, session)
+        # The keep-alive connection of the first job serves the second one
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_honoursEnvironment(self):
+        fetcher = self.fetcher()
+        fetcher.run(fetcher.get(self.server.url))
+        self.assertTrue(fetcher._session.trust_env)
+
+    def test_boundsRequestsPerHost(self):
+        fetcher = self.fetcher(max_in_flight=8, per_host_limit=2)
+
+        async def fetch_all():
+            return await asyncio.gather(*[fetcher.get(self.server.url + '?sleep=0.1') for _ in range(6)])
+
+        self.assertEqual(fetcher.run(fetch_all()), [(200, b'ok')] * 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    def test_timesOutSlowReads(self):
+        fetcher = self.fetcher(read_timeout_secs=0.2)
+        with self.assertRaises(asyncio.TimeoutError):
+            fetcher.run(fetcher.get(self.server.url + '?sleep=1'))
+
+    def test_canRunAfterClose(self):
+        fetcher = self.fetcher()
+        fetcher.run(fetcher.get(self.server.url))
+        fetcher.close()
+        self.assertIsNone(fetcher._session)
+        self.assertEqual(fetcher.run(fetcher.get(self.server.url)), (200, b'ok'))
+
+if __name__ == '__main__':
+    unittest.main()
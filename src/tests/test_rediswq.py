@@ -0,0 +1,269 @@
+import os
+import threading
+import time
+import unittest
+import uuid
+from workqueue.rediswq import RedisWQ
+from workqueue.heartbeat import LeaseHeartbeat
+from workqueue.reaper import LeaseReaper
+
+class TestRedisWQMethods(unittest.TestCase):
+
+    def setUp(self):
+        # Redis Params
+        self.REDIS_HOST = os.getenv("REDIS_SERVICE_HOST")
+        self.REDIS_WQS = f'redis_wq_unittest:{uuid.uuid4()}'
+
+        self._wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST)
+
+    def tearDown(self):
+        # Clean up the queue
+        self._wq.cleanup()
+
+    def test_canAddTasksInBulk(self):
+        results = self._wq.add_tasks([f'etnet:{i}' for i in range(25)], chunk_size=10, guard_empty=False)
+        self.assertEqual(results, 25)
+        self.assertFalse(self._wq.empty())
+
+    def test_cannotAddTasksIfEmpty(self):
+        results = self._wq.add_tasks(['etnet:700'])
+        self.assertEqual(results, 0)
+        self.assertTrue(self._wq.empty())
+
+    def test_canAddTasksIfNotEmpty(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        results = self._wq.add_tasks(['etnet:5', 'etnet:1'])
+        self.assertEqual(results, 2)
+
+    def test_canLeaseMany(self):
+        self._wq.add_tasks(['etnet:700', 'etnet:5', 'etnet:1'], guard_empty=False)
+        items = self._wq.lease_many(2, lease_secs=10)
+        self.assertEqual(items, ['etnet:1', 'etnet:5'])
+        self.assertTrue(all(self._wq._lease_exists(item) for item in items))
+
+    def test_canLeaseManyFromShortQueue(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        self.assertEqual(self._wq.lease_many(4), ['etnet:700'])
+        self.assertEqual(self._wq.lease_many(4), [])
+        self.assertFalse(self._wq.empty())
+
+    def test_canRenewOwnLeases(self):
+        self._wq.add_tasks(['etnet:700', 'etnet:5'], guard_empty=False)
+        items = self._wq.lease_many(2, lease_secs=10)
+        other_wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST)
+        self.assertEqual(sorted(self._wq.renew_leases(items, lease_secs=10)), sorted(items))
+        self.assertEqual(other_wq.renew_leases(items, lease_secs=10), [])
+
+    def test_cannotRenewCompletedLease(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        items = self._wq.lease_many(1, lease_secs=10)
+        self._wq.complete(items[0])
+        self.assertEqual(self._wq.renew_leases(items, lease_secs=10), [])
+
+    def test_cannotRenewExpiredLease(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        items = self._wq.lease_many(1, lease_secs=1)
+        time.sleep(1.5)
+        self.assertFalse(self._wq._lease_exists(items[0]))
+        self.assertEqual(self._wq.renew_leases(items, lease_secs=10), [])
+        self.assertFalse(self._wq.renew_lease(items[0], lease_secs=10))
+
+    def test_keepsLeaseStateInDeclaredKeys(self):
+        self._wq.add_tasks(['etnet:700', 'etnet:5'], guard_empty=False)
+        items = self._wq.lease_many(2, lease_secs=10)
+        self._wq.renew_leases(items, lease_secs=10)
+        # No per-item key built inside a script
+        self.assertEqual(sorted(self._wq._db.keys(f'{self.REDIS_WQS}*')), sorted([
+            self.REDIS_WQS + ':processing', self.REDIS_WQS + ':deadlines', self.REDIS_WQS + ':lease_info',
+            self.REDIS_WQS + ':lane_pass',
+        ]))
+
+    def test_canRequeueExpiredLease(self):
+        self._wq.add_tasks(['etnet:700', 'etnet:5'], guard_empty=False)
+        expired = self._wq.lease_many(1, lease_secs=1)
+        self._wq.lease_many(1, lease_secs=60)
+        time.sleep(2)
+        self.assertEqual(self._wq.check_expired_leases(), 1)
+        self.assertEqual(self._wq.get_retry_number(expired[0]), 1)
+        self.assertEqual(self._wq.lease_many(2), expired)
+
+    def test_canDropJobAfterMaxRetries(self):
+        wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, max_retries=0)
+        wq.add_tasks(['etnet:700'], guard_empty=False)
+        wq.lease_many(1, lease_secs=1)
+        time.sleep(2)
+        self.assertEqual(wq.check_expired_leases(), 0)
+        self.assertTrue(wq.empty())
+
+    def test_canRequeueOrphanJob(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        # Client crashed before creating the lease
+        self._wq._db.rpoplpush(self._wq._main_q_key, self._wq._processing_q_key)
+        self.assertEqual(self._wq.check_expired_leases(orphan_grace_secs=0), 1)
+        self.assertEqual(self._wq.lease_many(1), ['etnet:700'])
+
+    def test_onlyOneReaperLeads(self):
+        other_wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST)
+        self.assertTrue(self._wq.lead_reaper())
+        self.assertTrue(self._wq.lead_reaper())
+        self.assertFalse(other_wq.lead_reaper())
+        self._wq.resign_reaper()
+        self.assertTrue(other_wq.lead_reaper())
+
+    def test_reaperRequeuesExpiredLease(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        self._wq.lease_many(1, lease_secs=1)
+        time.sleep(2)
+        self.assertEqual(LeaseReaper(self._wq).reap(), 1)
+        self.assertEqual(self._wq.lease_many(1), ['etnet:700'])
+
+    def test_heartbeatRenewsTrackedLease(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        item = self._wq.lease(lease_secs=2, block=False)
+        heartbeat = LeaseHeartbeat(self._wq, lease_secs=2, interval_secs=0.5)
+        heartbeat.track([item])
+        heartbeat.start()
+        time.sleep(3)
+        heartbeat.stop()
+        self.assertTrue(self._wq._lease_exists(item))
+
+    def test_heartbeatStopsAfterMaxJobSecs(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        item = self._wq.lease(lease_secs=1, block=False)
+        heartbeat = LeaseHeartbeat(self._wq, lease_secs=1, interval_secs=0.2, max_job_secs=0.5)
+        heartbeat.track([item])
+        heartbeat.begin(item)
+        heartbeat.start()
+        time.sleep(2.5)
+        heartbeat.stop()
+        self.assertFalse(self._wq._lease_exists(item))
+        self.assertEqual(self._wq.check_expired_leases(), 1)
+
+    def test_heartbeatCountsMaxJobSecsFromBegin(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False)
+        item = self._wq.lease(lease_secs=2, block=False)
+        heartbeat = LeaseHeartbeat(self._wq, lease_secs=2, interval_secs=0.5, max_job_secs=1)
+        # Prefetched, its job has not begun
+        heartbeat.track([item])
+        heartbeat.start()
+        time.sleep(3)
+        self.assertTrue(self._wq._lease_exists(item))
+        heartbeat.begin(item)
+        time.sleep(3.5)
+        heartbeat.stop()
+        self.assertFalse(self._wq._lease_exists(item))
+
+    def test_blockingLeaseWaitsInRedis(self):
+        calls = []
+        lease_many = self._wq.lease_many
+        def counted_lease_many(*args, **kwargs):
+            calls.append(time.time())
+            return lease_many(*args, **kwargs)
+        self._wq.lease_many = counted_lease_many
+
+        self.assertIsNone(self._wq.lease(block=True, timeout=2))
+        # Once before blocking, once after the blocking pop timed out
+        self.assertLessEqual(len(calls), 2)
+
+    def test_blockingLeaseGetsNewItem(self):
+        timer = threading.Timer(0.2, self._wq.add_tasks, args=(['etnet:700'],), kwargs={'guard_empty': False})
+        timer.start()
+        started = time.time()
+        item = self._wq.lease(block=True, timeout=3)
+        self.assertEqual(item, 'etnet:700')
+        self.assertLess(time.time() - started, 1)
+        self.assertTrue(self._wq._lease_exists(item))
+        self.assertEqual(self._wq._db.lrange(self._wq._processing_q_key, 0, -1), [item])
+        timer.join()
+
+    def test_blockingLeaseWaitsOnAllLanes(self):
+        self._wq.add_tasks(['etnet:1'], guard_empty=False, lane='etnet')
+        self.assertEqual(self._wq.lease(block=False), 'etnet:1')
+        timer = threading.Timer(0.2, self._wq.add_tasks, args=(['etnet:700'],), kwargs={'guard_empty': False, 'lane': 'etnet'})
+        timer.start()
+        started = time.time()
+        item = self._wq.lease(block=True, timeout=3)
+        self.assertEqual(item, 'etnet:700')
+        self.assertLess(time.time() - started, 1)
+        self.assertTrue(self._wq._lease_exists(item))
+        self.assertEqual(self._wq._db.lrange(self._wq._processing_q_key, 0, -1), [item, 'etnet:1'])
+        timer.join()
+
+    def test_canLeaseFromLaneRegisteredByOtherClient(self):
+        wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, lane_refresh_secs=0)
+        self.assertEqual(wq.lease_many(1), [])
+        self._wq.add_tasks(['etnet:700'], guard_empty=False, lane='etnet')
+        self.assertEqual(wq.lease_many(1), ['etnet:700'])
+
+    def test_canLeaseFromLanesByWeight(self):
+        wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, lane_weights={'hot': 3})
+        wq.add_tasks([f'etnet:{i}' for i in range(10)], guard_empty=False, lane='hot')
+        wq.add_tasks([f'aastocks:{i}' for i in range(10)], guard_empty=False, lane='aastocks')
+        items = wq.lease_many(8)
+        self.assertEqual(len([item for item in items if item.startswith('etnet')]), 6)
+        self.assertEqual(len([item for item in items if item.startswith('aastocks')]), 2)
+
+    def test_guardCountsAllLanes(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False, lane='etnet')
+        self.assertFalse(self._wq.empty())
+        self.assertEqual(self._wq.add_tasks(['aastocks:700']), 1)
+
+    def test_canRequeueToLane(self):
+        self._wq.add_tasks(['etnet:700'], guard_empty=False, lane='etnet')
+        self._wq.lease_many(1, lease_secs=1)
+        time.sleep(2)
+        self.assertEqual(self._wq.check_expired_leases(), 1)
+        self.assertEqual(self._wq._db.lrange(self._wq._lane_key('etnet'), 0, -1), ['etnet:700'])
+
+    def test_canEnqueueDueTasks(self):
+        self.assertEqual(self._wq.schedule(['etnet:700', 'etnet:5']), 2)
+        self.assertEqual(self._wq.schedule(['etnet:700'], due=time.time() + 60), 0)
+        due = self._wq.due_tasks()
+        self.assertEqual(sorted(due), ['etnet:5', 'etnet:700'])
+        self.assertEqual(self._wq.enqueue_due(due, next_due=time.time() + 60, lane='etnet'), 2)
+        self.assertEqual(self._wq.due_tasks(), [])
+        self.assertFalse(self._wq.empty())
+
+    def test_cannotEnqueuePendingTask(self):
+        self._wq.schedule(['etnet:700'])
+        self._wq.enqueue_due(['etnet:700'], next_due=time.time())
+        self.assertEqual(self._wq.enqueue_due(['etnet:700'], next_due=time.time()), 0)
+        item = self._wq.lease(block=False)
+        self._wq.complete(item)
+        self.assertEqual(self._wq.enqueue_due(['etnet:700'], next_due=time.time()), 1)
+
+    def test_canBackOffQuietTask(self):
+        self.assertEqual(self._wq.record_yield('etnet:700', 0, cadence_secs=600), 1200)
+        self.assertEqual(self._wq.record_yield('etnet:700', 0, cadence_secs=600, max_secs=2000), 2000)
+        self.assertEqual(self._wq.not_due(['etnet:700', 'etnet:5']), {'etnet:700'})
+
+    def test_canSpeedUpBusyTask(self):
+        self.assertEqual(self._wq.record_yield('etnet:700', 10, cadence_secs=600, min_secs=200), 300)
+        self.assertEqual(self._wq.record_yield('etnet:700', 10, cadence_secs=600, min_secs=200), 200)
+        self.assertEqual(self._wq.record_yield('etnet:700', 1, cadence_secs=600, min_secs=200), 200)
+
+    def test_canDeadLetterJobAfterMaxRetries(self):
+        wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, max_retries=0)
+        wq.add_tasks(['etnet:700'], guard_empty=False, lane='etnet')
+        wq.lease_many(1, lease_secs=1)
+        time.sleep(2)
+        wq.check_expired_leases()
+        dead = wq.dead_letters()
+        self.assertEqual(len(dead), 1)
+        self.assertEqual(dead[0]['job'], 'etnet:700')
+        self.assertEqual(dead[0]['session'], wq.sessionID())
+        self.assertEqual(dead[0]['lane'], wq._lane_key('etnet'))
+
+    def test_canRedriveDeadLetters(self):
+        wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, max_retries=0)
+        wq.add_tasks(['etnet:700', 'etnet:5'], guard_empty=False)
+        wq.lease_many(2, lease_secs=1)
+        time.sleep(2)
+        wq.check_expired_leases()
+        self.assertEqual(wq.redrive(['etnet:5']), 1)
+        self.assertEqual(wq.redrive(), 1)
+        self.assertEqual(wq.dead_letters(), [])
+        self.assertEqual(sorted(wq.lease_many(2)), ['etnet:5', 'etnet:700'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import random
+import unittest
+from utils.general_utils import get_sector_loose
+from utils.universe_index import UniverseIndex
+
+class TestUniverseIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.sector_dict = {
+            'AAPL': '10101010',
+            'MSFT': '10101015',
+            'GOOG': '10102010',
+            'JPM': '30101010',
+            'XOM': '60101010',
+            'NA': 'NA',
+        }
+        self.index = UniverseIndex(self.sector_dict)
+
+    def test_skipsTickersWithoutCode(self):
+        self.assertNotIn('NA', self.index)
+        self.assertEqual(len(self.index), 5)
+
+    def test_sectorAtAllGranularities(self):
+        self.assertEqual(self.index.sector('MSFT'), 10101015)
+        self.assertEqual(self.index.sector('MSFT', trim=2), 101010)
+        self.assertEqual(self.index.sector('MSFT', trim=6), 10)
+        self.assertIsNone(self.index.sector('TSLA'))
+
+    def test_noTickerInUniverse(self):
+        self.assertIsNone(self.index.get_sector_loose(['TSLA', 'NA']))
+
+    def test_trimsToMajority(self):
+        self.assertEqual(self.index.get_sector_loose(['AAPL']), 10101010)
+        self.assertEqual(self.index.get_sector_loose(['AAPL', 'MSFT', 'JPM']), 101010)
+        self.assertEqual(self.index.get_sector_loose(['AAPL', 'GOOG', 'JPM']), 1010)
+        self.assertIsNone(self.index.get_sector_loose(['AAPL', 'JPM']))
+
+    def test_matchesGetSectorLoose(self):
+        rng = random.Random(0)
+        sector_dict = {f'T{i}': str(rng.choice([1, 2]) * 10**7 + rng.randrange(4) * 10**4 + rng.randrange(3)) for i in range(200)}
+        index = UniverseIndex(sector_dict)
+        tickers = list(sector_dict) + ['UNKNOWN']
+        for _ in range(1000):
+            ticker_list = rng.sample(tickers, rng.randrange(1, 8))
+            for threshold in (0.3, 0.5, 0.666):
+                self.assertEqual(index.get_sector_loose(ticker_list, threshold=threshold),
+                                 get_sector_loose(ticker_list, sector_dict, threshold=threshold))
+
+if __name__ == '__main__':
+    unittest.main()
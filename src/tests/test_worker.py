@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+import time
+import types
+import unittest
+import uuid
+from lurkers import Newsfilter, Reddit
+from worker import Worker
+from workqueue.rediswq import RedisWQ
+
+class TestRecordYield(unittest.TestCase):
+
+    def setUp(self):
+        self.REDIS_WQS = f'redis_wq_unittest:{uuid.uuid4()}'
+        self._wq = RedisWQ(name=self.REDIS_WQS, host=os.getenv("REDIS_SERVICE_HOST"))
+
+        self.worker = Worker({
+            'redis_wqs': self.REDIS_WQS,
+            'cadence_secs': {'reddit': 600, 'newsfilter': 900},
+            'min_cadence_secs': 300,
+            'max_cadence_secs': 86400,
+        }, logging.getLogger(__name__))
+
+    def tearDown(self):
+        self._wq.cleanup()
+
+    def quiet_lurker(self, lurker_class):
+        # Found nothing, without failing
+        lurker = types.SimpleNamespace(
+            getSuccessQueryNum=lambda: 0,
+            getFailedQueryNum=lambda: 0,
+            window_secs=lurker_class.window_secs
+        )
+        self.worker.lurkers._lurkers[lurker_class.__name__.lower()] = lurker
+
+    def backed_off_cadence(self, lurker_type, payload, runs=10):
+        for _ in range(runs):
+            self.worker.recordYield(self._wq, lurker_type, payload, f'{lurker_type}:{payload}')
+        return int(self._wq._db.hget(self._wq._cadence_key, f'{lurker_type}:{payload}'))
+
+    def test_hourWindowBacksOffToItsWindow(self):
+        self.quiet_lurker(Reddit)
+        self.assertEqual(self.backed_off_cadence('reddit', '1-0'), 3600)
+        # Due again within the hour, so the next window is scraped
+        self.assertEqual(self._wq.not_due(['reddit:1-0'], now=time.time() + 3600), set())
+
+    def test_dayShardBacksOffToADay(self):
+        self.quiet_lurker(Newsfilter)
+        self.assertEqual(self.backed_off_cadence('newsfilter', 'AAPL@0', runs=20), 86400)
+
+    def test_windowCapsTheMinimumCadence(self):
+        self.quiet_lurker(Reddit)
+        self.worker.MIN_CADENCE_SECS = 7200
+        self.assertEqual(self.backed_off_cadence('reddit', '1-0'), 3600)
+
+class TestDoWork(unittest.TestCase):
+
+    def setUp(self):
+        self.REDIS_WQS = f'redis_wq_unittest:{uuid.uuid4()}'
+        self._wq = RedisWQ(name=self.REDIS_WQS, host=os.getenv("REDIS_SERVICE_HOST"))
+        self.worker = Worker({'redis_wqs': self.REDIS_WQS, 'reaper': True, 'lease_secs': 10}, logging.getLogger(__name__))
+
+    def tearDown(self):
+        self._wq.cleanup()
+
+    def test_failedJobStopsHeartbeatAndReaper(self):
+        self._wq.add_tasks(['reddit:1-0'], guard_empty=False)
+        def failing_job(lurker_type, payload):
+            raise RuntimeError('scrape failed')
+        self.worker.lurkerJob = failing_job
+
+        with self.assertRaises(RuntimeError):
+            self.worker.doWork()
+        names = [thread.name for thread in threading.enumerate()]
+        self.assertNotIn('lease-heartbeat', names)
+        self.assertNotIn('lease-reaper', names)
+        # The leadership was given up for another worker to reap
+        self.assertTrue(self._wq.lead_reaper())
+
+if __name__ == '__main__':
+    unittest.main()
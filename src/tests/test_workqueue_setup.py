@@ -0,0 +1,82 @@
+import re
+import unittest
+from lurkers import Newsfilter
+from workqueue_setup import build_tasks
+
+# publishedAt:[<start> TO <end>} in days from the start of today, "*" being open-ended
+PUBLISHED_AT = re.compile(r'publishedAt:\[(\S+) TO (\S+)([\]}])')
+
+def day_offset(date_math: str) -> float:
+    if date_math == '*':
+        return float('inf')
+    match = re.fullmatch(r'now(?:-(\d+)d)?/d', date_math)
+    return -int(match.group(1) or 0)
+
+def query_window(query: str) -> tuple:
+    start, end, bracket = PUBLISHED_AT.search(query).groups()
+    # An inclusive end would overlap the next window
+    if end != '*':
+        assert bracket == '}', query
+    return day_offset(start), day_offset(end)
+
+def payload_windows(lurker: Newsfilter, payload: str) -> list:
+    lurker.set_task(payload)
+    return [query_window(query) for query in lurker.scraper_iterator()]
+
+class TestNewsfilterShards(unittest.TestCase):
+
+    def setUp(self):
+        # Only the task parsing is exercised, no connection is needed
+        self.lurker = Newsfilter.__new__(Newsfilter)
+        self.lurker.DURATION = 7
+
+    def test_canShardTickerByDay(self):
+        self.assertEqual(Newsfilter.shard_payload('AAPL', 3), ['AAPL@0', 'AAPL@1', 'AAPL@2'])
+
+    def test_shardScrapesOneDay(self):
+        self.assertEqual(payload_windows(self.lurker, 'AAPL@0'), [(0, float('inf'))])
+        self.assertEqual(payload_windows(self.lurker, 'AAPL@3'), [(-3, -2)])
+
+    def test_shardsCoverTheDurationOnce(self):
+        windows = []
+        for shard in Newsfilter.shard_payload('AAPL', self.lurker.DURATION):
+            windows += payload_windows(self.lurker, shard)
+        windows.sort()
+
+        # Same range as the unsharded 'publishedAt:[now-{DURATION - 1}d/d TO *]'
+        self.assertEqual(windows[0][0], -(self.lurker.DURATION - 1))
+        self.assertEqual(windows[-1][1], float('inf'))
+        # Each window starts where the previous one ends: no gap, no overlap
+        for previous, window in zip(windows, windows[1:]):
+            self.assertEqual(previous[1], window[0])
+
+    def test_unshardedTickerCoversTheSameDays(self):
+        sharded = []
+        for shard in Newsfilter.shard_payload('AAPL', self.lurker.DURATION):
+            sharded += payload_windows(self.lurker, shard)
+        self.assertEqual(sorted(payload_windows(self.lurker, 'AAPL')), sorted(sharded))
+
+class TestBuildTasks(unittest.TestCase):
+
+    def test_shardsNewsfilterTickers(self):
+        lanes = build_tasks(['newsfilter'], ['AAPL', 'MSFT'], hours=48)
+        self.assertEqual(lanes['newsfilter'], [
+            'newsfilter:AAPL@0', 'newsfilter:AAPL@1', 'newsfilter:MSFT@0', 'newsfilter:MSFT@1'
+        ])
+
+    def test_coversAtLeastADay(self):
+        lanes = build_tasks(['newsfilter'], ['AAPL'], hours=1)
+        self.assertEqual(lanes['newsfilter'], ['newsfilter:AAPL@0'])
+
+    def test_sendsHotTickerShardsToHotLane(self):
+        lanes = build_tasks(['newsfilter', 'etnet'], ['AAPL', '700'], hours=24, hot_tickers={'700'})
+        self.assertEqual(lanes['hot'], ['newsfilter:700@0', 'etnet:700'])
+        self.assertEqual(lanes['newsfilter'], ['newsfilter:AAPL@0'])
+        self.assertEqual(lanes['etnet'], ['etnet:AAPL'])
+
+    def test_doesNotShardWindowedLurkers(self):
+        lanes = build_tasks(['reddit'], ['AAPL'], hours=3)
+        self.assertEqual(lanes['reddit'], ['reddit:1-0', 'reddit:1-1', 'reddit:1-2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
+import atexit
+import logging
 import os
-from typing import Iterable
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Iterable, Union
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import streaming_bulk
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
 import pymongo
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 import yaml
-from res.models.datamodels import ESAction
+from res.models.datamodels import BaseDoc, ESAction, to_document
 
 def connect_to_elasticsearch():
     """
@@ -27,9 +36,111 @@ def connect_to_elasticsearch():
 
     return es
 
+# Process-wide ES client
+_es_client = None
+_es_client_lock = threading.Lock()
+
+def get_elasticsearch():
+    """
+    Returns the ES client shared by the whole process, building it on first use.
+
+    Returns:
+        obj: ES Connection Object
+    """
+    global _es_client
+    with _es_client_lock:
+        if _es_client is None:
+            _es_client = connect_to_elasticsearch()
+        return _es_client
+
+def close_elasticsearch():
+    """
+    Closes the shared ES client. Registered to run at interpreter exit.
+    """
+    global _es_client
+    with _es_client_lock:
+        if _es_client is not None:
+            _es_client.close()
+            _es_client = None
+
+atexit.register(close_elasticsearch)
+
+# Settings of the pooled MongoClients, overridable with "client_options" in scraper_storage.yaml
+DEFAULT_MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': 50,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 300000,
+    'connectTimeoutMS': 10000,
+    'socketTimeoutMS': 60000,
+    'serverSelectionTimeoutMS': 30000,
+}
+
+# Process-wide MongoClients, keyed by host and credentials
+_mongo_clients = {}
+_mongo_clients_lock = threading.Lock()
+_mongo_creds = {}
+
+
+def load_mongo_creds(creds_file_path: str = "res/db-creds/scraper_storage.yaml") -> dict:
+    """
+    Reads (once per process) the MongoDB credentials file.
+
+    Args:
+        creds_file_path (str): path to the credentials yaml file.
+
+    Raises:
+        Exception: Errors with reading the credentials file
+
+    Returns:
+        dict: content of the credentials file.
+    """
+    with _mongo_clients_lock:
+        if creds_file_path not in _mongo_creds:
+            try:
+                with open(creds_file_path, 'r') as f:
+                    _mongo_creds[creds_file_path] = yaml.safe_load(f)
+            except Exception as e:
+                raise Exception(e)
+
+        return _mongo_creds[creds_file_path]
+
+def get_mongo_client(creds: dict, client_options: dict = None) -> pymongo.MongoClient:
+    """
+    Returns the pooled MongoClient shared by the whole process for the given credentials,
+    building it on first use.
+
+    Args:
+        creds (dict): "credentials" section of the credentials file.
+        client_options (dict, optional): overrides of DEFAULT_MONGO_CLIENT_OPTIONS.
+
+    Returns:
+        pymongo.MongoClient: the shared client.
+    """
+    key = (creds['host'], creds['ssl_ca_cert_path'])
+
+    with _mongo_clients_lock:
+        if key not in _mongo_clients:
+            options = dict(DEFAULT_MONGO_CLIENT_OPTIONS)
+            options.update(client_options or {})
+            _mongo_clients[key] = pymongo.MongoClient(
+                host=creds['host'], ssl=True, tlsCAFile=creds['ssl_ca_cert_path'], **options)
+
+        return _mongo_clients[key]
+
+def close_mongo_clients():
+    """
+    Closes every cached MongoClient. Registered to run at interpreter exit.
+    """
+    with _mongo_clients_lock:
+        for client in _mongo_clients.values():
+            client.close()
+        _mongo_clients.clear()
+
+atexit.register(close_mongo_clients)
+
 def connect_to_mongodb(collection: str) -> pymongo.collection.Collection:
     """
-    Builds a connection to a MongoDB collection.
+    Builds a connection to a MongoDB collection, on the client shared by the whole process.
 
     Args:
         collection (str): name of MongoDB collection.
@@ -42,72 +153,359 @@ def connect_to_mongodb(collection: str) -> pymongo.collection.Collection:
         pymongo.collection.Collection: self-explanatory.
     """
     # Load Creds
-    creds_file_path = "res/db-creds/scraper_storage.yaml"
-    
-    try:
-        with open(creds_file_path, 'r') as f:
-            creds = yaml.safe_load(f)
-            service_type = creds['service_type']
-            creds = creds['credentials']
-    except Exception as e:
-        raise Exception(e)
+    creds = load_mongo_creds("res/db-creds/scraper_storage.yaml")
+    service_type = creds['service_type']
 
     # Connect to DB
     if service_type == 'mongo':
-        myclient = pymongo.MongoClient(
-            host=creds['host'], ssl=True, tlsCAFile=creds['ssl_ca_cert_path'])
-        mydb = myclient[creds['database']]
+        myclient = get_mongo_client(creds['credentials'], creds.get('client_options'))
+        mydb = myclient[creds['credentials']['database']]
         mycollection = mydb[collection]
         return mycollection
     else:
         raise TypeError(__name__, "No such type")
 
-# TODO: Implement a way to reset just_insert in mongodb for successful documents only. Perhaps by storing their Object IDs and then update_many()
-def reset_just_insert(mongo_collection: pymongo.collection.Collection):
+# Code of the write errors of documents whose key already exists
+DUPLICATE_KEY_ERROR = 11000
+
+def ensure_unique_index(collection: pymongo.collection.Collection, key: str = 'unique_identifier', logger: logging.Logger = None) -> bool:
     """
-    Reset the just_insert field for all documents in the mongodb collection to False.
+    Ensures that a collection has a unique index on key, so that the database rejects duplicated documents.
+    Documents without a (non-empty string) key are left out of the index.
+
+    Args:
+        collection (pymongo.collection.Collection): self-explanatory.
+        key (str): field identifying a document.
+        logger (Logger, optional): logger of the owner.
+
+    Returns:
+        bool: True if the index exists, False if it could not be built (e.g. the collection already has duplicates).
+    """
+    try:
+        collection.create_index(
+            [(key, pymongo.ASCENDING)],
+            name=f"{key}_unique",
+            unique=True,
+            partialFilterExpression={key: {'$gt': ''}}
+        )
+        return True
+    except OperationFailure as e:
+        (logger or logging.getLogger(__name__)).warning(f"Failed to ensure a unique index on {collection.full_name}.{key}: {e}")
+        return False
+
+class BufferedMongoWriter(threading.Thread):
+    """
+    Writes documents to a MongoDB collection from a background thread, in batches, so that writes
+    overlap scraping and what was scraped is stored as the job goes.
+
+    A batch is written once it holds batch_size documents or its oldest document waited flush_secs.
+    At most max_pending documents wait to be written: add() blocks past that, slowing the scraper down
+    to the pace of the database.
+
+    In upsert mode, a document is only inserted if no document has the same key, in a single
+    bulk_write() of UpdateOne($setOnInsert, upsert=True) per batch, so that the database dedups
+    even when the history db does not. Duplicates then cost no write.
+
+    Documents are dicts or document models (see res.models.datamodels). Models wait in their slotted
+    form and are converted with to_document() only when their batch is written.
+
+    The outcome of every document (inserted, duplicate or failed) is counted, and passed to
+    on_outcome if given.
+
+    Args:
+        collection (pymongo.collection.Collection): collection to write to.
+        batch_size (int): maximum number of documents per insert_many() or bulk_write().
+        flush_secs (float): maximum time a document waits before its batch is written.
+        max_pending (int): maximum number of documents waiting to be written.
+        logger (Logger, optional): logger of the owner.
+        upsert (bool): write in upsert mode instead of with insert_many().
+        key (str): field identifying a document in upsert mode.
+        on_outcome (Callable[[dict, str], None], optional): called from the writer thread with each
+            document and its outcome.
+    """
+    INSERTED = 'inserted'
+    DUPLICATE = 'duplicate'
+    FAILED = 'failed'
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, collection: pymongo.collection.Collection, batch_size: int = 500, flush_secs: float = 5.0,
+                 max_pending: int = 2000, logger: logging.Logger = None, upsert: bool = False,
+                 key: str = 'unique_identifier', on_outcome: Callable[[dict, str], None] = None):
+        super().__init__(name="mongo-writer", daemon=True)
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_secs = flush_secs
+        self.logger = logger or logging.getLogger(__name__)
+        self.upsert = upsert
+        self.key = key
+        self.on_outcome = on_outcome
+
+        # Number of documents per outcome
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.start()
+
+    def add(self, doc: Union[dict, BaseDoc]):
+        """
+        Queues a document to be written, blocking while max_pending documents are waiting.
+        """
+        self._queue.put(doc)
+
+    def flush(self):
+        """
+        Writes the documents waiting and returns once they are all written.
+        """
+        if not self.is_alive():
+            return
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the documents waiting and stops the writer.
+        """
+        if not self.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self.join()
+
+    def _report(self, batch: list, outcomes: list):
+        for doc, outcome in zip(batch, outcomes):
+            if outcome == self.INSERTED:
+                self.inserted += 1
+            elif outcome == self.DUPLICATE:
+                self.duplicates += 1
+            else:
+                self.failed += 1
+            if self.on_outcome is not None:
+                try:
+                    self.on_outcome(doc, outcome)
+                except Exception as e:
+                    self.logger.debug(f"Failed to report the outcome of a document: {e}")
+
+    def _write_batch(self, batch: list) -> list:
+        """
+        Writes a batch and returns the outcome of each of its documents.
+        """
+        batch = [doc if isinstance(doc, dict) else to_document(doc) for doc in batch]
+        if self.upsert:
+            operations = [UpdateOne({self.key: doc[self.key]}, {'$setOnInsert': doc}, upsert=True) for doc in batch]
+        try:
+            if self.upsert:
+                result = self.collection.bulk_write(operations, ordered=False)
+                return [self.INSERTED if i in result.upserted_ids else self.DUPLICATE for i in range(len(batch))]
+            self.collection.insert_many(batch, ordered=False)
+            return [self.INSERTED] * len(batch)
+        except BulkWriteError as e:
+            # Unordered: every document without a write error went through
+            outcomes = [self.INSERTED] * len(batch)
+            if self.upsert:
+                upserted = {upsert['index'] for upsert in e.details.get('upserted', [])}
+                outcomes = [self.INSERTED if i in upserted else self.DUPLICATE for i in range(len(batch))]
+            for error in e.details['writeErrors']:
+                # A concurrent upsert of the same key also ends up as a duplicate key error
+                outcomes[error['index']] = self.DUPLICATE if error['code'] == DUPLICATE_KEY_ERROR else self.FAILED
+            failures = [error for error in e.details['writeErrors'] if error['code'] != DUPLICATE_KEY_ERROR]
+            if failures:
+                self.logger.info(f"Payload failed to migrate to mongo.")
+                self.logger.debug(f"Failed Insertion into Mongo: {failures}")
+            return outcomes
+        except Exception as e:
+            self.logger.info(f"Payload failed to migrate to mongo.")
+            self.logger.debug(f"Failed Insertion into Mongo: {e}")
+            return [self.FAILED] * len(batch)
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        try:
+            try:
+                outcomes = self._write_batch(batch)
+            except Exception as e:
+                self.logger.error(f"Unexpected error while writing to mongo: {e}")
+                outcomes = [self.FAILED] * len(batch)
+            self._report(batch, outcomes)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def run(self):
+        batch = []
+        deadline = None
+        while True:
+            try:
+                timeout = max(0, deadline - time.monotonic()) if batch else None
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # The oldest document waited flush_secs
+                self._write(batch)
+                batch = []
+                continue
+
+            if item is self._FLUSH or item is self._STOP:
+                self._write(batch)
+                batch = []
+                self._queue.task_done()
+                if item is self._STOP:
+                    return
+                continue
+
+            if not batch:
+                deadline = time.monotonic() + self.flush_secs
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+
+def reset_just_insert(mongo_collection: pymongo.collection.Collection, ids: Iterable = None, chunk_size: int = 1000) -> int:
+    """
+    Reset the just_insert field to False, for the documents whose _id is in ids, in chunks of chunk_size.
+    Without ids, for all documents in the mongodb collection.
 
     Args:
         mongo_collection (obj): self-explanatory.
+        ids (Iterable, optional): _id of the documents to reset.
+        chunk_size (int): number of _id per update_many().
 
     Raises:
         e: Exception
+
+    Returns:
+        int: number of documents reset.
     """
+    new_value = {"$set": {"just_insert": False}}
     try:
-        query = {"just_insert": True}
-        new_value = {"$set": {"just_insert": False}}
-        mongo_collection.update_many(query, new_value)
+        if ids is None:
+            return mongo_collection.update_many({"just_insert": True}, new_value).modified_count
+
+        ids = list(ids)
+        modified = 0
+        for start in range(0, len(ids), chunk_size):
+            query = {"_id": {"$in": ids[start:start + chunk_size]}}
+            modified += mongo_collection.update_many(query, new_value).modified_count
+        return modified
     except Exception as e:
         raise e
 
-def bulk_migrate_to_es(mongo_collection: pymongo.collection.Collection, es_index: str, actions: Iterable[ESAction]) -> tuple:
+def es_acked_id(ok: bool, item: dict):
+    """
+    Returns the _id of the document of a streaming_bulk() result if ES holds the document,
+    either because it was just indexed or because it already existed (a 'create' conflict), None otherwise.
+
+    Args:
+        ok (bool): success of the action.
+        item (dict): result of the action, {op_type: {'_id': ..., 'status': ...}}.
+
+    Returns:
+        The _id of the mongo document, None if the action failed.
+    """
+    result = next(iter(item.values()))
+    if not ok and result.get('status') != 409:
+        return None
+    id = result['_id']
+    return ObjectId(id) if ObjectId.is_valid(id) else id
+
+def es_dead_letter(item: dict, es_index: str, mongo_collection: pymongo.collection.Collection = None) -> dict:
+    """
+    Builds the dead-letter record of a failed streaming_bulk()/parallel_bulk() result.
+
+    Args:
+        item (dict): result of the action, {op_type: {'_id': ..., 'status': ..., 'error': ...}}.
+        es_index (str): Destination Index.
+        mongo_collection (obj, optional): collection the document comes from.
+
+    Returns:
+        dict: the record.
+    """
+    op_type, result = next(iter(item.items()))
+    return {
+        'doc_id': result.get('_id'),
+        'es_index': es_index,
+        'mongo_collection': mongo_collection.full_name if mongo_collection is not None else None,
+        'op_type': op_type,
+        'status': result.get('status'),
+        'error': result.get('error', result.get('exception')),
+        'failed_at': datetime.now()
+    }
+
+def bulk_migrate_to_es(mongo_collection: pymongo.collection.Collection, es_index: str, actions: Iterable[ESAction],
+                       reset_chunk_size: int = 1000, thread_count: int = 1, chunk_size: int = 500,
+                       max_chunk_bytes: int = 100 * 1024 * 1024, dead_letters: Callable[[dict], None] = None) -> tuple:
     """
     Bulk Migrates Documents to ES
 
+    Only the documents acknowledged by ES have their just_insert flag reset, in chunks as the
+    migration goes, so failed documents and documents inserted meanwhile are migrated next time.
+
+    With thread_count > 1, chunks are sent by parallel_bulk() workers, without retries on 429s.
+    Otherwise, a single streaming_bulk() retries them.
+
     Args:
         index (str): Destination Index.
         actions (Generator[str, None, None]): Actions to be performed.
+        reset_chunk_size (int): number of acknowledged documents per just_insert reset.
+        thread_count (int): number of bulk requests in flight.
+        chunk_size (int): maximum number of documents per bulk request.
+        max_chunk_bytes (int): maximum size of a bulk request, in bytes.
+        dead_letters (Callable[[dict], None], optional): sink called with the dead-letter record
+            (see es_dead_letter()) of every failed document. Failures are returned in a list otherwise.
+
+    Returns:
+        tuple: number of successes, number of failures, failures (empty with a dead_letters sink)
     """
-    es_conn = connect_to_elasticsearch()
+    es_conn = get_elasticsearch()
     successes, failures = 0, 0
     errors = []
+    acked = []
 
-    try:
-        for ok, item in streaming_bulk(
-            client=es_conn, 
-            index=es_index, 
+    if thread_count > 1:
+        results = parallel_bulk(
+            client=es_conn,
+            index=es_index,
+            actions=actions,
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            raise_on_error=False
+        )
+    else:
+        results = streaming_bulk(
+            client=es_conn,
+            index=es_index,
             actions=actions,
-            max_retries=5
-        ):
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            max_retries=5,
+            raise_on_error=False
+        )
+
+    try:
+        for ok, item in results:
             if ok:
                 successes+=1
             else:
                 failures+=1
+
+            id = es_acked_id(ok, item)
+            if id is not None:
+                acked.append(id)
+            elif dead_letters is not None:
+                dead_letters(es_dead_letter(item, es_index, mongo_collection))
+            else:
                 errors.append(item)
 
-        reset_just_insert(mongo_collection)
+            if len(acked) >= reset_chunk_size:
+                reset_just_insert(mongo_collection, acked, chunk_size=reset_chunk_size)
+                acked = []
+
+        reset_just_insert(mongo_collection, acked, chunk_size=reset_chunk_size)
 
     except Exception as e:
         raise e    
 
-    return successes, failures, errors
\ No newline at end of file
+    return successes, failures, errors
@@ -113,15 +113,6 @@ def get_stock_list(mongodb_cursor):
     """
     return [item['ticker_symbol'] for item in mongodb_cursor.find({},{"_id": 0,"ticker_symbol": 1})]
 
-# ! WIP
-def get_sector_dict(sector_dict): 
-    """
-    get each symbol's corresponding sector using ICB code (AMZN -> 10101010)
-    """
-    # Return the pymongo cursor object
-    return sector_dict.find()
-
-
 # ! WIP
 def get_sector(ticker_list, sector_dict, threshold=0.666):
     """
@@ -181,7 +172,7 @@ def get_sector_loose(ticker_list, sector_dict, trim=0, threshold=0.5) -> int:
         sector = most_common[0][0]
         return sector
     else:
-        return get_sector_loose(ticker_list, sector_dict, trim=trim+2)
+        return get_sector_loose(ticker_list, sector_dict, trim=trim+2, threshold=threshold)
 
 
 def process_text(text):
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import get_environ_proxies, get_netrc_auth
+
+# Process-wide session shared by every lurker of a worker
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter applying a default timeout to the requests sent without one.
+    requests has no session-wide timeout, and a request without one can hang forever on a dead socket.
+
+    Args:
+        timeout (Tuple[float, float]): default (connect, read) timeout, in seconds.
+        **kwargs: Passed to HTTPAdapter.
+    """
+    def __init__(self, timeout: Tuple[float, float] = (10, 60), **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class EnvironmentSession(requests.Session):
+    """
+    Session resolving the environment once per host instead of on every request.
+
+    With trust_env, requests reads the proxies (and NO_PROXY), the CA bundle and netrc again for every
+    request. Here trust_env is off: the CA bundle is read when the session is built, and the proxies and
+    netrc credentials of a host when it is first requested, so NO_PROXY still applies host by host.
+    Proxies and auth given to a request still take precedence.
+    """
+    def __init__(self):
+        super().__init__()
+        self.trust_env = False
+        self.verify = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or True
+        # (scheme, host) -> (proxies, netrc auth)
+        self._host_environments = {}
+
+    def host_environment(self, url: str) -> Tuple[Dict[str, str], Optional[Tuple[str, str]]]:
+        """
+        Returns the proxies and the netrc credentials of the host of url, resolved on first use.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        environment = self._host_environments.get(key)
+        if environment is None:
+            environment = (get_environ_proxies(url), get_netrc_auth(url))
+            self._host_environments[key] = environment
+        return environment
+
+    def prepare_request(self, request):
+        if not request.auth and not self.auth:
+            request.auth = self.host_environment(request.url)[1]
+        return super().prepare_request(request)
+
+    def merge_environment_settings(self, url, proxies, stream, verify, cert):
+        proxies = dict(self.host_environment(url)[0], **(proxies or {}))
+        return super().merge_environment_settings(url, proxies, stream, verify, cert)
+
+
+def build_http_session(pool_connections: int = 10, pool_maxsize: int = 10, host_pool_sizes: Dict[str, int] = None,
+                       connect_timeout_secs: float = 10, read_timeout_secs: float = 60) -> requests.Session:
+    """
+    Builds a requests session with pooled keep-alive connections.
+
+    The environment (proxies and NO_PROXY, REQUESTS_CA_BUNDLE, netrc) is honoured, but resolved once
+    per host instead of on every request (see EnvironmentSession).
+
+    Args:
+        pool_connections (int): Number of host pools to keep.
+        pool_maxsize (int): Number of connections kept alive per host.
+        host_pool_sizes (Dict[str, int], optional): Url prefix -> pool size, for hosts that need a bigger (or smaller) pool.
+        connect_timeout_secs (float): Default connect timeout of the requests sent without one.
+        read_timeout_secs (float): Default read timeout of the requests sent without one.
+
+    Returns:
+        requests.Session: the session.
+    """
+    session = EnvironmentSession()
+    timeout = (connect_timeout_secs, read_timeout_secs)
+
+    adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    for prefix, pool_size in (host_pool_sizes or {}).items():
+        session.mount(prefix, TimeoutHTTPAdapter(timeout=timeout, pool_connections=1, pool_maxsize=pool_size))
+
+    return session
+
+
+def get_http_session(**kwargs) -> requests.Session:
+    """
+    Returns the session shared by the whole process, building it on first use.
+
+    Args:
+        **kwargs: Passed to build_http_session() when the session is built.
+
+    Returns:
+        requests.Session: the shared session.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = build_http_session(**kwargs)
+    return _http_session
+
+
+class AsyncFetcher:
+    """
+    Asyncio HTTP client used by a lurker in async scrape mode, kept for the whole life of the lurker.
+
+    Requests are bounded by a global in-flight cap and a per-host concurrency limit,
+    so a single slow source cannot starve the others and no host is hammered.
+
+    The fetcher runs the scrapes on its own event loop (see run()), so its connection pool and the
+    keep-alive connections are reused from one job to the next. Like build_http_session(), the
+    environment (proxies and NO_PROXY, netrc) is honoured and every request has a connect and a read timeout.
+
+    Args:
+        max_in_flight (int): Maximum number of requests in flight at once.
+        per_host_limit (int): Maximum number of concurrent requests to a single host.
+        connect_timeout_secs (float): Timeout to connect to a host, in seconds.
+        read_timeout_secs (float): Timeout of a single read of a response, in seconds.
+    """
+    def __init__(self, max_in_flight: int = 16, per_host_limit: int = 4,
+                 connect_timeout_secs: float = 10, read_timeout_secs: float = 60):
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.connect_timeout_secs = connect_timeout_secs
+        self.read_timeout_secs = read_timeout_secs
+
+        self._loop = None
+        self._session = None
+        self._global_slots = None
+        self._host_slots = {}
+
+    def run(self, coro):
+        """
+        Runs a coroutine to completion on the event loop of the fetcher, creating it on first use.
+        The session is bound to this loop, so every request of the fetcher must be made through run().
+
+        Args:
+            coro (Coroutine): the coroutine, i.e. Lurker.scrape_async().
+
+        Returns:
+            the result of the coroutine.
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        """
+        Closes the session and the event loop of the fetcher.
+        """
+        if self._loop is None:
+            return
+        self._loop.run_until_complete(self.aclose())
+        self._loop.close()
+        self._loop = None
+
+    async def aclose(self):
+        """
+        Closes the session, a new one is opened by the next request.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _open(self):
+        """
+        Opens the session on first use, within the running event loop it is bound to.
+        """
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.per_host_limit)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout_secs, sock_read=self.read_timeout_secs),
+            trust_env=True
+        )
+        self._global_slots = asyncio.Semaphore(self.max_in_flight)
+        self._host_slots = {}
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        """
+        Returns the semaphore bounding the requests made to the host of url.
+        """
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_slots[host]
+
+    async def request(self, method: str, url: str, **kwargs) -> Tuple[int, bytes]:
+        """
+        Performs a request once a global and a per-host slot are available.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Target url.
+            **kwargs: Passed to aiohttp.ClientSession.request().
+
+        Returns:
+            Tuple[int, bytes]: status code and body of the response.
+        """
+        self._open()
+        async with self._global_slots, self._host_slot(url):
+            async with self._session.request(method, url, **kwargs) as response:
+                content = await response.read()
+                return response.status, content
+
+    async def get(self, url: str, **kwargs) -> Tuple[int, bytes]:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Tuple[int, bytes]:
+        return await self.request('POST', url, **kwargs)
@@ -0,0 +1,95 @@
+from array import array
+from typing import Dict, Iterable, Optional
+
+import pymongo
+
+from utils.general_utils import get_sector_dict
+
+# Digits trimmed from an 8-digit ICB code at each granularity: subsector, sector, supersector, industry
+ICB_TRIMS = (0, 2, 4, 6)
+
+
+class UniverseIndex:
+    """
+    In-memory index of the ICB codes of the universe, built once per lurker.
+
+    Every ticker gets a position, and the ICB code of the ticker at position i is stored at all the
+    granularities up front: codes[level][i] == int(icb_code) // 10**ICB_TRIMS[level]. Lookups then
+    cost no parsing nor division.
+
+    Args:
+        sector_dict (Dict[str, str]): ticker symbol -> ICB code, as returned by get_sector_dict().
+    """
+    def __init__(self, sector_dict: Dict[str, str]):
+        self.positions = {}
+        self.codes = tuple(array('l') for _ in ICB_TRIMS)
+
+        for ticker, icb_code in sector_dict.items():
+            try:
+                code = int(icb_code)
+            except (TypeError, ValueError):
+                # i.e. 'NA', the ticker has no sector
+                continue
+            self.positions[ticker] = len(self.positions)
+            for codes, trim in zip(self.codes, ICB_TRIMS):
+                codes.append(code // 10**trim)
+
+    @classmethod
+    def from_collection(cls, universe_collection: pymongo.collection.Collection, currency=["USD", "HKD"]) -> 'UniverseIndex':
+        """
+        Builds the index of the universe collection.
+        """
+        return cls(get_sector_dict(universe_collection, currency=currency))
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.positions
+
+    def sector(self, ticker: str, trim: int = 0) -> Optional[int]:
+        """
+        Returns the ICB code of a ticker, trimmed by trim digits (one of ICB_TRIMS), None if unknown.
+        """
+        position = self.positions.get(ticker)
+        if position is None:
+            return None
+        return self.codes[ICB_TRIMS.index(trim)][position]
+
+    def get_sector_loose(self, ticker_list: Iterable[str], threshold: float = 0.5) -> Optional[int]:
+        """
+        Same as general_utils.get_sector_loose(): the finest ICB code shared by more than threshold
+        of the tickers of the universe in ticker_list, trimming 2 digits at a time.
+
+        The tickers are resolved to positions in a single pass, each granularity then only counts
+        the codes stored at these positions.
+
+        Args:
+            ticker_list (list): the candidate tickers
+            threshold (float, optional): the threhold for how many stocks should be in the same sector. Defaults to 0.5.
+
+        Returns:
+            int: the sector code, none if no majority
+        """
+        positions = self.positions
+        found = [positions[ticker] for ticker in ticker_list if ticker in positions]
+
+        # check if there is no ticker mentioned in the universe
+        if not found:
+            return None
+        if len(found) == 1 and threshold < 1:
+            # i.e. an article on a single stock, which is its own majority
+            return self.codes[0][found[0]]
+
+        for codes in self.codes:
+            counts = {}
+            for position in found:
+                code = codes[position]
+                counts[code] = counts.get(code, 0) + 1
+            # First code with the highest count, as Counter.most_common()
+            sector = max(counts, key=counts.__getitem__)
+            if counts[sector] / len(found) > threshold:
+                return sector
+
+        # no common sector even expand to 2 digit industry code
+        return None
@@ -8,12 +8,17 @@ __email__ = "u3556578@connect.hku.hk"
 # Import dependancies
 from email import generator
 from logging import Logger
+import argparse
 import os
 import logging
+from collections import deque
 from typing import Dict, Generator
-from utils.database_utils import connect_to_mongodb
+from utils.database_utils import connect_to_mongodb, close_mongo_clients
 from utils.general_utils import get_configs
+from utils.http_utils import get_http_session
 from workqueue.rediswq import RedisWQ
+from workqueue.heartbeat import LeaseHeartbeat
+from workqueue.reaper import LeaseReaper
 
 # Lurkers
 from lurkers import *
@@ -26,21 +31,88 @@ log_fmt = '%(asctime)s %(levelname)s %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_fmt)
 logger = logging.getLogger(__name__)
 
+class LurkerRegistry():
+    """
+    Builds each lurker type once per worker process, so configs, database connections and
+    universe data are loaded once instead of for every item of the work queue.
+
+    Args:
+        session (requests.Session): HTTP session handed to every lurker.
+        logger (Logger): logger of the worker.
+    """
+    def __init__(self, session, logger: Logger):
+        self.session = session
+        self.logger = logger
+        self._lurkers = {}
+
+    def get(self, lurker_type: str):
+        """
+        Returns the lurker of the given type, building it on first use.
+
+        Args:
+            lurker_type (str): lurker type of the work queue item (e.g. "etnet").
+
+        Returns:
+            Lurker: the lurker, None if the type is unknown.
+        """
+        if lurker_type not in LURKER_TYPES:
+            return None
+
+        if lurker_type not in self._lurkers:
+            self.logger.info(f"Building {lurker_type} lurker")
+            self._lurkers[lurker_type] = LURKER_TYPES[lurker_type](session=self.session)
+
+        return self._lurkers[lurker_type]
+
+    def close(self):
+        """
+        Closes every lurker built, writing the documents they still hold.
+        """
+        for lurker in self._lurkers.values():
+            lurker.close()
+
+
 class Worker():
-    def __init__(self, subclass_config: dict, logger: Logger):
+    def __init__(self, subclass_config: dict, logger: Logger, continuous: bool = False):
         """
         Initializes a Worker class.
 
         Args:
             logger (Logger): logger initialised by the subclass.
+            continuous (bool): keep waiting for work when the queue is empty instead of exiting.
         """
         self.logger = logger
+        self.continuous = continuous
 
         self.logger.info("Connecting to microservices..")
         try:
             # Redis Params
             self.REDIS_HOST = os.getenv("REDIS_SERVICE_HOST")
             self.REDIS_WQS = subclass_config['redis_wqs']
+            self.LANE_WEIGHTS = subclass_config.get('lane_weights')
+
+            # Leasing Params
+            self.LEASE_SECS = subclass_config.get('lease_secs', 60)
+            self.PREFETCH = subclass_config.get('prefetch', 4)
+            self.HEARTBEAT_SECS = subclass_config.get('heartbeat_secs', self.LEASE_SECS / 3)
+            self.MAX_JOB_SECS = subclass_config.get('max_job_secs', 3600)
+
+            # Adaptive cadence Params
+            self.CADENCE_SECS = subclass_config.get('cadence_secs', {})
+            self.DEFAULT_CADENCE_SECS = subclass_config.get('default_cadence_secs', 3600)
+            self.MIN_CADENCE_SECS = subclass_config.get('min_cadence_secs', 300)
+            self.MAX_CADENCE_SECS = subclass_config.get('max_cadence_secs', 86400)
+            self.BUSY_ITEMS = subclass_config.get('busy_items', 5)
+
+            # Reaping Params
+            self.REAPER = subclass_config.get('reaper', False)
+            self.REAPER_SECS = subclass_config.get('reaper_secs', 2)
+
+            # One pooled HTTP session shared by every lurker of this worker
+            self.session = get_http_session(**subclass_config.get('http', {}))
+
+            # Lurkers are built once and reused for every item of their type
+            self.lurkers = LurkerRegistry(session=self.session, logger=self.logger)
 
         except Exception as e:
             self.logger.error(e)
@@ -48,45 +120,95 @@ class Worker():
 
     def lurkerJob(self,lurker_type, payload):
         # Select Lurker job
-        if lurker_type == "newsfilter":
-            print(f"Worker: do {lurker_type}, payload: {payload}")
-            lurker = Newsfilter(payload)
-        elif lurker_type == "reddit":
-            duration_hr, offset_hr = payload.split('-')
-            duration_hr = int(duration_hr)
-            offset_hr = int(offset_hr)
-            print(f"Worker: do {lurker_type}, payload: {payload}")
-            lurker = Reddit(duration_hr=duration_hr,offset_hr=offset_hr)
-        elif lurker_type == "aastocks":
-            print(f"Worker: do {lurker_type}, payload: {payload}")
-            lurker = AAstocks(payload)
-        elif lurker_type == "etnet":
-            print(f"Worker: do {lurker_type}, payload: {payload}")
-            lurker = Etnet(payload)
-        elif lurker_type == "eastmoney":
-            duration_hr, offset_hr = payload.split('-')
-            duration_hr = int(duration_hr)
-            offset_hr = int(offset_hr)
-            print(f"Worker: do {lurker_type}, payload: {payload}")
-            lurker = EastMoney(duration_hr=duration_hr,offset_hr=offset_hr)
-        else:
+        lurker = self.lurkers.get(lurker_type)
+        if lurker is None:
             self.logger.error(f"Invalid Lurker Type: {lurker_type}")
+            return False
+
+        print(f"Worker: do {lurker_type}, payload: {payload}")
+        lurker.set_task(payload)
 
         result = lurker.scrape()
         return result
 
+    def recordYield(self, wq: RedisWQ, lurker_type: str, payload: str, item: str):
+        """
+        Adapts how often the item is scraped to the number of new documents its lurker just found.
+        Items bound to a time window (see Lurker.window_secs()) run at least once per window.
+
+        Args:
+            wq (RedisWQ): the work queue the item was leased from.
+            lurker_type (str): lurker type of the item.
+            payload (str): payload of the item.
+            item (str): the work queue item.
+        """
+        lurker = self.lurkers.get(lurker_type)
+        if lurker is None:
+            return
+
+        new_items = lurker.getSuccessQueryNum()
+        if new_items == 0 and lurker.getFailedQueryNum() > 0:
+            # Nothing was found because the source failed, not because it is quiet
+            return
+
+        # A task bound to a time window must run at least once per window, or windows go unscraped
+        max_secs = self.MAX_CADENCE_SECS
+        window = lurker.window_secs(payload)
+        if window is not None:
+            max_secs = min(max_secs, window)
+
+        cadence = wq.record_yield(
+            item,
+            new_items,
+            cadence_secs=self.CADENCE_SECS.get(lurker_type, self.DEFAULT_CADENCE_SECS),
+            min_secs=min(self.MIN_CADENCE_SECS, max_secs),
+            max_secs=max_secs,
+            busy_items=self.BUSY_ITEMS
+        )
+        self.logger.info(f"{item} found {new_items} new documents, next run in {cadence}s")
+
     def doWork(self):
         try:
             source = self.__class__.__name__
 
             self.logger.info(f'{source} running...')
 
-            wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST)
+            wq = RedisWQ(name=self.REDIS_WQS, host=self.REDIS_HOST, lane_weights=self.LANE_WEIGHTS)
             print("Worker with sessionID: " +  wq.sessionID())
             print("Initial queue state: empty=" + str(wq.empty()))
-            while not wq.empty():
-                item = wq.lease(lease_secs=60, block=True, timeout=2) 
-                if item is not None:
+
+            # Keep the leases of every item held by this worker alive
+            heartbeat = LeaseHeartbeat(wq, lease_secs=self.LEASE_SECS, interval_secs=self.HEARTBEAT_SECS,
+                                       max_job_secs=self.MAX_JOB_SECS)
+            heartbeat.start()
+
+            # Requeue the expired leases of crashed workers, if this worker is elected to
+            reaper = None
+            if self.REAPER:
+                reaper = LeaseReaper(wq, interval_secs=self.REAPER_SECS)
+                reaper.start()
+
+            # Items leased ahead of time, their leases are renewed by the heartbeat until they are processed
+            prefetched = deque()
+            try:
+                while True:
+                    if not prefetched:
+                        prefetched.extend(wq.lease_many(self.PREFETCH, lease_secs=self.LEASE_SECS))
+
+                    if not prefetched:
+                        if not self.continuous and wq.empty():
+                            break
+                        item = wq.lease(lease_secs=self.LEASE_SECS, block=True, timeout=30 if self.continuous else 2)
+                        if item is None:
+                            print("Waiting for work")
+                            continue
+                        prefetched.append(item)
+
+                    heartbeat.track(prefetched)
+
+                    item = prefetched.popleft()
+                    # The job begins now, not when the item was prefetched
+                    heartbeat.begin(item)
                     try:
                         # item is not string
                         self.logger.info(f"Item is not string: {item}")
@@ -101,10 +223,15 @@ class Worker():
                     # Pass params to lurker
                     print(f"[{lurker_type}] get payload:{payload}")
                     self.lurkerJob(lurker_type, payload)
+                    self.recordYield(wq, lurker_type, payload, item)
 
+                    heartbeat.untrack(item)
                     wq.complete(item)
-                else:
-                    print("Waiting for work")
+            finally:
+                # A failed job must not keep its leases (nor the reaper leadership) alive
+                heartbeat.stop()
+                if reaper is not None:
+                    reaper.stop()
 
             print("Queue empty, exiting")
 
@@ -112,7 +239,15 @@ class Worker():
             raise e
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Work on the items of the work queue")
+    parser.add_argument('--continuous', action='store_true', help="Wait for work instead of exiting when the queue is empty")
+    args = parser.parse_args()
+
     config = get_configs('res/configs/setup-configs.yaml')
 
-    worker = Worker(subclass_config=config,logger=logger)
-    worker.doWork()
\ No newline at end of file
+    worker = Worker(subclass_config=config,logger=logger,continuous=args.continuous)
+    try:
+        worker.doWork()
+    finally:
+        worker.lurkers.close()
+        close_mongo_clients()
\ No newline at end of file
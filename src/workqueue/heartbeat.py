@@ -0,0 +1,102 @@
+# the LeaseHeartbeat Class
+
+import logging
+import threading
+import time
+from typing import Iterable
+
+from workqueue.rediswq import RedisWQ
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Background thread renewing the leases of the items held by a worker.
+
+    Every tracked item has its lease renewed every `interval_secs`, so an
+    expired lease means the worker crashed, not that the job is slow.
+
+    Renewal stops `max_job_secs` after the job of an item began (see
+    begin()), so that a worker stuck on a job (e.g. on a hung socket) lets
+    its lease expire and the reaper hand the item to another worker. Items
+    prefetched but not begun yet are renewed without limit.
+
+    The heartbeat shares the RedisWQ of the worker, since the leases belong
+    to its session; only the thread-safe redis client is used concurrently.
+    """
+
+    def __init__(self, wq: RedisWQ, lease_secs: int = 60, interval_secs: float = None,
+                 max_job_secs: float = 3600) -> None:
+        """
+        Parameters
+        ----------
+        wq : RedisWQ
+            The work queue the items were leased from.
+        lease_secs : int, optional
+            Duration of each renewal.
+        interval_secs : float, optional
+            Time between two renewals, a third of lease_secs by default.
+        max_job_secs : float, optional
+            Time after which the lease of an item is no longer renewed,
+            counted from when its job began. None renews it forever.
+        """
+        super().__init__(name="lease-heartbeat", daemon=True)
+        self._wq = wq
+        self._lease_secs = lease_secs
+        self._interval_secs = interval_secs if interval_secs else lease_secs / 3
+        self._max_job_secs = max_job_secs
+        # Item -> monotonic time its job began, None until then
+        self._items = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._logger = logging.getLogger("heartbeat")
+
+    def track(self, items: Iterable[str]) -> None:
+        """Start renewing the leases of items, already tracked items keep their start time."""
+        with self._lock:
+            for item in items:
+                self._items.setdefault(item, None)
+
+    def begin(self, item: str) -> None:
+        """Start the max_job_secs clock of item, when its job begins. The item is tracked if it was not."""
+        now = time.monotonic()
+        with self._lock:
+            if self._items.get(item) is None:
+                self._items[item] = now
+
+    def untrack(self, item: str) -> None:
+        """Stop renewing the lease of item, e.g. before completing it."""
+        with self._lock:
+            self._items.pop(item, None)
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval_secs):
+            with self._lock:
+                expired = self._expired()
+                for item in expired:
+                    del self._items[item]
+                items = list(self._items)
+            for item in expired:
+                self._logger.warning(f"{item} held for more than {self._max_job_secs}s, no longer renewing its lease.")
+            if not items:
+                continue
+
+            try:
+                renewed = set(self._wq.renew_leases(items, lease_secs=self._lease_secs))
+            except Exception:
+                self._logger.error("Exception while renewing leases.", exc_info=True)
+                continue
+
+            for item in items:
+                if item not in renewed:
+                    self._logger.warning(f"Lease of {item} was lost before it was renewed.")
+
+    def _expired(self) -> list:
+        """Items whose job began more than max_job_secs ago, called with the lock held."""
+        if self._max_job_secs is None:
+            return []
+        deadline = time.monotonic() - self._max_job_secs
+        return [item for item, began_at in self._items.items() if began_at is not None and began_at < deadline]
+
+    def stop(self) -> None:
+        """Stop the heartbeat and wait for it to exit."""
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,66 @@
+# the LeaseReaper Class
+
+import logging
+import threading
+
+from workqueue.rediswq import RedisWQ
+
+
+class LeaseReaper(threading.Thread):
+    """Background thread requeueing the jobs whose lease expired.
+
+    Any number of reapers can run on the same queue, e.g. one per worker:
+    they elect a leader through a redis key and only the leader reaps, every
+    `interval_secs`. When the leader dies, another reaper takes over within
+    `leader_ttl_secs`.
+    """
+
+    def __init__(self, wq: RedisWQ, interval_secs: float = 2, leader_ttl_secs: int = None) -> None:
+        """
+        Parameters
+        ----------
+        wq : RedisWQ
+            The work queue to reap.
+        interval_secs : float, optional
+            Time between two reaps.
+        leader_ttl_secs : int, optional
+            How long the leadership lasts without being extended, at least
+            three intervals by default.
+        """
+        super().__init__(name="lease-reaper", daemon=True)
+        self._wq = wq
+        self._interval_secs = interval_secs
+        self._leader_ttl_secs = leader_ttl_secs if leader_ttl_secs else max(10, int(3 * interval_secs) + 1)
+        self._stopped = threading.Event()
+        self._logger = logging.getLogger("reaper")
+
+    def reap(self) -> int:
+        """Requeue the expired jobs if this reaper is the leader.
+
+        Returns the number of jobs requeued.
+        """
+        if not self._wq.lead_reaper(self._leader_ttl_secs):
+            return 0
+        requeued = self._wq.check_expired_leases()
+        if requeued:
+            self._logger.info(f"Requeued {requeued} jobs with an expired lease.")
+        return requeued
+
+    def run(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.reap()
+                except Exception:
+                    self._logger.error("Exception while reaping expired leases.", exc_info=True)
+                self._stopped.wait(self._interval_secs)
+        finally:
+            try:
+                self._wq.resign_reaper()
+            except Exception:
+                self._logger.error("Exception while resigning the reaper leadership.", exc_info=True)
+
+    def stop(self) -> None:
+        """Stop the reaper and wait for it to exit."""
+        self._stopped.set()
+        self.join()
@@ -6,13 +6,286 @@ __author__ = "Tom Mong"
 __email__ = "u3556578@connect.hku.hk"
 
 
-import hashlib
+import json
 import logging
+import math
+import time
 import uuid
-from typing import Any
+from typing import Any, Dict, Iterable, List, Set
 
 import redis
 
+# Pushes a chunk of items (ARGV[2:]) to a lane (KEYS[1]). When the guard
+# (ARGV[1]) is on, the chunk is refused if the processing queue (KEYS[2]) and
+# every lane, the default one (KEYS[3]) and the others (KEYS[6:]), are empty.
+# Items pushed to another lane than the default one have their lane recorded
+# in KEYS[5], so that they are requeued to it, and the lane is registered in
+# KEYS[4].
+ADD_TASKS_SCRIPT = """
+if ARGV[1] == '1' then
+    local empty = redis.call('llen', KEYS[2]) == 0 and redis.call('llen', KEYS[3]) == 0
+    for i = 6, #KEYS do
+        if not empty then
+            break
+        end
+        empty = redis.call('llen', KEYS[i]) == 0
+    end
+    if empty then
+        return 0
+    end
+end
+local added = redis.call('rpush', KEYS[1], unpack(ARGV, 2))
+if KEYS[1] ~= KEYS[3] then
+    redis.call('sadd', KEYS[4], KEYS[1])
+    for i = 2, #ARGV do
+        redis.call('hset', KEYS[5], ARGV[i], KEYS[1])
+    end
+else
+    redis.call('hdel', KEYS[5], unpack(ARGV, 2))
+end
+return added
+"""
+
+# Moves up to ARGV[1] items from the lanes (KEYS[5:], the default one first)
+# to the processing queue (KEYS[1]) and leases them for ARGV[2] seconds on
+# behalf of session ARGV[3]: their lease deadline (ARGV[4] + ARGV[2]) is
+# recorded in the deadlines sorted set (KEYS[2]), the session and time of the
+# lease in KEYS[4].
+# The lanes are served by stride scheduling: each pick goes to the non-empty
+# lane with the lowest pass (kept in KEYS[3]), whose pass then grows by the
+# inverse of its weight (ARGV[5:] holds lane, weight pairs, 1 by default).
+# A lane's pass never lags behind the last pick, so an idle lane does not
+# build up credit.
+LEASE_MANY_SCRIPT = """
+local lanes = {}
+for i = 5, #KEYS do
+    lanes[#lanes + 1] = KEYS[i]
+end
+local weights = {}
+for i = 5, #ARGV, 2 do
+    weights[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+local vtime = tonumber(redis.call('hget', KEYS[3], 'vtime') or '0')
+
+local items = {}
+local deadline = tonumber(ARGV[4]) + tonumber(ARGV[2])
+for i = 1, tonumber(ARGV[1]) do
+    local best, best_pass
+    for _, lane in ipairs(lanes) do
+        if redis.call('llen', lane) > 0 then
+            local pass = math.max(tonumber(redis.call('hget', KEYS[3], lane) or '0'), vtime)
+            if best == nil or pass < best_pass then
+                best, best_pass = lane, pass
+            end
+        end
+    end
+    if best == nil then
+        break
+    end
+    local item = redis.call('rpoplpush', best, KEYS[1])
+    redis.call('zadd', KEYS[2], deadline, item)
+    redis.call('hset', KEYS[4], item, ARGV[3] .. ' ' .. ARGV[4])
+    items[#items + 1] = item
+    vtime = best_pass
+    redis.call('hset', KEYS[3], best, best_pass + 1 / (weights[best] or 1))
+end
+redis.call('hset', KEYS[3], 'vtime', vtime)
+return items
+"""
+
+# Leases the item ARGV[1], popped from a lane by a blocking pop, for ARGV[2]
+# seconds on behalf of session ARGV[3], as LEASE_MANY_SCRIPT does. Unless
+# ARGV[5] is set, i.e. the pop already moved it, the item is first pushed to
+# the processing queue (KEYS[1]).
+LEASE_POPPED_SCRIPT = """
+if ARGV[5] ~= '1' then
+    redis.call('lpush', KEYS[1], ARGV[1])
+end
+redis.call('zadd', KEYS[2], tonumber(ARGV[4]) + tonumber(ARGV[2]), ARGV[1])
+redis.call('hset', KEYS[3], ARGV[1], ARGV[3] .. ' ' .. ARGV[4])
+return ARGV[1]
+"""
+
+# Renews for ARGV[1] seconds the leases of the jobs ARGV[4:] that are still
+# held by session ARGV[2], i.e. leased by it (KEYS[2]) with a deadline in the
+# deadlines sorted set (KEYS[1]) that is not past ARGV[3]. Their deadline is
+# pushed back to ARGV[3] + ARGV[1].
+RENEW_LEASES_SCRIPT = """
+local renewed = {}
+local now = tonumber(ARGV[3])
+local deadline = now + tonumber(ARGV[1])
+for i = 4, #ARGV do
+    local job = ARGV[i]
+    local lease = redis.call('hget', KEYS[2], job) or ''
+    local expiry = tonumber(redis.call('zscore', KEYS[1], job) or '0')
+    if string.match(lease, '(%S+)') == ARGV[2] and expiry > now then
+        redis.call('zadd', KEYS[1], deadline, job)
+        renewed[#renewed + 1] = job
+    end
+end
+return renewed
+"""
+
+# Pops up to ARGV[2] jobs whose deadline in the deadlines sorted set (KEYS[1])
+# is past ARGV[1], i.e. whose lease expired. Each job is removed from the
+# processing queue (KEYS[2]) and pushed back to its lane, recorded in KEYS[5]
+# if it is one of the lanes given (KEYS[10:]), to the default one (KEYS[3])
+# otherwise, unless its retry count in KEYS[4] reached
+# ARGV[3]. In that case it is no longer pending (KEYS[6]) and is moved to the
+# dead-letter list (KEYS[7]), with its failure metadata in the hash KEYS[9]:
+# its lane, the session and time of its last lease (from KEYS[8]), its retry
+# count and when it was dead-lettered, JSON encoded.
+# Returns the number of jobs popped, requeued and dead-lettered.
+REQUEUE_EXPIRED_SCRIPT = """
+local now = tonumber(ARGV[1])
+local lanes = {}
+for i = 10, #KEYS do
+    lanes[KEYS[i]] = true
+end
+local jobs = redis.call('zrangebyscore', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+local requeued = 0
+local dead = 0
+for _, job in ipairs(jobs) do
+    redis.call('zrem', KEYS[1], job)
+    local lease = redis.call('hget', KEYS[8], job) or ''
+    redis.call('hdel', KEYS[8], job)
+    -- Expired jobs are the oldest ones, at the tail of the processing queue
+    if redis.call('lrem', KEYS[2], -1, job) > 0 then
+        local retries = tonumber(redis.call('hget', KEYS[4], job) or '0')
+        local lane = redis.call('hget', KEYS[5], job)
+        if not lanes[lane] then
+            lane = KEYS[3]
+        end
+        if retries + 1 > tonumber(ARGV[3]) then
+            local session, leased_at = string.match(lease, '(%S+) (%S+)')
+            redis.call('hset', KEYS[9], job, cjson.encode({
+                lane = lane,
+                session = session or '',
+                leased_at = leased_at or '',
+                retries = tostring(retries),
+                dead_at = tostring(now)}))
+            redis.call('rpush', KEYS[7], job)
+            redis.call('hdel', KEYS[4], job)
+            redis.call('hdel', KEYS[5], job)
+            redis.call('srem', KEYS[6], job)
+            dead = dead + 1
+        else
+            redis.call('rpush', lane, job)
+            redis.call('hincrby', KEYS[4], job, 1)
+            requeued = requeued + 1
+        end
+    end
+end
+return {#jobs, requeued, dead}
+"""
+
+# Pushes back to their lane (recorded in their failure metadata, KEYS[7], if
+# it is one of the lanes given in KEYS[8:], the default one KEYS[2] otherwise)
+# the jobs ARGV[2:] of the dead-letter list (KEYS[1]), or the first ARGV[1] of
+# them if none is given. Their retry count (KEYS[3])
+# starts over and they are pending (KEYS[4]) again. The lanes are recorded
+# as in ADD_TASKS_SCRIPT (KEYS[5], KEYS[6]).
+# Returns the number of jobs redriven.
+REDRIVE_SCRIPT = """
+local lanes = {}
+for i = 8, #KEYS do
+    lanes[KEYS[i]] = true
+end
+local jobs = {}
+if #ARGV > 1 then
+    for i = 2, #ARGV do
+        jobs[#jobs + 1] = ARGV[i]
+    end
+else
+    jobs = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+end
+local redriven = 0
+for _, job in ipairs(jobs) do
+    if redis.call('lrem', KEYS[1], 1, job) > 0 then
+        local meta = redis.call('hget', KEYS[7], job)
+        local lane = meta and cjson.decode(meta)['lane']
+        if not lanes[lane] then
+            lane = KEYS[2]
+        end
+        redis.call('hdel', KEYS[7], job)
+        redis.call('hdel', KEYS[3], job)
+        redis.call('sadd', KEYS[4], job)
+        redis.call('rpush', lane, job)
+        if lane ~= KEYS[2] then
+            redis.call('sadd', KEYS[5], lane)
+            redis.call('hset', KEYS[6], job, lane)
+        end
+        redriven = redriven + 1
+    end
+end
+return redriven
+"""
+
+# Pushes the due tasks ARGV[2:] to a lane (KEYS[1]), unless they are still
+# pending (KEYS[6]), i.e. queued or being worked on, and reschedules them at
+# ARGV[1] in the schedule sorted set (KEYS[5]). Lanes are recorded as in
+# ADD_TASKS_SCRIPT, the default one being KEYS[2].
+# Returns the number of tasks pushed.
+ENQUEUE_DUE_SCRIPT = """
+local enqueued = 0
+for i = 2, #ARGV do
+    redis.call('zadd', KEYS[5], ARGV[1], ARGV[i])
+    if redis.call('sadd', KEYS[6], ARGV[i]) == 1 then
+        redis.call('rpush', KEYS[1], ARGV[i])
+        if KEYS[1] ~= KEYS[2] then
+            redis.call('sadd', KEYS[3], KEYS[1])
+            redis.call('hset', KEYS[4], ARGV[i], KEYS[1])
+        end
+        enqueued = enqueued + 1
+    end
+end
+return enqueued
+"""
+
+# Adapts the cadence of task ARGV[1] (kept in KEYS[1], ARGV[3] by default) to
+# the ARGV[2] new items its last run found: it doubles when nothing was found,
+# halves when at least ARGV[7] items were found, and otherwise halves back
+# only if it is above the default. It is kept within [ARGV[4], ARGV[5]] and
+# the task is rescheduled (KEYS[2]) at ARGV[6] + cadence.
+# Returns the new cadence.
+RECORD_YIELD_SCRIPT = """
+local new_items = tonumber(ARGV[2])
+local default = tonumber(ARGV[3])
+local cadence = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or default)
+if new_items == 0 then
+    cadence = cadence * 2
+elseif new_items >= tonumber(ARGV[7]) or cadence > default then
+    cadence = cadence / 2
+end
+cadence = math.floor(math.min(math.max(cadence, tonumber(ARGV[4])), tonumber(ARGV[5])))
+redis.call('hset', KEYS[1], ARGV[1], cadence)
+redis.call('zadd', KEYS[2], tonumber(ARGV[6]) + cadence, ARGV[1])
+return cadence
+"""
+
+# Takes or extends for ARGV[2] seconds the leadership key (KEYS[1]) on behalf
+# of session ARGV[1]. Returns 1 if the session is the leader.
+LEAD_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# Deletes the leadership key (KEYS[1]) if it is held by session ARGV[1].
+RESIGN_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Name of the lane backed by the `name` list itself
+DEFAULT_LANE = "default"
+
 class RedisWQ(object):
     """Simple Finite Work Queue with Redis Backend
 
@@ -20,6 +293,9 @@ class RedisWQ(object):
     after workers start, the workers can detect when the queue
     is completely empty.
 
+    It can also be used continuously: items are scheduled, enqueued each
+    time they are due (see enqueue_due) and workers never exit.
+
     The items in the work queue are assumed to have unique values.
 
     This object is not intended to be used by multiple threads
@@ -29,7 +305,8 @@ class RedisWQ(object):
     https://kubernetes.io/docs/tasks/job/fine-parallel-processing-work-queue
     """
 
-    def __init__(self, name: str, max_retries: int = 2, **redis_kwargs: Any) -> None:
+    def __init__(self, name: str, max_retries: int = 2, lane_weights: Dict[str, float] = None,
+                 lane_refresh_secs: float = 5, **redis_kwargs: Any) -> None:
         """Redis worker queue instance
 
         The default connection parameters are:
@@ -46,6 +323,14 @@ class RedisWQ(object):
         max_retries : int, optional
             Number of times to retry a job before removing it from the queue.
             If you don't wish to retry jobs, set the limit to 0.
+        lane_weights : dict, optional
+            Share of the leases given to each lane (e.g. per lurker type or
+            priority) while it has work, relative to the others. Lanes not
+            listed have a weight of 1.
+        lane_refresh_secs : float, optional
+            How long the lanes registered by other clients are cached before
+            leasing reads them again. Scripts are given the lanes as keys, so
+            a new lane is served once the cache is refreshed.
         """
         redis_kwargs.update(decode_responses=True)
         self._db = redis.StrictRedis(**redis_kwargs)
@@ -57,17 +342,81 @@ class RedisWQ(object):
         self._main_q_key = name
         self._processing_q_key = name + ":processing"
         self._retry_hash_map_key = name + ":retries"
-        self._lease_key_prefix = name + ":leased_by_session:"
+        # Work can be split in lanes, served in a weighted fair way. The
+        # default lane is the main queue, the others are registered in a set.
+        self._lane_key_prefix = name + ":lane:"
+        self._lane_registry_key = name + ":lane_keys"
+        self._job_lanes_key = name + ":job_lanes"
+        self._lane_pass_key = name + ":lane_pass"
+        # In continuous mode, tasks are re-enqueued when they are due, unless
+        # they are still pending from their last run.
+        self._schedule_key = name + ":schedule"
+        self._pending_key = name + ":pending"
+        self._cadence_key = name + ":cadence"
+        # Session and time of the lease of each job being worked on. Jobs
+        # that exhausted their retries are kept aside with failure metadata,
+        # until they are redriven.
+        self._lease_info_key = name + ":lease_info"
+        self._dead_q_key = name + ":dead"
+        self._dead_meta_key = name + ":dead_meta"
+        self._lane_weights = [
+            (self._lane_key(lane), weight) for lane, weight in (lane_weights or {}).items()
+        ]
+        self._lane_refresh_secs = lane_refresh_secs
+        self._lanes = None
+        self._lanes_read_at = None
+        # Lease deadlines, scored by expiry time, so that the expired leases
+        # can be found without scanning the processing queue. Together with
+        # the lease info, they are the whole lease state: scripts only touch
+        # the keys they are given.
+        self._deadlines_key = name + ":deadlines"
+        self._orphan_scan_key = name + ":orphan_scan"
+        self._reaper_key = name + ":reaper"
         self._logger = logging.getLogger("rediswq")
         self._max_retries = max_retries
+        self._add_tasks_script = self._db.register_script(ADD_TASKS_SCRIPT)
+        self._lease_many_script = self._db.register_script(LEASE_MANY_SCRIPT)
+        self._lease_popped_script = self._db.register_script(LEASE_POPPED_SCRIPT)
+        self._renew_leases_script = self._db.register_script(RENEW_LEASES_SCRIPT)
+        self._requeue_expired_script = self._db.register_script(REQUEUE_EXPIRED_SCRIPT)
+        self._redrive_script = self._db.register_script(REDRIVE_SCRIPT)
+        self._enqueue_due_script = self._db.register_script(ENQUEUE_DUE_SCRIPT)
+        self._record_yield_script = self._db.register_script(RECORD_YIELD_SCRIPT)
+        self._lead_script = self._db.register_script(LEAD_SCRIPT)
+        self._resign_script = self._db.register_script(RESIGN_SCRIPT)
 
     def sessionID(self) -> str:
         """Return the ID for this session."""
         return self._session
 
+    def _lane_key(self, lane: str = None) -> str:
+        """Return the key of the list backing `lane`."""
+        if lane is None or lane == DEFAULT_LANE:
+            return self._main_q_key
+        return self._lane_key_prefix + lane
+
+    def _lane_keys(self, refresh: bool = False) -> List[str]:
+        """Return the keys of the lists backing the lanes, the default one
+        first: the registered lanes and those given a weight.
+
+        Scripts only touch the keys they are given, so the lanes are read
+        here and passed in. The registry is read again after
+        lane_refresh_secs, or right away if `refresh`."""
+        now = time.monotonic()
+        if refresh or self._lanes is None or now - self._lanes_read_at >= self._lane_refresh_secs:
+            lanes = set(self._db.smembers(self._lane_registry_key))
+            lanes.update(key for key, _ in self._lane_weights)
+            lanes.discard(self._main_q_key)
+            self._lanes = [self._main_q_key] + sorted(lanes)
+            self._lanes_read_at = now
+        return self._lanes
+
     def _main_qsize(self) -> int:
-        """Return the size of the main queue."""
-        return self._db.llen(self._main_q_key)
+        """Return the size of the main queue, all lanes included."""
+        pipe = self._db.pipeline(transaction=False)
+        for key in self._lane_keys(refresh=True):
+            pipe.llen(key)
+        return sum(pipe.execute())
 
     def _processing_qsize(self) -> int:
         """Return the size of the main queue."""
@@ -82,127 +431,94 @@ class RedisWQ(object):
         """
         return self._main_qsize() == 0 and self._processing_qsize() == 0
 
-    def _maybe_renew_job(self, job: str) -> None:
-        """Transactionally move job from the processing to the work queue.
+    def _scan_orphans(self, now: float, grace_secs: int) -> int:
+        """Give a deadline to the jobs of the processing queue that have none.
+
+        This happens when a client crashed between picking up a job and
+        recording its lease, or for jobs leased before deadlines were tracked.
+        They get `grace_secs` for the lease to show up before being requeued.
 
-        A job will not be renewed if it appears that another worker is
-        changing the processing queue or if the job has exceeded the
-        maximum number of retries.
+        Returns the number of jobs that had no deadline.
         """
-        self._logger.debug(
-            "Lease expired for job %s. Attempting to move from processing "
-            "queue to work queue...[session %s]" % (job, self.sessionID())
-        )
-        # A pipeline executes a set of commands as a transaction, but
-        # does not support rollback in the event any individual
-        # command fails.
-        pipe = self._db.pipeline(transaction=True)
-
-        # First, watch the processing queue and retry count hash map for
-        # changes. The pipeline transaction won't execute if changes occur
-        # after this point. This allows us to prevent duplicate updates from
-        # different workers.
-        pipe.watch(self._processing_q_key)
-        pipe.watch(self._retry_hash_map_key)
-
-        # Next, ensure that the job is still in the processing queue.
-        # The processing queue is relatively small, so this shouldn't
-        # be an expensive operation.
-        if job not in self._db.lrange(self._processing_q_key, 0, -1):
-            pipe.reset()
-            self._logger.debug(
-                "Job %s no longer in the processing queue, there is no need "
-                "to renew..." % job
-            )
-            return
-
-        # Next, check that we haven't exceeded the retry limit for this job
-        # If we have, remove the job from the queue entirely and don't add it
-        # back to the main work queue
-        retry_count = self.get_retry_number(job)
-        if retry_count + 1 > self._max_retries:
-            self._logger.debug(
-                "Job %s exceeded maximum retry count, attempting to remove "
-                "from the processing queue. [session %s]" % (job, self.sessionID())
-            )
-            pipe.multi()
-            pipe = pipe.lrem(self._processing_q_key, 0, job).hdel(
-                self._retry_hash_map_key, job
-            )
-            results = pipe.execute()
-            if results:
+        processing = self._db.lrange(self._processing_q_key, 0, -1)
+        if not processing:
+            return 0
+        pipe = self._db.pipeline(transaction=False)
+        for job in processing:
+            pipe.zadd(self._deadlines_key, {job: now + grace_secs}, nx=True)
+        return sum(pipe.execute())
+
+    def check_expired_leases(self, batch_size: int = 1000, orphan_scan_secs: int = 600,
+                             orphan_grace_secs: int = 60) -> int:
+        """Return to the work queue the jobs whose lease expired.
+
+        Only the jobs whose deadline is past are looked at, in batches of
+        `batch_size`, and each batch is requeued atomically. A job that
+        exceeded the maximum number of retries is removed from the queue
+        and moved to the dead-letter queue instead.
+
+        Once every `orphan_scan_secs` (across all the clients), the processing
+        queue is scanned for jobs without a deadline, e.g. because the client
+        crashed before creating their lease.
+
+        Returns the number of jobs moved back to the work queue.
+        """
+        now = time.time()
+        if self._db.set(self._orphan_scan_key, self._session, nx=True, ex=orphan_scan_secs):
+            orphans = self._scan_orphans(now, orphan_grace_secs)
+            if orphans:
                 self._logger.debug(
-                    "Job %s successfully removed from the processing "
-                    "queue due to too many retries. [session %s]"
-                    % (job, self.sessionID())
+                    "Found %d jobs without a lease deadline. [session %s]"
+                    % (orphans, self.sessionID())
                 )
-            else:
-                self._logger.debug(
-                    "Removing job %s was interrupted due to a change by a "
-                    "concurrent worker. [session %s]" % (job, self.sessionID())
+
+        lanes = self._lane_keys(refresh=True)[1:]
+        total_requeued = 0
+        while True:
+            popped, requeued, dead = self._requeue_expired_script(
+                keys=[self._deadlines_key, self._processing_q_key, self._main_q_key, self._retry_hash_map_key,
+                  self._job_lanes_key, self._pending_key, self._dead_q_key, self._lease_info_key,
+                  self._dead_meta_key] + lanes,
+                args=[now, batch_size, self._max_retries],
+            )
+            total_requeued += requeued
+            if dead:
+                self._logger.warning(
+                    "%d jobs exceeded maximum retry count and were moved to "
+                    "the dead-letter queue. [session %s]" % (dead, self.sessionID())
                 )
-            return
-
-        # Finally, execute the transaction to move the expired job
-        # back to the main queue and increment the retry counter by 1
-        pipe.multi()
-        pipe = (
-            pipe.lrem(self._processing_q_key, 0, job)
-            .rpush(self._main_q_key, job)
-            .hincrby(self._retry_hash_map_key, job, 1)
+            if popped < batch_size:
+                break
+        self._logger.debug(
+            "%d jobs moved from processing queue to work queue. [session %s]"
+            % (total_requeued, self.sessionID())
         )
-        results = pipe.execute()
-        if results:
-            self._logger.debug(
-                "Job %s successfully moved from processing queue to "
-                "work queue for retry attempt %d. [session %s]"
-                % (job, retry_count + 1, self.sessionID())
-            )
-        else:
-            self._logger.debug(
-                "Moving job %s was interrupted due to a change by a "
-                "concurrent worker. [session %s]" % (job, self.sessionID())
-            )
-        return
+        return total_requeued
+
+    def lead_reaper(self, ttl_secs: int = 10) -> bool:
+        """Try to become, or stay, the client reaping the expired leases.
 
-    def check_expired_leases(self) -> None:
-        """Return to the work queue
+        The leadership lasts `ttl_secs` unless it is extended by calling this
+        again, so another client takes over if the leader crashes.
 
-        If the lease key is not present for an item (it expired or was
-        never created because the client crashed before creating it)
-        then move the item back to the main queue so others can work on
-        it.
+        Returns True if this client is the leader.
         """
-        processing = self._db.lrange(self._processing_q_key, 0, -1)
-        for job in processing:
-            if not self._lease_exists(job):
-                try:
-                    self._maybe_renew_job(job)
-                except redis.exceptions.WatchError:
-                    self._logger.debug(
-                        "Watched variable changed while trying to renew lease "
-                        "for job %s. Skipping lease renew for now... "
-                        "[session %s]" % (job, self.sessionID())
-                    )
-                except Exception:
-                    self._logger.error(
-                        "Exception while renewing job %s. [session %s]"
-                        % (job, self.sessionID()),
-                        exc_info=True,
-                    )
-        return
-
-    def _itemkey(self, item: str) -> str:
-        """Returns a string that uniquely identifies an item (bytes)."""
-        return hashlib.sha224(item.encode("utf-8")).hexdigest()
+        return bool(self._lead_script(keys=[self._reaper_key], args=[self._session, ttl_secs]))
+
+    def resign_reaper(self) -> None:
+        """Give up the leadership of the reaping, if this client holds it."""
+        self._resign_script(keys=[self._reaper_key], args=[self._session])
 
     def _lease_exists(self, item: str) -> bool:
         """True if a lease on 'item' exists."""
-        return bool(self._db.exists(self._lease_key_prefix + self._itemkey(item)))
-
-    def lease(
-        self, lease_secs: int = 60, block: bool = True, timeout: int = None
-    ) -> bytes:
+        pipe = self._db.pipeline(transaction=False)
+        pipe.hexists(self._lease_info_key, item)
+        pipe.zscore(self._deadlines_key, item)
+        leased, deadline = pipe.execute()
+        return leased and deadline is not None and deadline > time.time()
+
+    def lease(self, lease_secs: int = 60, block: bool = True, timeout: int = None,
+              max_block_secs: int = 30) -> str:
         """Begin working on an item the work queue.
 
         Lease the item for lease_secs.  After that time, other
@@ -210,33 +526,83 @@ class RedisWQ(object):
         and pick up the item instead.
 
         If optional args block is true and timeout is None (the default), block
-        if necessary until an item is available."""
-        if block:
-            item = self._db.brpoplpush(
-                self._main_q_key, self._processing_q_key, timeout=timeout
-            )
+        if necessary until an item is available. The wait happens in redis, so
+        a new item is picked up as soon as it is pushed: a queue with the
+        default lane only uses BRPOPLPUSH, as the item must be moved to the
+        processing queue atomically (if the client crashes before recording
+        the lease, check_expired_leases finds it without a deadline). With
+        several lanes, BRPOP waits on all of them at once; redis cannot move
+        an item from one of several lists, so an item popped by a client that
+        dies before recording its lease is lost. The wait is cut in
+        slices of max_block_secs, so that lanes registered meanwhile are
+        waited on too."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            # Served by weight while there is work
+            items = self.lease_many(1, lease_secs=lease_secs)
+            if items:
+                return items[0]
+            if not block:
+                return None
+            wait = max_block_secs if deadline is None else min(max_block_secs, deadline - time.time())
+            if wait <= 0:
+                return None
+            item = self._lease_blocking(lease_secs, max(1, int(math.ceil(wait))))
+            if item is not None:
+                return item
+
+    def _lease_blocking(self, lease_secs: int, timeout: int) -> str:
+        """Wait up to timeout seconds for an item to be pushed to a lane,
+        and lease it. Returns None if none was."""
+        lanes = self._lane_keys(refresh=True)
+        if len(lanes) == 1:
+            item = self._db.brpoplpush(self._main_q_key, self._processing_q_key, timeout)
+            moved = True
         else:
-            item = self._db.rpoplpush(self._main_q_key, self._processing_q_key)
-        if item:
-            # Record that we (this session id) are working on a key. Expire
-            # that note after the lease timeout.
-            # Note: if we crash at this line of the program, then GC will see
-            # no lease for this item a later return it to the main queue.
-            itemkey = self._itemkey(item)
-            self._db.setex(self._lease_key_prefix + itemkey, lease_secs, self._session)
-        return item
+            popped = self._db.brpop(lanes, timeout)
+            item = popped[1] if popped else None
+            moved = False
+        if item is None:
+            return None
+        return self._lease_popped_script(
+            keys=[self._processing_q_key, self._deadlines_key, self._lease_info_key],
+            args=[item, lease_secs, self._session, time.time(), int(moved)],
+        )
+
+    def lease_many(self, n: int, lease_secs: int = 60) -> List[str]:
+        """Begin working on up to n items of the work queue.
+
+        The items are moved to the processing queue and leased for lease_secs
+        atomically, in a single round-trip. They are taken from the lanes
+        with work in proportion to the lane weights. This never blocks: an
+        empty list is returned if there is no work available right now."""
+        weights = [value for lane_weight in self._lane_weights for value in lane_weight]
+        return self._lease_many_script(
+            keys=[self._processing_q_key, self._deadlines_key, self._lane_pass_key, self._lease_info_key]
+            + self._lane_keys(),
+            args=[n, lease_secs, self._session, time.time()] + weights,
+        )
 
     def renew_lease(self, job: str, lease_secs: int = 60) -> bool:
         """Checks if the item is currently leased by this client
         and if so renews that lease by `lease_secs`
         Return false if the lease was already expired"""
 
-        key = self._lease_key_prefix + self._itemkey(job)
-        if self._db.get(key):
-            self._db.setex(key, lease_secs, self._session)
-            return True
-        else:
-            return False
+        return bool(self.renew_leases([job], lease_secs=lease_secs))
+
+    def renew_leases(self, jobs: Iterable[str], lease_secs: int = 60) -> List[str]:
+        """Renew by `lease_secs` the leases of the jobs still held by this
+        client, in a single round-trip.
+
+        Returns the jobs whose lease was renewed. The others already expired
+        (and may be worked on by another client) or were completed."""
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        return self._renew_leases_script(
+            keys=[self._deadlines_key, self._lease_info_key],
+            args=[lease_secs, self._session, time.time()] + jobs,
+        )
 
     def get_retry_number(self, job: str) -> int:
         """Return the number of retries for the given `job`.
@@ -261,13 +627,17 @@ class RedisWQ(object):
         other worker may have picked it up.  There is no indication
         of what happened.
         """
-        self._db.lrem(self._processing_q_key, 0, job)
-        self._db.hdel(self._retry_hash_map_key, job)
+        pipe = self._db.pipeline(transaction=False)
+        pipe.lrem(self._processing_q_key, 0, job)
+        pipe.hdel(self._retry_hash_map_key, job)
+        pipe.zrem(self._deadlines_key, job)
+        pipe.hdel(self._job_lanes_key, job)
+        pipe.hdel(self._lease_info_key, job)
+        pipe.srem(self._pending_key, job)
         # If we crash here, then the GC code will try to move the value, but
         # it will not be here, which is fine.  So this does not need to be a
         # transaction.
-        itemkey = self._itemkey(job)
-        self._db.delete(self._lease_key_prefix + itemkey, self._session)
+        pipe.execute()
 
     # DONE: add functions to clean up all keys associated with "name" when
     # processing is complete.
@@ -296,3 +666,140 @@ class RedisWQ(object):
             atomic_action.execute()
             print("[add_task] Queue has already been emptied")
             return False
+
+    def add_tasks(self, items: Iterable[str], chunk_size: int = 5000, guard_empty: bool = True,
+                  lane: str = None) -> int:
+        """Add many items to the queue, with one round-trip per chunk.
+
+        The items go to `lane`, the default lane if None.
+
+        Like add_task, a chunk is atomically refused if the queue is empty,
+        since other workers might think work is done and be in the process
+        of exiting. Set guard_empty to False to fill the queue before any
+        worker starts.
+
+        Returns the number of items added.
+        """
+        items = list(items)
+        # The other lanes, checked by the guard
+        lanes = self._lane_keys(refresh=True)[1:] if guard_empty else []
+        added = 0
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            if not self._add_tasks_script(
+                keys=[self._lane_key(lane), self._processing_q_key, self._main_q_key, self._lane_registry_key,
+                      self._job_lanes_key] + lanes,
+                args=[int(guard_empty)] + chunk,
+            ):
+                print("[add_tasks] Queue has already been emptied")
+                break
+            added += len(chunk)
+        return added
+
+    def schedule(self, items: Iterable[str], due: float = None) -> int:
+        """Schedule items to be enqueued at `due` (now by default) in
+        continuous mode. Items already scheduled keep their due time.
+
+        Returns the number of items newly scheduled.
+        """
+        items = list(items)
+        if not items:
+            return 0
+        due = time.time() if due is None else due
+        return self._db.zadd(self._schedule_key, {item: due for item in items}, nx=True)
+
+    def unschedule(self, items: Iterable[str]) -> int:
+        """Stop enqueueing items in continuous mode.
+
+        Returns the number of items unscheduled.
+        """
+        items = list(items)
+        if not items:
+            return 0
+        return self._db.zrem(self._schedule_key, *items)
+
+    def scheduled(self) -> List[str]:
+        """Return all the scheduled items."""
+        return self._db.zrange(self._schedule_key, 0, -1)
+
+    def due_tasks(self, now: float = None, limit: int = 1000) -> List[str]:
+        """Return up to `limit` scheduled items that are due by `now`."""
+        now = time.time() if now is None else now
+        return self._db.zrangebyscore(self._schedule_key, "-inf", now, start=0, num=limit)
+
+    def enqueue_due(self, items: Iterable[str], next_due: float, lane: str = None) -> int:
+        """Add due items to `lane` and reschedule them at `next_due`.
+
+        Unlike add_tasks, this never checks that the queue is not empty: the
+        workers of a continuous queue stay up waiting for work. An item still
+        pending from its last enqueue is only rescheduled, so a slow source
+        does not pile up duplicates.
+
+        Returns the number of items added.
+        """
+        items = list(items)
+        if not items:
+            return 0
+        return self._enqueue_due_script(
+            keys=[self._lane_key(lane), self._main_q_key, self._lane_registry_key, self._job_lanes_key,
+                  self._schedule_key, self._pending_key],
+            args=[next_due] + items,
+        )
+
+    def record_yield(self, job: str, new_items: int, cadence_secs: int = 3600, min_secs: int = 300,
+                     max_secs: int = 86400, busy_items: int = 5) -> int:
+        """Adapt how often `job` is run to the number of new items its last
+        run found, and reschedule it accordingly.
+
+        Quiet jobs back off exponentially up to `max_secs`, busy ones (at
+        least `busy_items` new items) speed up down to `min_secs`.
+        `cadence_secs` is the cadence of a job never recorded before.
+
+        Returns the new cadence of the job, in seconds.
+        """
+        return self._record_yield_script(
+            keys=[self._cadence_key, self._schedule_key],
+            args=[job, new_items, cadence_secs, min_secs, max_secs, time.time(), busy_items],
+        )
+
+    def not_due(self, items: Iterable[str], now: float = None) -> Set[str]:
+        """Return the items scheduled after `now`. Items that were never
+        scheduled are due."""
+        items = list(items)
+        now = time.time() if now is None else now
+        pipe = self._db.pipeline(transaction=False)
+        for item in items:
+            pipe.zscore(self._schedule_key, item)
+        return {item for item, due in zip(items, pipe.execute()) if due is not None and due > now}
+
+    def dead_letters(self, start: int = 0, end: int = -1) -> List[Dict[str, str]]:
+        """Return the jobs of the dead-letter queue, from `start` to `end`
+        (inclusive), with their failure metadata: lane, session and
+        leased_at of their last lease, retries and dead_at."""
+        jobs = self._db.lrange(self._dead_q_key, start, end)
+        if not jobs:
+            return []
+        metas = self._db.hmget(self._dead_meta_key, jobs)
+        return [dict(json.loads(meta) if meta else {}, job=job) for job, meta in zip(jobs, metas)]
+
+    def redrive(self, jobs: Iterable[str] = None, chunk_size: int = 1000) -> int:
+        """Move jobs of the dead-letter queue back to their lane, with their
+        retry count reset. All of them are redriven if `jobs` is None.
+
+        Returns the number of jobs redriven.
+        """
+        keys = [self._dead_q_key, self._main_q_key, self._retry_hash_map_key, self._pending_key,
+                self._lane_registry_key, self._job_lanes_key, self._dead_meta_key] + self._lane_keys(refresh=True)[1:]
+        redriven = 0
+        if jobs is None:
+            while True:
+                count = self._redrive_script(keys=keys, args=[chunk_size])
+                redriven += count
+                if count < chunk_size:
+                    return redriven
+        jobs = list(jobs)
+        for start in range(0, len(jobs), chunk_size):
+            redriven += self._redrive_script(
+                keys=keys, args=[chunk_size] + jobs[start:start + chunk_size]
+            )
+        return redriven
@@ -1,5 +1,7 @@
-from typing import List
+import math
+from typing import Dict, List, Set
 from workqueue.rediswq import RedisWQ
+from lurkers import LURKER_TYPES
 from utils.database_api import DbConn
 import logging
 from utils.general_utils import get_configs
@@ -46,14 +48,64 @@ def update_universe(universe_collection):
             logging.error(e.args)
 
 # DONE: Implement functions in RedisWQ module and test.
-def populate_wq(tickers: List[str], name: str):
+def populate_wq(tickers: List[str], name: str, lane: str = None):
     wq = RedisWQ(name=name, host=os.getenv("REDIS_SERVICE_HOST"))
     # Clean up the work queue.
     # wq.cleanup()
 
-    # Add the item to the work queue
-    for ticker in tickers:
-        wq.add_task(ticker)
+    # Skip the tasks whose last runs were quiet enough to back off past this run
+    not_due = wq.not_due(tickers)
+    tickers = [ticker for ticker in tickers if ticker not in not_due]
+    logger.info(f"Skipped {len(not_due)} tasks that are not due")
+
+    # Add the items to the work queue in bulk. The queue is expected to be
+    # empty here since the workers only start once this job is completed.
+    added = wq.add_tasks(tickers, guard_empty=False, lane=lane)
+    logger.info(f"Added {added} tasks to {name} (lane {lane})")
+
+def build_tasks(lurkers_collection: List[str], tickers: List[str], hours: int, hot_tickers: Set[str] = frozenset()) -> Dict[str, List[str]]:
+    """
+    Builds the work queue tasks of every lurker, grouped by lane.
+
+    Each lurker type has its own lane, so that every source progresses at once.
+    Tickers with a high news volume go to the 'hot' lane instead.
+    A ticker is split into the sub-tasks its lurker declares (see Lurker.shard_payload()).
+
+    Args:
+        lurkers_collection (List[str]): lurker types to give work to.
+        tickers (List[str]): the universe.
+        hours (int): how many hours back the lurkers that are not by ticker scrape.
+        hot_tickers (Set[str]): tickers of the 'hot' lane.
+
+    Returns:
+        Dict[str, List[str]]: lane -> tasks
+    """
+    lanes = {}
+    # For give the work to a specific type of lurker
+    for lurker in lurkers_collection:
+        # Each lurker will try to scrape the universe
+        print(f"Init for lurker type {lurker}")
+        if lurker == 'reddit':
+            payload = [ f"{lurker}:1-{offset}" for offset in range(hours) ]
+        elif lurker == 'eastmoney':
+            payload = [ f"{lurker}:1-{offset}" for offset in range(hours) ]
+        else:
+            payload = []
+            duration_days = max(1, math.ceil(hours / 24))
+            for ticker in tickers:
+                if lurker in LURKER_TYPES:
+                    shards = [ f"{lurker}:{shard}" for shard in LURKER_TYPES[lurker].shard_payload(ticker, duration_days) ]
+                else:
+                    shards = [ f"{lurker}:{ticker}" ]
+
+                if ticker in hot_tickers:
+                    lanes.setdefault('hot', []).extend(shards)
+                else:
+                    payload += shards
+
+        lanes.setdefault(lurker, []).extend(payload)
+
+    return lanes
 
 
 def main():
@@ -72,24 +124,14 @@ def main():
 
     days_to_scrape = int(os.environ['DURATION_DAYS'])
 
-    tasks = []
-    # For give the work to a specific type of lurker
-    for lurker in lurkers_collection:
-        # Each lurker will try to scrape the universe
-        print(f"Init for lurker type {lurker}")
-        if lurker == 'reddit':
-            duration = 24 * days_to_scrape
-            payload = [ f"{lurker}:1-{offset}" for offset in range(duration) ]
-        elif lurker == 'eastmoney':
-            duration = 24 * days_to_scrape
-            payload = [ f"{lurker}:1-{offset}" for offset in range(duration) ]
-        else:
-            payload = [ f"{lurker}:{ticker}" for ticker in tickers]
-        
-        tasks += payload
+    # Tickers with a high news volume go to their own, higher priority, lane
+    hot_tickers = set(config.get('hot_tickers') or [])
+
+    lanes = build_tasks(lurkers_collection, tickers, hours=24 * days_to_scrape, hot_tickers=hot_tickers)
 
-    print(len(tasks))
-    populate_wq(tasks, redis_wqs)
+    print(sum(len(tasks) for tasks in lanes.values()))
+    for lane, tasks in lanes.items():
+        populate_wq(tasks, redis_wqs, lane=lane)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()